@@ -0,0 +1,63 @@
+import argparse
+from typing import Dict, List
+
+from benchmarks import report
+
+
+def flatten(results: dict, prefix: str = '') -> Dict[str, float]:
+    """
+    Flattens nested results into name -> number
+
+    :param results: measured values, possibly nested
+    :param prefix: prefix of names
+    """
+    values = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix + name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + name] = value
+    return values
+
+
+def latest(records: List[dict]) -> Dict[str, dict]:
+    """ Returns the latest record of every benchmark """
+    return {record['benchmark']: record for record in records}
+
+
+def main() -> None:
+    """ Prints relative changes of results between two runs """
+    parser = argparse.ArgumentParser(description='compares results of netcalc benchmarks')
+    parser.add_argument('baseline', help='JSONL file of baseline results')
+    parser.add_argument('current', nargs='?', help='JSONL file of current results, baseline file if not given')
+    args = parser.parse_args()
+
+    if args.current is None:
+        # compare two latest runs of every benchmark in one file
+        records = report.load(args.baseline)
+        baseline, current = {}, {}
+        for record in records:
+            if record['benchmark'] in current:
+                baseline[record['benchmark']] = current[record['benchmark']]
+            current[record['benchmark']] = record
+    else:
+        baseline = latest(report.load(args.baseline))
+        current = latest(report.load(args.current))
+
+    for benchmark in sorted(baseline.keys() & current.keys()):
+        print(
+            benchmark + ': ' + str(baseline[benchmark]['environment']['commit']) + ' -> ' +
+            str(current[benchmark]['environment']['commit'])
+        )
+        old = flatten(baseline[benchmark]['results'])
+        new = flatten(current[benchmark]['results'])
+        for name in sorted(old.keys() & new.keys()):
+            change = (new[name] - old[name]) / old[name] * 100 if old[name] else 0.0
+            print(
+                '  ' + name.ljust(44) + format(old[name], '14.2f') + format(new[name], '14.2f') +
+                format(change, '+9.1f') + ' %'
+            )
+
+
+if __name__ == '__main__':
+    main()
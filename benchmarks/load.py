@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import random
+import socket
+import tempfile
+from threading import Barrier, Lock, Thread
+from time import perf_counter, perf_counter_ns, sleep
+from typing import List
+
+from benchmarks import report
+from client.embedded import EmbeddedConnection
+from client.pool import Connection
+from common import logger
+from common.Datagram import Datagram
+from common.protocol import LATEST_VERSION
+from common.transport import create_transport, UNIX_PREFIX
+from common.values import Status, Mode, Operation, LOCAL_HOST
+from server.metrics import Histogram
+
+# operation codes by their names [replayed files may use either]
+OPERATIONS = {Operation.name_from_code(code): code for code in range(4)}
+
+
+def generate(count: int, rng: random.Random) -> List[dict]:
+    """
+    Generates mix of calculations with arguments typical for every operation
+
+    :param count: number of requests
+    :param rng: random generator [seeded, so mix is reproducible]
+    :return: requests in replay format
+    """
+    requests = []
+    for _ in range(count):
+        operation = rng.randrange(4)
+        if operation == Operation.POWER:
+            a, b = rng.uniform(0.5, 10), rng.uniform(-20, 20)
+        elif operation == Operation.LOG:
+            a, b = rng.uniform(1.1, 100), rng.uniform(1, 1e6)
+        elif operation == Operation.GEO_MEAN:
+            a, b = rng.uniform(0, 1e6), rng.uniform(0, 1e6)
+        else:
+            a = rng.randint(0, 1000)
+            b = rng.randint(0, a)
+        requests.append({'operation': Operation.name_from_code(operation), 'a': float(a), 'b': float(b)})
+    return requests
+
+
+def read_requests(path: str) -> List[dict]:
+    """
+    Reads recorded requests, one JSON object per line:
+    {"operation": "power", "a": 2, "b": 10} for calculation [mode OPERATION is default],
+    {"mode": "QUERY_BY_RESULT_ID", "result_id": 5}, {"mode": "QUERY_BY_SESSION_ID"} or {"mode": "IS_ALIVE"}
+
+    :param path: JSONL file
+    """
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def write_requests(path: str, requests: List[dict]) -> None:
+    """
+    Saves requests in replay format
+
+    :param path: JSONL file
+    :param requests: requests to save
+    """
+    with open(path, 'w') as file:
+        for request in requests:
+            file.write(json.dumps(request) + '\n')
+
+
+def to_datagram(request: dict, session_id: int) -> Datagram:
+    """
+    Creates datagram of recorded request
+
+    :param request: request in replay format
+    :param session_id: session sending the request
+    """
+    mode = getattr(Mode, request.get('mode', 'OPERATION'))
+    operation = request.get('operation', 0)
+    if isinstance(operation, str):
+        operation = OPERATIONS[operation]
+    return Datagram(
+        Status.NEW, mode, session_id, operation,
+        request.get('a', 0.0), request.get('b', 0.0), result_id=request.get('result_id', 0)
+    )
+
+
+class LoadGenerator:
+    """ Sends requests to the server from many concurrent sessions
+
+    Every session is a thread with its own connection, which sends its share of requests one after another and
+    measures time from sending a request to receiving its last answer. All sessions start together.
+    """
+
+    def __init__(
+            self, host: str, port: int, sessions: int, protocol_version: int = LATEST_VERSION, server=None
+    ) -> None:
+        """
+        :param host: IP address of the server, or unix:path of its Unix domain socket
+        :param port: port number of the server
+        :param sessions: number of concurrent sessions
+        :param protocol_version: protocol version spoken by sessions
+        :param server: server running in this process to call without sockets [see EmbeddedConnection], host and
+        port are not used then
+        """
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.protocol_version = protocol_version
+        self.server = server
+        self.latencies = Histogram()
+        self.errors = 0
+        self.refused = 0
+        self.lock = Lock()
+
+    def run(self, requests: List[dict]) -> dict:
+        """
+        Sends requests, session n sends every sessions-th of them starting from n
+
+        :param requests: requests in replay format
+        :return: measured values
+        """
+        start = Barrier(self.sessions + 1)
+        threads = [
+            Thread(name='session_' + str(n), target=self.__session, args=(requests[n::self.sessions], start))
+            for n in range(self.sessions)
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - started
+
+        return {
+            'requests': self.latencies.count,
+            'errors': self.errors,
+            'refused': self.refused,
+            'seconds': elapsed,
+            'requests_per_second': self.latencies.count / elapsed if elapsed else 0.0,
+            'latency_us': report.latency_summary(self.latencies),
+            'peak_memory_bytes': report.peak_memory(),
+        }
+
+    def __session(self, requests: List[dict], start: Barrier) -> None:
+        """ Sends requests of one session """
+
+        if self.server is not None:
+            connection = EmbeddedConnection(self.server)
+        else:
+            connection = Connection(self.host, self.port, protocol_version=self.protocol_version)
+        datagrams = [[to_datagram(request, connection.session_id)] for request in requests]
+        latencies = Histogram()
+        errors = 0
+        refused = 0
+        start.wait()
+
+        for request in datagrams:
+            sent = perf_counter_ns()
+            answers = connection.request(request)
+            latencies.record(perf_counter_ns() - sent)
+            errors += sum(1 for answer in answers if answer.status == Status.ERROR)
+            refused += sum(1 for answer in answers if answer.status == Status.REFUSED)
+        connection.close()
+
+        # merge results of session
+        with self.lock:
+            self.latencies.merge(latencies)
+            self.errors += errors
+            self.refused += refused
+
+
+def free_port() -> int:
+    """ Returns port which is free at the moment """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((LOCAL_HOST, 0))
+        return s.getsockname()[1]
+
+
+def wait_for_server(host: str, port: int, timeout: float = 10) -> None:
+    """
+    Waits until server accepts connections
+
+    :param host: IP address of the server, or unix:path of its Unix domain socket
+    :param port: port number of the server
+    :param timeout: maximal time of waiting [s]
+    :raises ConnectionRefusedError: if server did not start in time
+    """
+    deadline = perf_counter() + timeout
+    transport = create_transport(host, port)
+    while True:
+        try:
+            transport.connect(timeout).close()
+            return
+        except (ConnectionRefusedError, FileNotFoundError):
+            if perf_counter() > deadline:
+                raise
+            sleep(0.05)
+
+
+def main() -> None:
+    """ Runs load test and prints its results """
+    # server engines are imported only here, they are not needed to load a remote server
+    from netcalc_server import ENGINES
+
+    parser = argparse.ArgumentParser(description='netcalc load generator')
+    parser.add_argument(
+        'host', nargs='?',
+        help='IP address of the server or unix:path of its Unix domain socket, local server is started if not given'
+    )
+    parser.add_argument('port', nargs='?', type=int, help='port number of the server')
+    parser.add_argument('--engine', choices=ENGINES.keys(), default='thread', help='engine of local server')
+    parser.add_argument(
+        '--transport', choices=('tcp', 'unix', 'embedded'), default='tcp',
+        help='how sessions reach local server: TCP, Unix domain socket or calls in this process without socket'
+    )
+    parser.add_argument('--sessions', type=int, default=8, help='number of concurrent sessions')
+    parser.add_argument('--requests', type=int, default=20000, help='number of generated requests')
+    parser.add_argument(
+        '--protocol', type=int, choices=(1, 2), default=LATEST_VERSION, help='protocol version spoken by sessions'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='seed of generated requests')
+    parser.add_argument('--replay', help='JSONL file of recorded requests to send instead of generated ones')
+    parser.add_argument('--record', help='JSONL file to save sent requests to, so the run can be replayed')
+    parser.add_argument('--output', help='JSONL file to append results to')
+    args = parser.parse_args()
+    if args.host is not None and args.transport != 'tcp':
+        parser.error('--transport chooses how to reach local server, address of remote one says it already')
+
+    requests = read_requests(args.replay) if args.replay else generate(args.requests, random.Random(args.seed))
+    if args.record:
+        write_requests(args.record, requests)
+
+    # logs of every request would measure stdout
+    logger.get_logger('calls').configure(logger.OFF)
+    logger.get_logger('main').configure(logger.WARNING)
+    logger.start()
+
+    server = None
+    host, port = args.host, args.port
+    if host is None:
+        host, port = LOCAL_HOST, free_port()
+        if args.transport == 'unix':
+            host = UNIX_PREFIX + os.path.join(tempfile.mkdtemp(), 'netcalc.sock')
+        server = ENGINES[args.engine](host, port)
+        server.start()
+        wait_for_server(host, port)
+
+    try:
+        embedded = server if args.transport == 'embedded' else None
+        results = LoadGenerator(host, port, args.sessions, args.protocol, embedded).run(requests)
+    finally:
+        if server is not None:
+            server.stop()
+            server.join()
+        logger.stop()
+
+    latency = results['latency_us']
+    print(
+        str(results['requests']) + ' requests in ' + format(results['seconds'], '.2f') + ' s, ' +
+        format(results['requests_per_second'], '.0f') + ' req/s, ' + str(results['errors']) + ' errors, ' +
+        str(results['refused']) + ' refused'
+    )
+    print('latency [us]: ' + ', '.join(name + ' ' + format(value, '.1f') for name, value in latency.items()))
+    print('peak memory: ' + format(results['peak_memory_bytes'] / 2 ** 20, '.1f') + ' MiB')
+
+    if args.output:
+        parameters = {
+            'engine': args.engine if server is not None else None,
+            'transport': args.transport if server is not None else None,
+            'sessions': args.sessions,
+            'protocol': args.protocol,
+            'requests': len(requests),
+            'seed': None if args.replay else args.seed,
+            'replay': args.replay,
+        }
+        report.save(args.output, 'load', parameters, results)
+
+
+if __name__ == '__main__':
+    main()
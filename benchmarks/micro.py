@@ -0,0 +1,129 @@
+import argparse
+import random
+import statistics
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks import report
+from common.Datagram import Datagram
+from common.protocol import Codec, ResultBlock, HEADER, BLOCK, VERSION_2
+from common.values import Status, Mode, Operation
+from server.cache import ResultCache
+from server.operations import calculate
+from server.vectorized import calculate_many, np
+
+
+def measure(function: Callable[[], object], number: int, repeat: int) -> Dict[str, float]:
+    """
+    Measures time of one call
+
+    :param function: measured function without arguments
+    :param number: number of calls in one measurement
+    :param repeat: number of measurements
+    :return: median and minimum time of one call [ns] and calls per second of the median
+    """
+    times = [total / number * 1e9 for total in timeit.Timer(function).repeat(repeat, number)]
+    median = statistics.median(times)
+    return {'ns_per_call': median, 'ns_per_call_min': min(times), 'calls_per_second': 1e9 / median}
+
+
+def random_datagram(rng: random.Random) -> Datagram:
+    """ Creates datagram with random fields, special numbers included """
+    def number() -> float:
+        return rng.choice([rng.uniform(-1e6, 1e6), rng.random(), 0.0, -0.0, float('inf'), 1e308, -5e-324])
+
+    return Datagram(
+        rng.randrange(4), rng.randrange(8), rng.randrange(1 << 16), rng.randrange(4),
+        number(), number(), number(), rng.randrange(1 << 32), rng.random() < 0.5
+    )
+
+
+def check_codec(count: int, seed: int) -> None:
+    """
+    Checks that fast codec gives the same results as the bitstring reference
+
+    :param count: number of random datagrams
+    :param seed: seed of random generator
+    :raises AssertionError: on first difference
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        datagram = random_datagram(rng)
+        binary = datagram.get_bytes()
+        assert binary == datagram.get_bytes_reference(), vars(datagram)
+        decoded = Datagram.from_bytes(binary)
+        reference = Datagram.from_bytes_reference(binary)
+        assert Datagram.get_bytes(decoded) == Datagram.get_bytes(reference), vars(datagram)
+    print('codec matches reference on ' + str(count) + ' datagrams')
+
+
+def cases() -> List[Tuple[str, Callable[[], object]]]:
+    """ Returns (name, function) of every benchmark """
+
+    datagram = Datagram(Status.OK, Mode.OPERATION, 1234, Operation.POWER, 2.5, -3.75, 12.5, 987654, True)
+    binary = datagram.get_bytes()
+    view = memoryview(bytearray(binary))
+
+    cache = ResultCache()
+    cache.put(Operation.POWER, 2.0, 10.0, (1024.0, None))
+
+    rng = random.Random(1)
+    batch = [(rng.randrange(4), float(rng.randint(1, 50)), float(rng.randint(0, 20))) for _ in range(1024)]
+
+    codec = Codec()
+    codec.upgrade(VERSION_2, 1)
+    page = [(operation, a, b, 1, rng.uniform(0, 1e6), 100 + 2 * i) for i, (operation, a, b) in enumerate(batch)]
+    frame = codec.encode(ResultBlock.from_results(1, page))
+    header, payload = frame[:HEADER.size], frame[HEADER.size:HEADER.size + BLOCK.size]
+    body = frame[HEADER.size + BLOCK.size:]
+
+    benchmarks = [
+        ('codec.from_bytes', lambda: Datagram.from_bytes(binary)),
+        ('codec.from_bytes_memoryview', lambda: Datagram.from_bytes(view)),
+        ('codec.get_bytes', datagram.get_bytes),
+        ('codec.peek_header', lambda: Datagram.peek_header(binary)),
+        ('codec.from_bytes_reference', lambda: Datagram.from_bytes_reference(binary)),
+        ('codec.get_bytes_reference', datagram.get_bytes_reference),
+        ('operation.power', lambda: calculate(Operation.POWER, 1.0001, 2500.5)),
+        ('operation.log', lambda: calculate(Operation.LOG, 3.0, 1234.5)),
+        ('operation.geo_mean', lambda: calculate(Operation.GEO_MEAN, 12.5, 1e6)),
+        ('operation.bin_coe_small', lambda: calculate(Operation.BIN_COE, 60.0, 30.0)),
+        ('operation.bin_coe_large', lambda: calculate(Operation.BIN_COE, 1e6, 5e5)),
+        ('operation.error', lambda: calculate(Operation.LOG, -1.0, 2.0)),
+        ('cache.hit', lambda: cache.get(Operation.POWER, 2.0, 10.0)),
+        ('batch.calculate_many_1024', lambda: calculate_many(batch)),
+        ('batch.result_block_encode_1024', lambda: codec.encode(ResultBlock.from_results(1, page))),
+        ('batch.result_block_decode_1024', lambda: codec.decode(header, payload, body)),
+    ]
+    return benchmarks
+
+
+def main() -> None:
+    """ Runs benchmarks and prints their results """
+    parser = argparse.ArgumentParser(description='netcalc micro benchmarks')
+    parser.add_argument('--number', type=int, default=20000, help='number of calls in one measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='number of measurements of every benchmark')
+    parser.add_argument('--filter', default='', help='run only benchmarks whose name contains this text')
+    parser.add_argument('--output', help='JSONL file to append results to')
+    parser.add_argument('--check', action='store_true', help='check fast codec against the reference first')
+    args = parser.parse_args()
+
+    if args.check:
+        check_codec(20000, 0)
+
+    results = {}
+    for name, function in cases():
+        if args.filter not in name:
+            continue
+        # whole batches are much slower than single calls
+        number = max(args.number // 1000, 10) if name.startswith('batch.') else args.number
+        results[name] = measure(function, number, args.repeat)
+        print(name.ljust(32) + format(results[name]['ns_per_call'], '12.1f') + ' ns/call')
+
+    if args.output:
+        parameters = {'number': args.number, 'repeat': args.repeat, 'numpy': np is not None}
+        report.save(args.output, 'micro', parameters, results)
+
+
+if __name__ == '__main__':
+    main()
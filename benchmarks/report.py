@@ -0,0 +1,75 @@
+import json
+import platform
+import resource
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from server.metrics import Histogram
+
+# quantiles reported for latencies
+QUANTILES = {'p50': 0.5, 'p99': 0.99, 'p999': 0.999}
+
+
+def environment() -> dict:
+    """ Returns description of the environment, so results of different commits and machines can be told apart """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+    }
+
+
+def peak_memory() -> int:
+    """ Returns peak resident memory of the process [B] """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def latency_summary(histogram: Histogram) -> Dict[str, float]:
+    """
+    Summarizes latencies recorded in ns
+
+    :param histogram: histogram of latencies
+    :return: quantiles, mean and max in microseconds
+    """
+    summary = {name: histogram.quantile(q) / 1e3 for name, q in QUANTILES.items()}
+    summary['mean'] = histogram.total / histogram.count / 1e3 if histogram.count else 0.0
+    summary['max'] = histogram.max / 1e3
+    return summary
+
+
+def save(path: str, benchmark: str, parameters: dict, results: dict) -> None:
+    """
+    Appends results of a run to JSONL file
+
+    :param path: file of results
+    :param benchmark: name of benchmark
+    :param parameters: parameters of the run
+    :param results: measured values
+    """
+    record = {'benchmark': benchmark, 'environment': environment(), 'parameters': parameters, 'results': results}
+    with open(path, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+def load(path: str) -> List[dict]:
+    """
+    Reads results saved with save
+
+    :param path: file of results
+    :return: records in order of saving
+    """
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
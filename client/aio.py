@@ -0,0 +1,247 @@
+import asyncio
+from collections import deque
+from typing import List, Tuple
+
+from common import utils
+from common.Datagram import Datagram
+from common.protocol import Codec, ResultBlock, VERSION_1, LATEST_VERSION
+from common.transport import create_transport
+from common.values import Status, Mode
+
+
+class AsyncClient:
+    """ Programmatic asyncio client of netcalc
+
+    Requests are pipelined: many of them can be outstanding on one connection at once. Server answers requests of
+    a connection in order, every request ends with an answer with last flag set, so answers are matched to callers
+    by keeping their futures in a queue. Requests made in the same loop iteration are sent with one write.
+    Heartbeats are sent in the background as ordinary pipelined requests, so they never block calls.
+
+    Usage:
+        async with AsyncClient(host, port) as client:
+            answers = await asyncio.gather(*(client.compute(Operation.POWER, 2, n) for n in range(100)))
+    """
+
+    def __init__(
+            self, host: str, port: int, heartbeat_interval: float = 1.0, max_in_flight: int = 4096,
+            protocol_version: int = LATEST_VERSION
+    ) -> None:
+        """
+        :param host: IP address of the server, or unix:path of its Unix domain socket
+        :param port: port number of the server
+        :param heartbeat_interval: time between IS_ALIVE requests asked from the server [s], server may grant shorter
+        :param max_in_flight: maximal number of outstanding requests, further calls wait
+        :param protocol_version: highest protocol version to speak [server may grant lower]
+        """
+        self.host = host
+        self.port = port
+        self.transport = create_transport(host, port)
+        self.heartbeat_interval = heartbeat_interval
+        self.protocol_version = protocol_version
+        self.codec = Codec()
+        self.session_id = 0
+        self.connected = False
+
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+        # (future, datagrams) of outstanding requests in order of sending and answers received for the first of them
+        self.waiting = deque()
+        self.answers: List[Datagram] = []
+        # data of requests waiting for write
+        self.outgoing = bytearray()
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+
+        self.receiver: asyncio.Task = None
+        self.heartbeat: asyncio.Task = None
+
+    async def __aenter__(self) -> 'AsyncClient':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def connect(self) -> None:
+        """ Connects to the server and opens session """
+
+        self.reader, self.writer = await self.transport.open_connection()
+        self.receiver = asyncio.create_task(self.__receive())
+
+        datagram = Datagram(Status.NEW, Mode.CONNECT, a=self.heartbeat_interval, b=self.protocol_version)
+        answer = (await self.request([datagram]))[0]
+        if answer.status != Status.OK:
+            await self.__abort(ConnectionRefusedError('server refused to connect'))
+            raise ConnectionRefusedError('server refused to connect')
+
+        self.session_id = answer.session_id
+        # use interval granted by the server [older servers do not send it]
+        if answer.a > 0:
+            self.heartbeat_interval = answer.a
+        self.connected = True
+        self.heartbeat = asyncio.create_task(self.__keep_alive())
+        utils.log('connected to : ' + str(self.transport))
+
+    async def close(self) -> None:
+        """ Closes session and connection """
+
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        if self.connected:
+            self.connected = False
+            try:
+                await self.request([Datagram(Status.NEW, Mode.DISCONNECT, self.session_id)])
+            except ConnectionError:
+                pass
+        await self.__abort(ConnectionAbortedError('client closed'))
+
+    async def compute(self, operation: int, a: float, b: float) -> Datagram:
+        """
+        Makes calculation
+
+        :param operation: operation code
+        :param a: number a
+        :param b: number b
+        :return: answer, status ERROR with error code in a if calculation failed
+        """
+        return (await self.request([Datagram(Status.NEW, Mode.OPERATION, self.session_id, operation, a, b)]))[0]
+
+    async def compute_many(self, operations: List[Tuple[int, float, float]]) -> List[Datagram]:
+        """
+        Makes batch of calculations in one request
+
+        :param operations: list of (operation code, a, b)
+        :return: answers in order of operations
+        """
+        if not operations:
+            return []
+        datagrams = [
+            Datagram(Status.NEW, Mode.OPERATION, self.session_id, operation, a, b, last=False)
+            for operation, a, b in operations
+        ]
+        datagrams[-1].last = True
+        return await self.request(datagrams)
+
+    async def query_by_result_id(self, result_id: int) -> Datagram:
+        """
+        Gets one result of the session
+
+        :param result_id: id of result
+        :return: answer of the server
+        """
+        datagram = Datagram(Status.NEW, Mode.QUERY_BY_RESULT_ID, self.session_id, result_id=result_id)
+        return (await self.request([datagram]))[0]
+
+    async def query_by_session_id(self, after_result_id: int = 0) -> List[Datagram]:
+        """
+        Gets results of the session
+
+        :param after_result_id: get only results with greater id
+        :return: answers of the server
+        """
+        datagram = Datagram(Status.NEW, Mode.QUERY_BY_SESSION_ID, self.session_id, result_id=after_result_id)
+        return await self.request([datagram])
+
+    async def query_result_blocks(self, after_result_id: int = 0) -> List[ResultBlock]:
+        """
+        Gets results of the session in blocks [see ResultBlock]
+
+        :param after_result_id: get only results with greater id
+        :return: blocks in order of result ids, empty if session has no results
+        """
+        if self.codec.version == VERSION_1:
+            # server speaking version 1 sends datagram per result
+            answers = await self.query_by_session_id(after_result_id)
+            answers = [answer for answer in answers if answer.status == Status.OK]
+            return [ResultBlock.from_datagrams(answers)] if answers else []
+        datagram = Datagram(Status.NEW, Mode.RESULT_BLOCK, self.session_id, result_id=after_result_id)
+        return [answer for answer in await self.request([datagram]) if answer.status == Status.OK]
+
+    async def request(self, datagrams: List[Datagram]) -> List[Datagram]:
+        """
+        Sends request and waits for its answers
+
+        :param datagrams: datagrams of the request, last flag of the final one ends the request
+        :return: answers of the server
+        """
+        async with self.in_flight:
+            if self.writer is None or self.writer.is_closing():
+                raise ConnectionAbortedError('not connected')
+
+            future = asyncio.get_running_loop().create_future()
+            self.waiting.append((future, datagrams))
+            # write requests of this loop iteration together
+            if not self.outgoing:
+                asyncio.get_running_loop().call_soon(self.__flush)
+            correlation_id = self.codec.next_correlation_id()
+            for datagram in datagrams:
+                datagram.correlation_id = correlation_id
+                self.outgoing += self.codec.encode(datagram)
+
+            return await future
+
+    def __flush(self) -> None:
+        """ Writes requests gathered in this loop iteration """
+        if self.outgoing and not self.writer.is_closing():
+            self.writer.write(bytes(self.outgoing))
+        self.outgoing.clear()
+
+    async def __receive(self) -> None:
+        """ Receives answers and passes them to waiting callers """
+
+        try:
+            while True:
+                header = await self.reader.readexactly(self.codec.header_size)
+                size = self.codec.payload_size(header)
+                payload = await self.reader.readexactly(size) if size else b''
+                size = self.codec.body_size(header, payload)
+                answer = self.codec.decode(header, payload, await self.reader.readexactly(size) if size else b'')
+                self.answers.append(answer)
+                if answer.last:
+                    answers, self.answers = self.answers, []
+                    future, datagrams = self.waiting[0]
+                    answers = self.codec.fill_in(answers, datagrams)
+                    self.waiting.popleft()
+                    if answer.mode == Mode.CONNECT and answer.status == Status.OK:
+                        # switch to protocol version granted by the server before reading next answer [older
+                        # servers grant none, so version 1 is kept]
+                        self.codec.upgrade(int(answer.b), answer.session_id)
+                    if not future.done():
+                        future.set_result(answers)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.__fail_waiting(ConnectionResetError('connection lost: ' + str(e)))
+        except (IndexError, ValueError):
+            self.__fail_waiting(ConnectionAbortedError('unexpected answer from server'))
+
+    async def __keep_alive(self) -> None:
+        """ Checks periodically if server still keeps the session """
+
+        while self.connected:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                answer = (await self.request([Datagram(Status.NEW, Mode.IS_ALIVE, self.session_id)]))[0]
+            except ConnectionError:
+                answer = None
+            if answer is None or answer.status != Status.OK:
+                utils.log('server rejected session')
+                self.connected = False
+                await self.__abort(ConnectionAbortedError('server rejected session'))
+
+    async def __abort(self, error: Exception) -> None:
+        """ Closes connection, failing outstanding requests """
+
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self.receiver is not None and self.receiver is not asyncio.current_task():
+            self.receiver.cancel()
+        self.__fail_waiting(error)
+
+    def __fail_waiting(self, error: Exception) -> None:
+        """ Fails all outstanding requests """
+        while self.waiting:
+            future, _ = self.waiting.popleft()
+            if not future.done():
+                future.set_exception(error)
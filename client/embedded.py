@@ -0,0 +1,56 @@
+from typing import List
+
+from client.pool import Connection
+from common.Datagram import Datagram
+from common.protocol import LATEST_VERSION
+
+
+class EmbeddedConnection(Connection):
+    """ Session with a server running in the same process, without any socket
+
+    Requests go straight to the request dispatcher of the server [Server.handle_embedded, run on the event loop of
+    AsyncServer] and its answers come back as datagrams, so a calculation costs neither system calls nor encoding.
+    Otherwise the session behaves as over a connection: it gets a session id in CONNECT, its results are stored and
+    queried the same way, admission control and heartbeats apply to it [caller idle for longer than three intervals
+    has to call is_alive], and a session closed by the server [idle, or server stopped] fails further requests with
+    ConnectionAbortedError.
+
+    Usage:
+        server = Server(LOCAL_HOST, PORT)
+        server.start()
+        connection = EmbeddedConnection(server)
+        answer = connection.compute(Operation.POWER, 2, 10)
+    """
+
+    def __init__(self, server, heartbeat_interval: float = 1.0) -> None:
+        """
+        Opens session in the server
+
+        :param server: server running in this process [engine thread or async]
+        :param heartbeat_interval: time between IS_ALIVE requests asked from the server [s]
+        :raises ConnectionRefusedError: if server refused to open session
+        :raises ConnectionAbortedError: if server is stopped
+        """
+        self.server = server
+        server.open_embedded(self)
+        try:
+            self.open_session(heartbeat_interval, LATEST_VERSION)
+        except ConnectionAbortedError:
+            server.close_embedded(self)
+            raise
+
+    def exchange(self, datagrams: List[Datagram]) -> List[Datagram]:
+        """
+        Passes request to the server and returns its answers [answers are not encoded, codec only keeps version
+        granted by the server]
+
+        :param datagrams: datagrams of the request
+        :return: answers of the server
+        :raises ConnectionAbortedError: if session was closed by the server
+        """
+        answers, self.session_id = self.server.handle_embedded(self, self.session_id, datagrams)
+        return answers
+
+    def close_transport(self) -> None:
+        """ Forgets the session in the server """
+        self.server.close_embedded(self, self.session_id)
@@ -0,0 +1,362 @@
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Event, Lock, Thread
+from time import monotonic
+from typing import Iterator, List, Tuple
+
+from common import utils
+from common.Datagram import Datagram
+from common.framing import FrameReader, FrameWriter
+from common.protocol import Codec, LATEST_VERSION
+from common.transport import create_transport
+from common.values import Status, Mode
+
+
+class Connection:
+    """ Blocking session with the server, used by one caller at a time """
+
+    def __init__(
+            self, host: str, port: int, timeout: float = 5, heartbeat_interval: float = 1.0,
+            protocol_version: int = LATEST_VERSION
+    ) -> None:
+        """
+        Connects to the server and opens session
+
+        :param host: IP address of the server, or unix:path of its Unix domain socket
+        :param port: port number of the server
+        :param timeout: timeout of connecting and of waiting for answers [s]
+        :param heartbeat_interval: time between IS_ALIVE requests asked from the server [s]
+        :param protocol_version: highest protocol version to speak [server may grant lower]
+        :raises ConnectionRefusedError: if server refused to open session
+        """
+        self.socket = create_transport(host, port).connect(timeout)
+        self.reader = FrameReader(self.socket)
+        self.writer = FrameWriter(self.socket)
+        self.open_session(heartbeat_interval, protocol_version)
+
+    def open_session(self, heartbeat_interval: float, protocol_version: int) -> None:
+        """
+        Opens session and adopts settings granted by the server [state of session is set up here for all transports]
+
+        :param heartbeat_interval: time between IS_ALIVE requests asked from the server [s]
+        :param protocol_version: highest protocol version to speak
+        :raises ConnectionRefusedError: if server refused to open session
+        """
+        self.codec = Codec()
+        self.session_id = 0
+        # time of return to the pool [heartbeats do not count as use]
+        self.last_used = monotonic()
+        # time of the last request of any kind and lock held for the time of request [see keep_alive]
+        self.last_request = monotonic()
+        self.lock = Lock()
+        # whether request failed half way [answers may be half read], so connection cannot be used any more
+        self.broken = False
+
+        answer = self.request([Datagram(Status.NEW, Mode.CONNECT, a=heartbeat_interval, b=protocol_version)])[0]
+        if answer.status != Status.OK:
+            self.close_transport()
+            raise ConnectionRefusedError('server refused to connect')
+        self.session_id = answer.session_id
+        # interval and protocol version granted by the server [older servers send neither]
+        self.heartbeat_interval = answer.a if answer.a > 0 else heartbeat_interval
+        self.codec.upgrade(int(answer.b), self.session_id)
+
+    def request(self, datagrams: List[Datagram]) -> List[Datagram]:
+        """
+        Sends request and receives its answers
+
+        :param datagrams: datagrams of the request, last flag of the final one ends the request
+        :return: answers of the server
+        :raises OSError: if connection failed, it is marked as broken then
+        :raises ValueError: if answer could not be read, connection is marked as broken then
+        """
+        with self.lock:
+            self.last_request = monotonic()
+            try:
+                return self.exchange(datagrams)
+            except (OSError, ValueError):
+                self.broken = True
+                raise
+
+    def keep_alive(self, interval: float) -> None:
+        """
+        Sends heartbeat if connection was quiet for interval and no request is in progress
+
+        Called by the pool for leased connections, so session of a caller which holds connection without using it is
+        not closed as idle. Connection which fails the heartbeat is closed, so the caller gets connection error.
+
+        :param interval: time without request after which heartbeat is sent [s]
+        """
+        if monotonic() - self.last_request < interval or not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.last_request = monotonic()
+            self.exchange([Datagram(Status.NEW, Mode.IS_ALIVE, self.session_id)])
+        except (OSError, ValueError):
+            self.broken = True
+            self.close_transport()
+        finally:
+            self.lock.release()
+
+    def compute(self, operation: int, a: float, b: float) -> Datagram:
+        """
+        Makes calculation
+
+        :param operation: operation code
+        :param a: number a
+        :param b: number b
+        :return: answer, status ERROR with error code in a if calculation failed
+        """
+        return self.request([Datagram(Status.NEW, Mode.OPERATION, self.session_id, operation, a, b)])[0]
+
+    def compute_many(self, operations: List[Tuple[int, float, float]]) -> List[Datagram]:
+        """
+        Makes batch of calculations in one round trip
+
+        :param operations: list of (operation code, a, b)
+        :return: answers in order of operations
+        """
+        if not operations:
+            return []
+        datagrams = [
+            Datagram(Status.NEW, Mode.OPERATION, self.session_id, operation, a, b, last=False)
+            for operation, a, b in operations
+        ]
+        datagrams[-1].last = True
+        return self.request(datagrams)
+
+    def is_alive(self) -> bool:
+        """ Checks if server still keeps the session """
+        try:
+            return self.request([Datagram(Status.NEW, Mode.IS_ALIVE, self.session_id)])[0].status == Status.OK
+        except (OSError, ValueError):
+            return False
+
+    def close(self) -> None:
+        """ Closes session and connection """
+        try:
+            self.request([Datagram(Status.NEW, Mode.DISCONNECT, self.session_id)])
+        except (OSError, ValueError):
+            pass
+        self.close_transport()
+
+    def close_transport(self) -> None:
+        """ Closes the connection [session is left to the server] """
+        self.socket.close()
+
+    def exchange(self, datagrams: List[Datagram]) -> List[Datagram]:
+        """
+        Sends request over the connection and receives its answers [lock has to be held]
+
+        :param datagrams: datagrams of the request
+        :return: answers of the server
+        """
+        correlation_id = self.codec.next_correlation_id()
+        for datagram in datagrams:
+            datagram.correlation_id = correlation_id
+            self.writer.write(self.codec.encode(datagram))
+        self.writer.flush()
+
+        answers = []
+        while not answers or not answers[-1].last:
+            answers.append(self.codec.read(self.reader))
+        return self.codec.fill_in(answers, datagrams)
+
+
+class ClientPool:
+    """ Pool of open sessions with the server
+
+    Keeps warm connections with sessions already opened and leases them to callers, so a calculation does not pay
+    for TCP handshake and CONNECT. One heartbeat thread checks idle connections of the whole pool: sessions which
+    fail IS_ALIVE are replaced, connections idle for longer than idle_timeout are closed [down to min_idle]. Leased
+    connections quiet for heartbeat interval get IS_ALIVE too, so the server does not close sessions of callers
+    holding a connection without using it.
+
+    Usage:
+        with pool.lease() as connection:
+            answer = connection.compute(Operation.POWER, 2, 10)
+    """
+
+    def __init__(
+            self, host: str, port: int,
+            max_size: int = 16, min_idle: int = 0, max_idle: int = 8,
+            idle_timeout: float = 60, heartbeat_interval: float = 1.0, timeout: float = 5
+    ) -> None:
+        """
+        :param host: IP address of the server, or unix:path of its Unix domain socket
+        :param port: port number of the server
+        :param max_size: maximal number of connections, leased and idle
+        :param min_idle: number of idle connections kept open regardless of idle_timeout
+        :param max_idle: maximal number of idle connections, more are closed on release
+        :param idle_timeout: time after which unused connection is closed [s]
+        :param heartbeat_interval: time between checks of idle connections [s], lowered if server grants shorter
+        :param timeout: timeout of connecting and of waiting for answers [s]
+        """
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+
+        # idle connections, most recently used last
+        self.idle = deque()
+        # leased connections and number of all open connections [leased, idle and being checked]
+        self.leased = set()
+        self.size = 0
+        self.available = Condition()
+
+        self.replaced = 0
+        self.expired = 0
+
+        self.closed = Event()
+        self.heartbeat = Thread(name='pool_heartbeat', target=self.__keep_alive, daemon=True)
+        self.heartbeat.start()
+
+    @contextmanager
+    def lease(self, timeout: float = None) -> Iterator[Connection]:
+        """
+        Leases connection for the time of with block
+
+        Connection whose request failed during the block [see Connection.broken] is discarded instead of returned to
+        the pool, errors of the caller itself do not affect the connection.
+
+        :param timeout: maximal time of waiting for free connection [s], None for no limit
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def acquire(self, timeout: float = None) -> Connection:
+        """
+        Takes connection from the pool, opens new one if there is no idle connection and the pool is not full
+
+        :param timeout: maximal time of waiting for free connection [s], None for no limit
+        :raises TimeoutError: if no connection became free in time
+        """
+        with self.available:
+            if not self.available.wait_for(lambda: self.idle or self.size < self.max_size, timeout):
+                raise TimeoutError('no free connection in pool')
+            if self.idle:
+                connection = self.idle.pop()
+                self.leased.add(connection)
+                return connection
+            self.size += 1
+
+        try:
+            connection = self.__connected(Connection(self.host, self.port, self.timeout, self.heartbeat_interval))
+        except BaseException:
+            with self.available:
+                self.size -= 1
+                self.available.notify()
+            raise
+        with self.available:
+            self.leased.add(connection)
+        return connection
+
+    def release(self, connection: Connection) -> None:
+        """
+        Gives connection back to the pool, broken connection is closed
+
+        :param connection: connection taken with acquire
+        """
+        with self.available:
+            self.leased.discard(connection)
+            if not connection.broken and not self.closed.is_set() and len(self.idle) < self.max_idle:
+                connection.last_used = monotonic()
+                self.idle.append(connection)
+                self.available.notify()
+                return
+            self.size -= 1
+            self.available.notify()
+        if connection.broken:
+            connection.close_transport()
+        else:
+            connection.close()
+
+    def close(self) -> None:
+        """ Closes all idle connections and stops heartbeat, leased connections are closed on release """
+        self.closed.set()
+        self.heartbeat.join()
+        with self.available:
+            connections = list(self.idle)
+            self.idle.clear()
+            self.size -= len(connections)
+        for connection in connections:
+            connection.close()
+
+    def stats(self) -> dict:
+        """ Returns counters of the pool """
+        with self.available:
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'replaced': self.replaced,
+                'expired': self.expired,
+            }
+
+    def __keep_alive(self) -> None:
+        """ Checks idle connections and keeps quiet leased ones alive until pool is closed """
+
+        while not self.closed.wait(self.heartbeat_interval):
+            # take idle connections out of the pool for the time of checking
+            with self.available:
+                connections = list(self.idle)
+                self.idle.clear()
+                leased = list(self.leased)
+
+            # connections used by their callers are skipped
+            for connection in leased:
+                connection.keep_alive(self.heartbeat_interval)
+
+            now = monotonic()
+            alive = []
+            for i, connection in enumerate(connections):
+                # connections are ordered from least recently used, keep min_idle of the most recent ones
+                if now - connection.last_used > self.idle_timeout and len(connections) - i > self.min_idle:
+                    self.expired += 1
+                    connection.close()
+                elif connection.is_alive():
+                    alive.append(connection)
+                else:
+                    utils.log('replacing session ' + str(connection.session_id) + ' rejected by server')
+                    self.replaced += 1
+                    connection.close_transport()
+                    replacement = self.__open()
+                    if replacement is not None:
+                        alive.append(replacement)
+
+            with self.available:
+                self.size -= len(connections) - len(alive)
+                # connections released in the meantime are more recent
+                self.idle.extendleft(reversed(alive))
+                self.available.notify_all()
+
+            # open connections missing to min_idle
+            while len(self.idle) < self.min_idle and self.size < self.max_size and not self.closed.is_set():
+                with self.available:
+                    self.size += 1
+                connection = self.__open()
+                with self.available:
+                    if connection is None:
+                        self.size -= 1
+                        break
+                    self.idle.appendleft(connection)
+                    self.available.notify()
+
+    def __open(self) -> Connection:
+        """ Opens new connection, returns None if server is not available """
+        try:
+            return self.__connected(Connection(self.host, self.port, self.timeout, self.heartbeat_interval))
+        except (OSError, ValueError) as e:
+            utils.log('cannot open pooled connection: ' + str(e), True)
+            return None
+
+    def __connected(self, connection: Connection) -> Connection:
+        """ Adopts heartbeat interval granted to new connection if it is shorter than the one of the pool """
+        self.heartbeat_interval = min(self.heartbeat_interval, connection.heartbeat_interval)
+        return connection
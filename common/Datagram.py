@@ -1,5 +1,35 @@
+from struct import Struct
+
 from bitstring import BitArray, ConstBitArray, ConstBitStream
 
+from common.values import DATAGRAM_BYTES
+
+# bit offsets of fields, counted from the least significant bit of the whole datagram [see readme]
+OPERATION_SHIFT = 246
+A_SHIFT = 182
+B_SHIFT = 118
+STATUS_SHIFT = 116
+SESSION_ID_SHIFT = 100
+MODE_SHIFT = 97
+RESULT_SHIFT = 33
+RESULT_ID_SHIFT = 1
+
+# masks of fields
+MASK_2 = (1 << 2) - 1
+MASK_3 = (1 << 3) - 1
+MASK_16 = (1 << 16) - 1
+MASK_32 = (1 << 32) - 1
+MASK_64 = (1 << 64) - 1
+
+# position of fields read without decoding [both lie within one byte]
+MODE_BYTE = DATAGRAM_BYTES - 1 - MODE_SHIFT // 8
+MODE_BIT = MODE_SHIFT % 8
+OPERATION_BIT = OPERATION_SHIFT % 8
+
+# precompiled converters between IEEE-754 numbers and their bit patterns
+FLOATS = Struct('>ddd')
+FLOATS_BITS = Struct('>QQQ')
+
 
 class Datagram:
     """ Stores, prepares and retrieves data sent over network """
@@ -8,7 +38,7 @@ class Datagram:
             self,
             status: int, mode: int, session_id: int=0,
             operation: int=0, a: float=0, b: float=0,
-            result: float=0, result_id: int=0, last: bool = True
+            result: float=0, result_id: int=0, last: bool = True, correlation_id: int = 0
     ) -> None:
         super().__init__()
         self.status = status
@@ -20,10 +50,85 @@ class Datagram:
         self.result = result
         self.result_id = result_id
         self.last = last
+        # id of request the datagram belongs to [sent only in protocol v2, see common.protocol]
+        self.correlation_id = correlation_id
 
     @classmethod
     def from_bytes(cls, binary: bytes):
         """ Parses retrieved data into python object
+
+        Treats whole datagram as one integer and cuts fields out of it with precomputed shifts and masks.
+        Accepts any bytes-like object, so frames can be passed as memoryview without copying.
+
+        :param binary: data to parse
+        """
+
+        if len(binary) < DATAGRAM_BYTES:
+            raise ValueError('datagram too short: ' + str(len(binary)) + ' bytes')
+
+        value = int.from_bytes(binary[:DATAGRAM_BYTES], 'big')
+        a, b, result = FLOATS.unpack(FLOATS_BITS.pack(
+            value >> A_SHIFT & MASK_64,
+            value >> B_SHIFT & MASK_64,
+            value >> RESULT_SHIFT & MASK_64
+        ))
+
+        return cls(
+            value >> STATUS_SHIFT & MASK_2,
+            value >> MODE_SHIFT & MASK_3,
+            value >> SESSION_ID_SHIFT & MASK_16,
+            value >> OPERATION_SHIFT,
+            a, b, result,
+            value >> RESULT_ID_SHIFT & MASK_32,
+            bool(value & 1)
+        )
+
+    @staticmethod
+    def peek_header(binary: bytes) -> (int, int):
+        """ Reads mode and operation of encoded datagram without decoding the rest of it
+
+        :param binary: encoded datagram
+        :return: (mode, operation)
+        """
+        return binary[MODE_BYTE] >> MODE_BIT & MASK_3, binary[0] >> OPERATION_BIT
+
+    def get_bytes(self) -> bytes:
+        """ Parses data to binary format
+
+        Packs all fields into one integer, produces the same output as get_bytes_reference
+        """
+
+        if not 0 <= self.operation <= MASK_2:
+            raise ValueError('operation out of range: ' + str(self.operation))
+        if not 0 <= self.status <= MASK_2:
+            raise ValueError('status out of range: ' + str(self.status))
+        if not 0 <= self.session_id <= MASK_16:
+            raise ValueError('session_id out of range: ' + str(self.session_id))
+        if not 0 <= self.mode <= MASK_3:
+            raise ValueError('mode out of range: ' + str(self.mode))
+        if not 0 <= self.result_id <= MASK_32:
+            raise ValueError('result_id out of range: ' + str(self.result_id))
+
+        a, b, result = FLOATS_BITS.unpack(FLOATS.pack(self.a, self.b, self.result))
+        value = \
+            self.operation << OPERATION_SHIFT | \
+            a << A_SHIFT | \
+            b << B_SHIFT | \
+            self.status << STATUS_SHIFT | \
+            self.session_id << SESSION_ID_SHIFT | \
+            self.mode << MODE_SHIFT | \
+            result << RESULT_SHIFT | \
+            self.result_id << RESULT_ID_SHIFT | \
+            (1 if self.last else 0)
+
+        return value.to_bytes(DATAGRAM_BYTES, 'big')
+
+    @classmethod
+    def from_bytes_reference(cls, binary: bytes):
+        """ Parses retrieved data into python object using bitstring
+
+        Reference implementation of from_bytes, slow but easy to check against the readme
+
         :param binary: data to parse
         """
 
@@ -40,8 +145,11 @@ class Datagram:
 
         return cls(status, mode, session_id, operation, a, b, result, result_id, last)
 
-    def get_bytes(self) -> bytes:
-        """ Parses data to binary format """
+    def get_bytes_reference(self) -> bytes:
+        """ Parses data to binary format using bitstring
+
+        Reference implementation of get_bytes
+        """
 
         datagram = BitArray()
 
@@ -0,0 +1,150 @@
+import os
+import socket
+from time import monotonic
+
+from common.values import DATAGRAM_BYTES
+
+# maximal number of buffers passed to one sendmsg
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
+
+class FrameReader:
+    """ Splits data received from stream socket into datagram frames
+
+    Data is received with recv_into straight into one preallocated buffer and frames are handed out as memoryview
+    slices of it, so no bytes object is created per recv or per frame. One recv may bring many frames [pipelined
+    requests] or only a part of one, both cases are handled.
+    """
+
+    def __init__(self, connection: socket.socket, frame_size: int = DATAGRAM_BYTES, capacity: int = 128) -> None:
+        """
+        :param connection: socket with established connection
+        :param frame_size: size of one frame in bytes
+        :param capacity: number of frames buffer can hold
+        """
+        self.connection = connection
+        self.frame_size = frame_size
+        self.buffer = bytearray(frame_size * capacity)
+        self.view = memoryview(self.buffer)
+        # buffered data lies in buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    def read_frame(self) -> memoryview:
+        """
+        Returns next frame
+
+        Receives more data only if there is no complete frame in the buffer. Returned view points into the buffer,
+        so it is valid only until the next call.
+
+        :return: frame of exactly frame_size bytes
+        :raises ConnectionAbortedError: if connection was closed by the peer
+        """
+        return self.read(self.frame_size)
+
+    def read(self, size: int) -> memoryview:
+        """
+        Returns next size bytes [frames of variable size are read in parts, e.g. header and payload]
+
+        Returned view points into the buffer, so it is valid only until the next call.
+
+        :param size: number of bytes
+        :raises ConnectionAbortedError: if connection was closed by the peer
+        """
+        if size > len(self.buffer):
+            # make room for frame bigger than the buffer
+            self.buffer = self.buffer[:self.end] + bytearray(size - self.end)
+            self.view = memoryview(self.buffer)
+
+        while self.end - self.start < size:
+            self.__receive()
+
+        data = self.view[self.start:self.start + size]
+        self.start += size
+        return data
+
+    def pending(self, size: int = None) -> bool:
+        """
+        Checks if next frame can be read without receiving
+
+        :param size: size of frame [or of its header], frame_size if not given
+        """
+        return self.end - self.start >= (size or self.frame_size)
+
+    def __receive(self) -> None:
+        """ Receives data into the free part of the buffer """
+
+        # move incomplete frame to the beginning of the buffer
+        if self.start > 0:
+            left = self.end - self.start
+            self.view[:left] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = left
+
+        received = self.connection.recv_into(self.view[self.end:])
+        if received == 0:
+            raise ConnectionAbortedError('connection closed by peer')
+        self.end += received
+
+
+class FrameWriter:
+    """ Gathers outgoing frames of connection and sends them together
+
+    Frames are kept until flush [called by the owner when it is about to wait for more requests], until
+    max_buffered bytes are gathered or until the oldest of them waits max_delay. Then all of them are sent with
+    scatter-gather sendmsg, so a reply of many datagrams costs a few syscalls instead of one per datagram.
+    Since frames are coalesced here, Nagle's algorithm would only add latency, so it is turned off.
+    """
+
+    def __init__(self, connection: socket.socket, max_buffered: int = 64 * 1024, max_delay: float = 0.005) -> None:
+        """
+        :param connection: socket with established connection
+        :param max_buffered: number of buffered bytes which triggers sending
+        :param max_delay: maximal time frame can wait in buffer [s]
+        """
+        self.connection = connection
+        self.max_buffered = max_buffered
+        self.max_delay = max_delay
+        self.frames = []
+        self.size = 0
+        self.oldest = 0.0
+
+        if connection.family in (socket.AF_INET, socket.AF_INET6):
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, frame: bytes) -> None:
+        """
+        Adds frame to the buffer, sends the buffer if it is full or waits too long
+
+        :param frame: data to send
+        """
+        if not self.frames:
+            self.oldest = monotonic()
+        self.frames.append(frame)
+        self.size += len(frame)
+
+        if self.size >= self.max_buffered or monotonic() - self.oldest >= self.max_delay:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Sends all buffered frames """
+
+        frames = self.frames
+        if not frames:
+            return
+
+        if not hasattr(self.connection, 'sendmsg'):
+            self.connection.sendall(b''.join(frames))
+        else:
+            start = 0
+            while start < len(frames):
+                sent = self.connection.sendmsg(frames[start:start + IOV_MAX])
+                # skip frames sent whole, keep the rest of the one sent partially
+                while start < len(frames) and sent >= len(frames[start]):
+                    sent -= len(frames[start])
+                    start += 1
+                if sent:
+                    frames[start] = memoryview(frames[start])[sent:]
+
+        self.frames = []
+        self.size = 0
@@ -0,0 +1,273 @@
+import atexit
+import datetime
+import sys
+from collections import deque
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Dict, List, Tuple
+
+# levels of messages
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+# level of logger which writes nothing
+OFF = 100
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR, 'off': OFF}
+# prefixes of messages by level
+PREFIXES = {DEBUG: '', INFO: '', WARNING: 'WARNING: ', ERROR: 'ERROR: '}
+
+# record of log: (time, level, message, arguments of message)
+Record = Tuple[float, int, str, tuple]
+
+
+def format_record(record: Record) -> str:
+    """
+    Formats record into line of log [the same as utils.log always printed]
+
+    :param record: record to format
+    :return: line without newline
+    """
+    timestamp, level, message, args = record
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError):
+            message = message + ' ' + repr(args)
+    return str(datetime.datetime.fromtimestamp(timestamp).time()) + ' - ' + PREFIXES.get(level, '') + message
+
+
+class Writer:
+    """ Writes log records to the stream
+
+    Until started, records are formatted and written right away by the thread which logs them [as print did].
+    Once started, records are only appended to a queue, and a background thread formats and writes them in
+    batches every interval, so logging costs the caller an append and never waits for the stream. If max_queued
+    records are waiting, new ones are dropped and their number is written instead.
+    """
+
+    def __init__(self, stream=None, interval: float = 0.05, max_queued: int = 100000) -> None:
+        """
+        :param stream: text stream to write to, sys.stdout if not given
+        :param interval: time between writes of queued records [s]
+        :param max_queued: maximal number of records waiting for write
+        """
+        self.stream = stream
+        self.interval = interval
+        self.max_queued = max_queued
+        self.queue = deque()
+        self.dropped = 0
+        # lines of different threads are not mixed
+        self.lock = Lock()
+
+        self.thread: Thread = None
+        self.stopped = Event()
+
+    def write(self, record: Record) -> None:
+        """
+        Writes record or queues it if writer is started
+
+        :param record: record to write
+        """
+        if self.thread is None:
+            self.__write([record])
+        elif len(self.queue) < self.max_queued:
+            self.queue.append(record)
+        else:
+            self.dropped += 1
+
+    def start(self) -> None:
+        """ Starts writing in background """
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = Thread(name='log_writer', target=self.__write_periodically, daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """ Writes queued records and returns to writing right away """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            atexit.unregister(self.stop)
+        self.flush()
+
+    def flush(self) -> None:
+        """ Writes all queued records """
+
+        records: List[Record] = []
+        # popleft is atomic, so records appended in the meantime are left for the next flush
+        while self.queue:
+            records.append(self.queue.popleft())
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            records.append((time(), WARNING, '%d log records dropped', (dropped,)))
+        self.__write(records)
+
+    def __write_periodically(self) -> None:
+        """ Flushes queue until writer is stopped """
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def __write(self, records: List[Record]) -> None:
+        """ Formats records and writes them with one call """
+        if not records:
+            return
+        text = '\n'.join(format_record(record) for record in records) + '\n'
+        stream = self.stream or sys.stdout
+        with self.lock:
+            stream.write(text)
+            stream.flush()
+
+
+class Logger:
+    """ Logger of one category of messages
+
+    Message is a %-format string, arguments are formatted only when the record is written, so a message below
+    level costs one comparison and a disabled logger [level OFF] costs nothing more. Frequent messages can be
+    sampled [only every sample_every-th is written] or rate limited [at most rate_limit per second, number of
+    suppressed ones is written when the second ends].
+    """
+
+    def __init__(
+            self, category: str, writer: Writer, level: int = INFO, sample_every: int = 1, rate_limit: int = None
+    ) -> None:
+        """
+        :param category: name of logged category
+        :param writer: writer of records
+        :param level: lowest level of written messages
+        :param sample_every: write only every n-th message
+        :param rate_limit: maximal number of messages written per second, None for no limit
+        """
+        self.category = category
+        self.writer = writer
+        self.level = level
+        self.sample_every = sample_every
+        self.rate_limit = rate_limit
+
+        self.calls = 0
+        self.window_start = 0.0
+        self.window_count = 0
+        self.suppressed = 0
+
+    def configure(self, level: int = None, sample_every: int = None, rate_limit: int = None) -> None:
+        """
+        Changes settings of logger, settings not given are kept
+
+        :param level: lowest level of written messages
+        :param sample_every: write only every n-th message
+        :param rate_limit: maximal number of messages written per second, 0 for no limit
+        """
+        if level is not None:
+            self.level = level
+        if sample_every is not None:
+            self.sample_every = max(sample_every, 1)
+        if rate_limit is not None:
+            self.rate_limit = rate_limit or None
+
+    def settings(self) -> Tuple[int, int, int]:
+        """ Returns (level, sample_every, rate_limit) of logger """
+        return self.level, self.sample_every, self.rate_limit
+
+    def log(self, level: int, message: str, *args) -> None:
+        """
+        Logs message
+
+        :param level: level of message
+        :param message: message, %-format string if args are given
+        :param args: arguments of message
+        """
+        if level < self.level:
+            return
+        if self.sample_every > 1:
+            self.calls += 1
+            if self.calls % self.sample_every:
+                return
+        if self.rate_limit is not None and not self.__allowed():
+            return
+        self.writer.write((time(), level, message, args))
+
+    def debug(self, message: str, *args) -> None:
+        if DEBUG >= self.level:
+            self.log(DEBUG, message, *args)
+
+    def info(self, message: str, *args) -> None:
+        if INFO >= self.level:
+            self.log(INFO, message, *args)
+
+    def warning(self, message: str, *args) -> None:
+        if WARNING >= self.level:
+            self.log(WARNING, message, *args)
+
+    def error(self, message: str, *args) -> None:
+        if ERROR >= self.level:
+            self.log(ERROR, message, *args)
+
+    def __allowed(self) -> bool:
+        """ Counts message in current second, checks if it fits into rate limit """
+
+        now = monotonic()
+        if now - self.window_start >= 1:
+            if self.suppressed:
+                self.writer.write(
+                    (time(), WARNING, '%d messages of %s suppressed', (self.suppressed, self.category))
+                )
+            self.window_start = now
+            self.window_count = 0
+            self.suppressed = 0
+
+        if self.window_count >= self.rate_limit:
+            self.suppressed += 1
+            return False
+        self.window_count += 1
+        return True
+
+
+# writer shared by all loggers of the process
+WRITER = Writer()
+# category -> logger
+loggers: Dict[str, Logger] = {}
+
+
+def get_logger(category: str) -> Logger:
+    """
+    Gets logger of category, creates it if it does not exist
+
+    :param category: name of category
+    """
+    logger = loggers.get(category)
+    if logger is None:
+        logger = loggers.setdefault(category, Logger(category, WRITER))
+    return logger
+
+
+def start() -> None:
+    """ Starts writing logs in background """
+    WRITER.start()
+
+
+def stop() -> None:
+    """ Writes queued logs and returns to writing them right away """
+    WRITER.stop()
+
+
+def settings() -> dict:
+    """ Returns settings of logging, so they can be applied in another process with configure """
+    return {
+        'background': WRITER.thread is not None,
+        'loggers': {category: logger.settings() for category, logger in loggers.items()},
+    }
+
+
+def configure(log_settings: dict) -> None:
+    """
+    Applies settings of logging
+
+    :param log_settings: settings returned by settings
+    """
+    for category, (level, sample_every, rate_limit) in log_settings['loggers'].items():
+        get_logger(category).configure(level, sample_every, rate_limit or 0)
+    if log_settings['background']:
+        start()
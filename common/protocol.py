@@ -0,0 +1,457 @@
+import sys
+from array import array
+from itertools import accumulate
+from operator import sub
+from struct import Struct
+from typing import Dict, Iterator, List, Tuple
+
+from common.Datagram import Datagram
+from common.framing import FrameReader
+from common.values import Status, Mode, Operation, DATAGRAM_BYTES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# versions of protocol [client asks for one in number b of CONNECT, server grants it in number b of the answer,
+# so old servers, which answer with 0, and old clients, which ask for 0, keep speaking version 1]
+VERSION_1 = 1
+VERSION_2 = 2
+LATEST_VERSION = VERSION_2
+
+# correlation ids go around after that
+MAX_CORRELATION_ID = 0xFFFF
+
+# header of v2 frame: type [mode of request], flags [status in bits 0-1, last in bit 2], correlation id
+HEADER = Struct('>BBH')
+STATUS_MASK = 3
+LAST_FLAG = 4
+
+# payloads of v2 frames
+OPERATION_REQUEST = Struct('>Bdd')      # operation, a, b
+OPERATION_ANSWER = Struct('>Id')        # result_id, result
+RESULT_ID = Struct('>I')                # result_id [after_result_id for session query]
+RESULT = Struct('>BdddI')               # operation, a, b, result, result_id
+ERROR = Struct('>Hd')                   # error code, detail [e.g. time to retry after]
+BLOCK = Struct('>IIIB')                 # first result_id, number of results, size of body, encoding of body
+EMPTY = Struct('')
+
+# encoding of block body: bits 0-1 select column of result ids, bits 2-4 mark number columns sent in single precision
+IDS_MASK = 3
+FLOAT_A = 4
+FLOAT_B = 8
+FLOAT_RESULT = 16
+# typecodes of result id column: deltas of 1, 2 or 4 bytes, or ids themselves if they do not grow
+ID_TYPES = ('B', 'H', 'I', 'I')
+ABSOLUTE_IDS = 3
+# columns travel in network order
+SWAP = sys.byteorder == 'little'
+
+# (type, status) -> payload, status ERROR and REFUSED always carry ERROR payload
+PAYLOADS: Dict[Tuple[int, int], Struct] = {
+    (Mode.DISCONNECT, Status.NEW): EMPTY,
+    (Mode.DISCONNECT, Status.OK): EMPTY,
+    (Mode.IS_ALIVE, Status.NEW): EMPTY,
+    (Mode.IS_ALIVE, Status.OK): EMPTY,
+    (Mode.OPERATION, Status.NEW): OPERATION_REQUEST,
+    (Mode.OPERATION, Status.OK): OPERATION_ANSWER,
+    (Mode.QUERY_BY_SESSION_ID, Status.NEW): RESULT_ID,
+    (Mode.QUERY_BY_SESSION_ID, Status.OK): RESULT,
+    (Mode.QUERY_BY_RESULT_ID, Status.NEW): RESULT_ID,
+    (Mode.QUERY_BY_RESULT_ID, Status.OK): RESULT,
+    (Mode.RESULT_BLOCK, Status.NEW): RESULT_ID,
+    (Mode.RESULT_BLOCK, Status.OK): BLOCK,
+}
+PAYLOADS.update({
+    (mode, status): ERROR for mode in range(Mode.RESULT_BLOCK + 1) for status in (Status.ERROR, Status.REFUSED)
+})
+# the same indexed by type << 2 | status, None for unknown types, so lookup of frame being read does not build a tuple
+LAYOUTS: List[Struct] = [PAYLOADS.get((key >> 2, key & STATUS_MASK)) for key in range(256 << 2)]
+
+
+def _deltas(ids: array) -> (int, array):
+    """
+    Converts column of result ids to differences between neighbours in the narrowest type they fit
+
+    :param ids: result ids
+    :return: (encoding of result ids, differences [or ids without the first one if they do not grow])
+    """
+    if np is not None:
+        deltas = np.diff(np.frombuffer(ids, dtype=np.uint32).astype(np.int64))
+        smallest, largest = (int(deltas.min()), int(deltas.max())) if len(deltas) else (0, 0)
+    else:
+        deltas = list(map(sub, ids[1:], ids[:-1]))
+        smallest, largest = min(deltas, default=0), max(deltas, default=0)
+
+    if smallest < 0:
+        return ABSOLUTE_IDS, ids[1:]
+    encoding = 0 if largest <= 0xFF else 1 if largest <= 0xFFFF else 2
+    if np is not None:
+        return encoding, array(ID_TYPES[encoding], deltas.astype(ID_TYPES[encoding]).tobytes())
+    return encoding, array(ID_TYPES[encoding], deltas)
+
+
+def _narrowed(column: array) -> array:
+    """
+    Converts column of numbers to single precision if no number changes by it
+
+    :return: single precision column or None
+    """
+    if np is not None:
+        numbers = np.frombuffer(column, dtype=np.float64)
+        # numbers out of single precision range become infinite, which is caught by the comparison
+        with np.errstate(over='ignore'):
+            narrow = numbers.astype(np.float32)
+        return array('f', narrow.tobytes()) if np.array_equal(narrow, numbers) else None
+    narrow = array('f', column)
+    return narrow if array('d', narrow) == column else None
+
+
+def _widened(column: array) -> array:
+    """ Converts column of single precision numbers to double precision """
+    if np is not None:
+        return array('d', np.frombuffer(column, dtype=np.float32).astype(np.float64).tobytes())
+    return array('d', column)
+
+
+def _network_bytes(column: array) -> bytes:
+    """ Gets bytes of column in network order """
+    if SWAP and column.itemsize > 1:
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+class ResultBlock:
+    """ Many results of session sent in one frame of protocol version 2
+
+    Answer to RESULT_BLOCK request is a stream of blocks, one per page of results, the final one has last flag set.
+    Results are kept in columns [arrays] and the body of frame is the columns one after another: result ids,
+    operations, numbers a, numbers b, results. Result ids of session grow, so they are sent as differences from the
+    previous one in 1, 2 or 4 bytes, whichever fits the largest. Number columns take 4 bytes per value when all
+    values of the column are exact in single precision [e.g. integer arguments]. So typical result takes 18 bytes
+    instead of 31 of version 1 datagram, and the whole block is encoded and decoded by array operations, not per
+    result.
+
+    Columns can be used directly [e.g. numpy.frombuffer(block.results)] or the block can be iterated as datagrams.
+    """
+
+    def __init__(
+            self, result_ids: array, operations: array, numbers_a: array, numbers_b: array, results: array,
+            session_id: int = 0, last: bool = True, correlation_id: int = 0
+    ) -> None:
+        """
+        :param result_ids: column of result ids [typecode 'I']
+        :param operations: column of operation codes [typecode 'B']
+        :param numbers_a: column of numbers a [typecode 'd']
+        :param numbers_b: column of numbers b [typecode 'd']
+        :param results: column of results [typecode 'd']
+        :param session_id: id of session the results belong to
+        :param last: if the block ends the answer
+        :param correlation_id: id of request the block answers
+        """
+        self.status = Status.OK
+        self.mode = Mode.RESULT_BLOCK
+        self.session_id = session_id
+        self.result_ids = result_ids
+        self.operations = operations
+        self.numbers_a = numbers_a
+        self.numbers_b = numbers_b
+        self.results = results
+        self.last = last
+        self.correlation_id = correlation_id
+
+    @classmethod
+    def from_results(cls, session_id: int, results: List[tuple], last: bool = True) -> 'ResultBlock':
+        """
+        Creates block from results of storage
+
+        :param session_id: id of session
+        :param results: results as (operation, a, b, session_id, result, result_id), not empty
+        :param last: if the block ends the answer
+        """
+        operations, numbers_a, numbers_b, _, values, result_ids = zip(*results)
+        return cls(
+            array('I', result_ids), array('B', operations), array('d', numbers_a), array('d', numbers_b),
+            array('d', values), session_id, last
+        )
+
+    @classmethod
+    def from_datagrams(cls, datagrams: List[Datagram], last: bool = True) -> 'ResultBlock':
+        """
+        Creates block from answers to QUERY_BY_SESSION_ID [e.g. from server speaking version 1]
+
+        :param datagrams: answers with results, not empty
+        :param last: if the block ends the answer
+        """
+        return cls(
+            array('I', (datagram.result_id for datagram in datagrams)),
+            array('B', (datagram.operation for datagram in datagrams)),
+            array('d', (datagram.a for datagram in datagrams)),
+            array('d', (datagram.b for datagram in datagrams)),
+            array('d', (datagram.result for datagram in datagrams)),
+            datagrams[0].session_id, last
+        )
+
+    def encode(self) -> (int, int, bytes):
+        """
+        Encodes columns into body of frame
+
+        :return: (first result id, encoding, body)
+        """
+        encoding, deltas = _deltas(self.result_ids)
+        columns = [_network_bytes(deltas), self.operations.tobytes()]
+        for flag, column in ((FLOAT_A, self.numbers_a), (FLOAT_B, self.numbers_b), (FLOAT_RESULT, self.results)):
+            narrow = _narrowed(column)
+            if narrow is not None:
+                encoding |= flag
+                column = narrow
+            columns.append(_network_bytes(column))
+        return self.result_ids[0] if self.result_ids else 0, encoding, b''.join(columns)
+
+    @classmethod
+    def decode(cls, first: int, count: int, encoding: int, body: bytes) -> 'ResultBlock':
+        """
+        Decodes body of frame into columns
+
+        :param first: first result id
+        :param count: number of results
+        :param encoding: encoding of body
+        :param body: body of frame
+        :raises ValueError: if body does not match its encoding
+        """
+        typecodes = [ID_TYPES[encoding & IDS_MASK], 'B'] + [
+            'f' if encoding & flag else 'd' for flag in (FLOAT_A, FLOAT_B, FLOAT_RESULT)
+        ]
+        # result id column lacks the first id
+        sizes = [max(count - 1, 0)] + [count] * 4
+        if len(body) != sum(array(typecode).itemsize * size for typecode, size in zip(typecodes, sizes)):
+            raise ValueError('size of result block does not match its encoding')
+
+        columns = []
+        offset = 0
+        for typecode, size in zip(typecodes, sizes):
+            column = array(typecode)
+            column.frombytes(body[offset:offset + column.itemsize * size])
+            offset += column.itemsize * size
+            if SWAP and column.itemsize > 1:
+                column.byteswap()
+            # single precision numbers are widened, so columns look the same regardless of encoding
+            columns.append(_widened(column) if typecode == 'f' else column)
+
+        ids = columns[0]
+        if not count:
+            result_ids = array('I')
+        elif encoding & IDS_MASK == ABSOLUTE_IDS:
+            result_ids = array('I', [first]) + ids
+        else:
+            result_ids = array('I', accumulate(ids, initial=first))
+        return cls(result_ids, *columns[1:])
+
+    def __len__(self) -> int:
+        return len(self.result_ids)
+
+    def __iter__(self) -> Iterator[Datagram]:
+        """ Yields results as answers to QUERY_BY_SESSION_ID, the final one of the last block with last flag """
+        final = len(self.result_ids) - 1
+        for i, (result_id, operation, a, b, result) in enumerate(
+                zip(self.result_ids, self.operations, self.numbers_a, self.numbers_b, self.results)
+        ):
+            yield Datagram(
+                Status.OK, Mode.QUERY_BY_SESSION_ID, self.session_id, operation, a, b, result, result_id,
+                self.last and i == final, self.correlation_id
+            )
+
+
+class Codec:
+    """ Converts datagrams of one connection to frames and back
+
+    Connection starts in version 1, where every frame is the whole datagram [see readme], and may be upgraded
+    to version 2 after CONNECT. Frame of version 2 is a 4 byte header followed by payload whose size depends on type
+    and status, so heartbeat is 4 bytes and calculation request 21. Session id is not sent [connection belongs to one
+    session], answers do not repeat arguments of requests, every answer carries correlation id of its request.
+
+    Frames are read in two steps, header_size bytes of header, then payload_size(header) bytes of payload. Result
+    block is followed by a body of body_size(header, payload) bytes.
+    """
+
+    def __init__(self) -> None:
+        self.version = VERSION_1
+        self.session_id = 0
+        self.header_size = DATAGRAM_BYTES
+        self.correlation_id = 0
+
+    def upgrade(self, version: int, session_id: int) -> None:
+        """
+        Switches to other version of protocol
+
+        :param version: version agreed on in CONNECT
+        :param session_id: session the connection belongs to
+        """
+        self.version = VERSION_2 if version == VERSION_2 else VERSION_1
+        self.session_id = session_id
+        self.header_size = HEADER.size if self.version == VERSION_2 else DATAGRAM_BYTES
+
+    def next_correlation_id(self) -> int:
+        """ Returns correlation id for next request [datagrams of one request share it] """
+        self.correlation_id = self.correlation_id % MAX_CORRELATION_ID + 1
+        return self.correlation_id
+
+    def payload_size(self, header: bytes) -> int:
+        """
+        Gets size of payload following the header
+
+        :param header: header of frame
+        :raises ValueError: if frame type is unknown [the rest of the stream cannot be read then]
+        """
+        if self.version == VERSION_1:
+            return 0
+        layout = LAYOUTS[header[0] << 2 | header[1] & STATUS_MASK]
+        if layout is None:
+            raise ValueError('unknown frame type: ' + str(header[0]))
+        return layout.size
+
+    def body_size(self, header: bytes, payload: bytes) -> int:
+        """
+        Gets size of body following the payload [only result blocks have one]
+
+        :param header: header of frame
+        :param payload: payload of frame
+        """
+        if self.version == VERSION_1 or header[0] != Mode.RESULT_BLOCK or header[1] & STATUS_MASK != Status.OK:
+            return 0
+        return BLOCK.unpack_from(payload)[2]
+
+    def peek(self, header: bytes, payload: bytes) -> (int, int):
+        """
+        Reads mode and operation of frame without decoding it
+
+        :return: (mode, operation) [unknown operation is reported as 0, decode refuses the frame]
+        """
+        if self.version == VERSION_1:
+            return Datagram.peek_header(header)
+        if header[0] == Mode.OPERATION and payload and payload[0] < Operation.COUNT:
+            return header[0], payload[0]
+        return header[0], 0
+
+    def decode(self, header: bytes, payload: bytes, body: bytes = b'') -> Datagram:
+        """
+        Decodes frame
+
+        :param header: header of frame
+        :param payload: payload of frame
+        :param body: body of result block
+        :return: datagram or ResultBlock
+        :raises ValueError: if frame is malformed
+        """
+        if self.version == VERSION_1:
+            return Datagram.from_bytes(header)
+
+        mode, flags, correlation_id = HEADER.unpack(header)
+        layout = LAYOUTS[mode << 2 | flags & STATUS_MASK]
+        status = flags & STATUS_MASK
+        last = flags & LAST_FLAG != 0
+        # every layout builds datagram at once, setting fields one by one costs more than the decoding itself
+        if layout is OPERATION_REQUEST:
+            operation, a, b = OPERATION_REQUEST.unpack(payload)
+            if operation >= Operation.COUNT:
+                raise ValueError('unknown operation: ' + str(operation))
+            return Datagram(status, mode, self.session_id, operation, a, b, 0, 0, last, correlation_id)
+        elif layout is OPERATION_ANSWER:
+            result_id, result = OPERATION_ANSWER.unpack(payload)
+            return Datagram(status, mode, self.session_id, 0, 0, 0, result, result_id, last, correlation_id)
+        elif layout is RESULT:
+            operation, a, b, result, result_id = RESULT.unpack(payload)
+            return Datagram(status, mode, self.session_id, operation, a, b, result, result_id, last, correlation_id)
+        elif layout is RESULT_ID:
+            result_id, = RESULT_ID.unpack(payload)
+            return Datagram(status, mode, self.session_id, 0, 0, 0, 0, result_id, last, correlation_id)
+        elif layout is ERROR:
+            code, detail = ERROR.unpack(payload)
+            return Datagram(status, mode, self.session_id, 0, code, detail, 0, 0, last, correlation_id)
+        elif layout is BLOCK:
+            first, count, _, encoding = BLOCK.unpack(payload)
+            block = ResultBlock.decode(first, count, encoding, body)
+            block.session_id = self.session_id
+            block.last = last
+            block.correlation_id = correlation_id
+            return block
+        elif layout is None:
+            raise ValueError('unknown frame type: ' + str(mode))
+        return Datagram(status, mode, self.session_id, 0, 0, 0, 0, 0, last, correlation_id)
+
+    def read(self, reader: FrameReader) -> Datagram:
+        """
+        Reads and decodes next frame
+
+        :param reader: reader of the connection
+        :raises ValueError: if frame is malformed
+        """
+        header = reader.read(self.header_size)
+        size = self.payload_size(header)
+        if not size:
+            return self.decode(header, b'')
+        # header points into the buffer of reader, which may move on the next read
+        header = bytes(header)
+        payload = reader.read(size)
+        size = self.body_size(header, payload)
+        if not size:
+            return self.decode(header, payload)
+        payload = bytes(payload)
+        return self.decode(header, payload, reader.read(size))
+
+    def fill_in(self, answers: List[Datagram], requests: List[Datagram]) -> List[Datagram]:
+        """
+        Fills fields which version 2 does not repeat in answers from their requests, so answers look the same in both
+        versions
+
+        :param answers: answers of one request
+        :param requests: datagrams of the request
+        :return: answers
+        :raises ValueError: if answers belong to other request
+        """
+        if self.version == VERSION_1:
+            return answers
+        for answer in answers:
+            if answer.correlation_id != requests[-1].correlation_id:
+                raise ValueError(
+                    'answer of request ' + str(answer.correlation_id) + ' instead of ' +
+                    str(requests[-1].correlation_id)
+                )
+        if requests[0].mode == Mode.OPERATION:
+            for answer, request in zip(answers, requests):
+                answer.operation = request.operation
+                if answer.status == Status.OK:
+                    answer.a, answer.b = request.a, request.b
+        return answers
+
+    def encode(self, datagram: Datagram) -> bytes:
+        """
+        Encodes datagram as frame of the connection's version
+
+        :param datagram: datagram or ResultBlock [version 2 only] to encode
+        """
+        if self.version == VERSION_1:
+            return datagram.get_bytes()
+
+        header = HEADER.pack(
+            datagram.mode, datagram.status | (LAST_FLAG if datagram.last else 0), datagram.correlation_id
+        )
+        layout = PAYLOADS[(datagram.mode, datagram.status)]
+        if layout is ERROR:
+            return header + ERROR.pack(int(datagram.a), datagram.b)
+        elif layout is OPERATION_REQUEST:
+            return header + OPERATION_REQUEST.pack(datagram.operation, datagram.a, datagram.b)
+        elif layout is OPERATION_ANSWER:
+            return header + OPERATION_ANSWER.pack(datagram.result_id, datagram.result)
+        elif layout is RESULT_ID:
+            return header + RESULT_ID.pack(datagram.result_id)
+        elif layout is RESULT:
+            return header + RESULT.pack(
+                datagram.operation, datagram.a, datagram.b, datagram.result, datagram.result_id
+            )
+        elif layout is BLOCK:
+            first, encoding, body = datagram.encode()
+            return header + BLOCK.pack(first, len(datagram), len(body), encoding) + body
+        return header
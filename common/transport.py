@@ -0,0 +1,192 @@
+import asyncio
+import os
+import socket
+import stat
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+# prefix of address of Unix domain socket [e.g. unix:/tmp/netcalc.sock], other addresses are IP addresses for TCP
+UNIX_PREFIX = 'unix:'
+
+
+class Transport(ABC):
+    """ Stream transport between clients and the server
+
+    Transports differ only in how connections are made, frames and sessions are the same over all of them.
+    Both engines of the server and all clients create their sockets through a transport.
+    """
+
+    @abstractmethod
+    def listen(self, backlog: int, reuse_port: bool = False) -> socket.socket:
+        """
+        Creates listening socket
+
+        :param backlog: maximal number of connections waiting for accept
+        :param reuse_port: let other processes listen on the same address
+        """
+
+    @abstractmethod
+    def connect(self, timeout: float = None) -> socket.socket:
+        """
+        Connects to the server
+
+        :param timeout: timeout of connecting and of later operations on the socket [s], None for blocking
+        """
+
+    @abstractmethod
+    async def start_server(
+            self, handle: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]],
+            backlog: int, reuse_port: bool = False
+    ) -> asyncio.AbstractServer:
+        """
+        Starts accepting connections on the running event loop
+
+        :param handle: coroutine handling one connection
+        :param backlog: maximal number of connections waiting for accept
+        :param reuse_port: let other processes listen on the same address
+        """
+
+    @abstractmethod
+    async def open_connection(self) -> (asyncio.StreamReader, asyncio.StreamWriter):
+        """ Connects to the server from the running event loop """
+
+    def client_address(self, address) -> tuple:
+        """
+        Gets address of accepted client as (host, port) for logs
+
+        :param address: address returned by accept or peername of the connection
+        """
+        return address
+
+    def close(self) -> None:
+        """ Releases the address after listening socket was closed """
+
+
+class TcpTransport(Transport):
+    """ TCP connections to IP address and port """
+
+    def __init__(self, host: str, port: int) -> None:
+        """
+        :param host: IP address of the server
+        :param port: port number of the server
+        """
+        self.host = host
+        self.port = port
+
+    def listen(self, backlog: int, reuse_port: bool = False) -> socket.socket:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((self.host, self.port))
+        s.listen(backlog)
+        return s
+
+    def connect(self, timeout: float = None) -> socket.socket:
+        s = socket.create_connection((self.host, self.port), timeout)
+        # requests are written at once, so Nagle's algorithm would only delay them
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return s
+
+    async def start_server(
+            self, handle: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]],
+            backlog: int, reuse_port: bool = False
+    ) -> asyncio.AbstractServer:
+        return await asyncio.start_server(handle, self.host, self.port, backlog=backlog, reuse_port=reuse_port)
+
+    async def open_connection(self) -> (asyncio.StreamReader, asyncio.StreamWriter):
+        return await asyncio.open_connection(self.host, self.port)
+
+    def __str__(self) -> str:
+        return self.host + ':' + str(self.port)
+
+
+class UnixTransport(Transport):
+    """ Unix domain socket connections for clients on the same host
+
+    Data does not go through the TCP/IP stack [no checksums, acknowledgements or loopback routing]. Socket file is
+    removed when the server stops, stale file left by a server which crashed is removed before listening.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: path of socket file
+        """
+        self.path = path
+
+    def listen(self, backlog: int, reuse_port: bool = False) -> socket.socket:
+        self.__check_sharing(reuse_port)
+        self.__remove_stale()
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(self.path)
+        s.listen(backlog)
+        return s
+
+    def connect(self, timeout: float = None) -> socket.socket:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        try:
+            s.connect(self.path)
+        except OSError:
+            s.close()
+            raise
+        return s
+
+    async def start_server(
+            self, handle: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]],
+            backlog: int, reuse_port: bool = False
+    ) -> asyncio.AbstractServer:
+        self.__check_sharing(reuse_port)
+        self.__remove_stale()
+        return await asyncio.start_unix_server(handle, self.path, backlog=backlog)
+
+    async def open_connection(self) -> (asyncio.StreamReader, asyncio.StreamWriter):
+        return await asyncio.open_unix_connection(self.path)
+
+    def client_address(self, address) -> tuple:
+        # clients of Unix domain sockets are unnamed
+        return str(self), 0
+
+    def close(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __check_sharing(self, reuse_port: bool) -> None:
+        """ Refuses to share the socket among processes [SO_REUSEPORT balances only TCP and UDP] """
+        if reuse_port:
+            raise ValueError('Unix domain socket ' + self.path + ' cannot be shared by many workers')
+
+    def __remove_stale(self) -> None:
+        """
+        Removes socket file left by server which did not stop cleanly
+
+        :raises OSError: if the file is not a socket or another server still listens on it
+        """
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError('not a socket: ' + self.path)
+        try:
+            self.connect(1).close()
+        except ConnectionRefusedError:
+            os.unlink(self.path)
+        else:
+            raise OSError('address already in use: ' + str(self))
+
+    def __str__(self) -> str:
+        return UNIX_PREFIX + self.path
+
+
+def create_transport(host: str, port: int) -> Transport:
+    """
+    Creates transport of address
+
+    :param host: IP address, or unix:path of Unix domain socket
+    :param port: port number [ignored for Unix domain socket]
+    """
+    if host.startswith(UNIX_PREFIX):
+        return UnixTransport(host[len(UNIX_PREFIX):])
+    return TcpTransport(host, port)
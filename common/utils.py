@@ -1,5 +1,8 @@
-import datetime
+from common import logger
+
+# logger of messages logged with log
+MAIN = logger.get_logger('main')
 
 
 def log(msg: str, is_error: bool = False) -> None:
-    print(str(datetime.datetime.time(datetime.datetime.now())) + ' - ' + ("ERROR: " if is_error else "") + msg)
+    MAIN.log(logger.ERROR if is_error else logger.INFO, msg)
@@ -1,7 +1,8 @@
 # connection utils
 LOCAL_HOST = '127.0.0.1'
 PORT = 1500
-DATAGRAM_SIZE = 248
+DATAGRAM_SIZE = 248  # in bits
+DATAGRAM_BYTES = DATAGRAM_SIZE // 8  # 31
 
 
 # datagram consts
@@ -20,6 +21,7 @@ class Mode:
     QUERY_BY_RESULT_ID = 4   # 100
     ERROR = 5                # 101
     IS_ALIVE = 6             # 110
+    RESULT_BLOCK = 7         # 111 [session query answered in blocks, protocol v2 only]
 
     QUERY_BY_SESSION_ID_CMD = 'session'
     QUERY_BY_RESULT_ID_CMD = 'result'
@@ -40,6 +42,8 @@ class Mode:
             return 'ERROR'
         elif code == Mode.IS_ALIVE:
             return 'IS_ALIVE'
+        elif code == Mode.RESULT_BLOCK:
+            return 'RESULT_BLOCK'
         else:
             return 'unknown method'
 
@@ -57,6 +61,9 @@ class Operation:
     BIN_COE = 3  # 11
     BIN_COE_CMD = 'aCb'  # Binomial coefficient
 
+    # number of known operations [protocol v2 has room for 256]
+    COUNT = 4
+
     @staticmethod
     def name_from_code(code: int) -> str:
         if code == Operation.POWER:
@@ -77,6 +84,8 @@ class Error:
     NOT_EXISTING_DATA = 4       # 100
     INVALID_ARGUMENT = 5        # 101
     MAX_VALUE_EXCEEDED = 6      # 110
+    OVERLOADED = 7              # 111
+    NO_FREE_SESSION_ID = 8      # 1000
 
     @staticmethod
     def name_from_code(code: int) -> str:
@@ -94,6 +103,10 @@ class Error:
             return 'INVALID_ARGUMENT'
         elif code == Error.MAX_VALUE_EXCEEDED:
             return 'MAX_VALUE_EXCEEDED'
+        elif code == Error.OVERLOADED:
+            return 'OVERLOADED'
+        elif code == Error.NO_FREE_SESSION_ID:
+            return 'NO_FREE_SESSION_ID'
         else:
             return 'unknown error'
 
@@ -1,24 +1,36 @@
 import sys
-import socket
 import bitstring
 import time
 from threading import Thread, Lock
 from common import utils
-from common.values import Status, Mode, Operation, LOCAL_HOST, PORT, DATAGRAM_SIZE, Error
+from common.values import Status, Mode, Operation, LOCAL_HOST, PORT, Error
 from common.Datagram import Datagram
-from typing import List
+from common.framing import FrameReader
+from common.protocol import Codec, ResultBlock, VERSION_1, LATEST_VERSION
+from common.transport import create_transport
+from itertools import islice
+from typing import List, Tuple, Iterator
 
 
 class Client:
     """ Implementation of client application """
 
-    def __init__(self, host: str, port: int) -> None:
+    def __init__(self, host: str, port: int, protocol_version: int = LATEST_VERSION) -> None:
+        """
+        :param host: IP address of the server, or unix:path of its Unix domain socket
+        :param port: port number of the server
+        :param protocol_version: highest protocol version to speak [server may grant lower]
+        """
         self.host = host
         self.port = port
+        self.transport = create_transport(host, port)
+        self.protocol_version = protocol_version
+        self.codec = Codec()
         self.session_id = 0
         self.connected = False
         self.connected_lock = Lock()
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket = None
+        self.reader: FrameReader = None
         self.is_alive_handler = None
 
     def start(self):
@@ -88,6 +100,28 @@ class Client:
                 else:
                     print('invalid command')
 
+    def compute_many(self, operations: List[Tuple[int, float, float]]) -> List[Datagram]:
+        """
+        Makes many calculations in one round trip
+
+        All requests are sent at once as a batch [last flag set only on the final one] and the server answers
+        with one datagram per request.
+
+        :param operations: list of (operation code, a, b)
+        :return: answers in order of operations, failed calculations have status ERROR and error code in a
+        """
+        if not operations:
+            return []
+
+        datagrams = [
+            Datagram(Status.NEW, Mode.OPERATION, self.session_id, operation, a, b, last=False)
+            for operation, a, b in operations
+        ]
+        datagrams[-1].last = True
+
+        with self.connected_lock:
+            return self.__send_datagrams(datagrams)
+
     def __send_datagram(self, datagram: Datagram) -> List[Datagram]:
         """
         Sends data to the server
@@ -95,17 +129,34 @@ class Client:
         :param datagram: data to send
         :return: list of answers
         """
-        self.socket.sendall(datagram.get_bytes())
-        answer = list()
+        return self.__send_datagrams([datagram])
+
+    def __send_datagrams(self, datagrams: List[Datagram]) -> List[Datagram]:
+        """
+        Sends many datagrams to the server at once
+
+        :param datagrams: data to send, last flag of the final datagram ends the request
+        :return: list of answers
+        """
+        correlation_id = self.codec.next_correlation_id()
+        for datagram in datagrams:
+            datagram.correlation_id = correlation_id
+        self.socket.sendall(b''.join(self.codec.encode(datagram) for datagram in datagrams))
+        return self.codec.fill_in(list(self.__receive_answers()), datagrams)
+
+    def __receive_answers(self) -> Iterator[Datagram]:
+        """
+        Receives answers for the request sent
+
+        :return: answers as they arrive, until the one with last flag
+        """
         last = False
 
         # receive data until last flag is send to true
         while last is False:
-            # get data
-            answer_bin = self.socket.recv(DATAGRAM_SIZE)
             try:
-                # decode data
-                answer_data = Datagram.from_bytes(answer_bin)
+                # get and decode data
+                answer_data = self.codec.read(self.reader)
             except (bitstring.ReadError, ValueError, TypeError) as e:
                 # if data was unreadable
                 utils.log('error reading datagram: ' + str(e), True)
@@ -118,7 +169,8 @@ class Client:
                 # proceed received errors
                 if answer_data.status == Status.ERROR:
                     print(
-                        'error on server: ' + Mode.name_from_code(answer_data.mode) + ' - ' + Error.name_from_code(answer_data.a)
+                        'error on server: ' + Mode.name_from_code(answer_data.mode) + ' - ' +
+                        Error.name_from_code(answer_data.a)
                     )
                 elif answer_data.status == Status.REFUSED:
                     print(
@@ -126,27 +178,84 @@ class Client:
                         ' reason: ' + Error.name_from_code(answer_data.a)
                     )
 
-                # add received data to answers
-                answer.append(answer_data)
+                # pass received data on
+                yield answer_data
+
+    def iter_session_results(self, after_result_id: int = 0) -> Iterator[Datagram]:
+        """
+        Gets results of the session as they arrive
+
+        Results are not collected, so memory used does not depend on the size of the session history. Connection
+        is reserved until iteration ends, answers left when it is abandoned are discarded on close.
+
+        :param after_result_id: get only results with greater id [e.g. to resume interrupted query]
+        :return: answers of the server in order of result ids
+        """
+        with self.connected_lock:
+            datagram = Datagram(Status.NEW, Mode.QUERY_BY_SESSION_ID, self.session_id, result_id=after_result_id)
+            datagram.correlation_id = self.codec.next_correlation_id()
+            self.socket.sendall(self.codec.encode(datagram))
+            answers = self.__receive_answers()
+            try:
+                for answer in answers:
+                    yield answer
+            finally:
+                # read the rest, so it is not taken as answers for next request
+                for _ in answers:
+                    pass
+
+    def iter_result_blocks(self, after_result_id: int = 0, block_size: int = 1024) -> Iterator[ResultBlock]:
+        """
+        Gets results of the session in blocks
+
+        Block holds results in columns [arrays of result ids, operations, numbers and results], which are decoded
+        at once instead of datagram per result. Server speaking protocol version 1 sends datagrams, which are then
+        gathered into blocks of block_size results.
+
+        :param after_result_id: get only results with greater id [e.g. to resume interrupted query]
+        :param block_size: number of results in block made from datagrams
+        :return: blocks in order of result ids, none if session has no results
+        """
+        if self.codec.version == VERSION_1:
+            results = (answer for answer in self.iter_session_results(after_result_id) if answer.status == Status.OK)
+            block = list(islice(results, block_size))
+            while block:
+                next_block = list(islice(results, block_size))
+                yield ResultBlock.from_datagrams(block, last=not next_block)
+                block = next_block
+            return
 
-        return answer
+        with self.connected_lock:
+            datagram = Datagram(Status.NEW, Mode.RESULT_BLOCK, self.session_id, result_id=after_result_id)
+            datagram.correlation_id = self.codec.next_correlation_id()
+            self.socket.sendall(self.codec.encode(datagram))
+            answers = self.__receive_answers()
+            try:
+                for answer in answers:
+                    if answer.status == Status.OK:
+                        yield answer
+            finally:
+                for _ in answers:
+                    pass
 
     def __connect(self) -> None:
         """ Connects to the server """
 
         self.connected_lock.acquire()
-        utils.log('connecting to : ' + self.host + ':' + str(self.port))
+        utils.log('connecting to : ' + str(self.transport))
         # connect to the server
-        self.socket.connect((self.host, self.port))
-        # get session id
-        datagram = Datagram(Status.NEW, Mode.CONNECT)
+        self.socket = self.transport.connect()
+        self.reader = FrameReader(self.socket)
+        # get session id [and protocol version, older servers grant none, so version 1 is kept]
+        datagram = Datagram(Status.NEW, Mode.CONNECT, b=self.protocol_version)
         answer = self.__send_datagram(datagram)[0]
         self.session_id = answer.session_id
         if answer.status == Status.OK:
-            utils.log('connected to : ' + self.host + ':' + str(self.port))
+            self.codec.upgrade(int(answer.b), self.session_id)
+            utils.log('connected to : ' + str(self.transport))
             self.connected = True
         else:
-            utils.log(self.host + ':' + str(self.port) + ' refused to connect')
+            utils.log(str(self.transport) + ' refused to connect')
             self.connected = False
         self.connected_lock.release()
 
@@ -154,18 +263,18 @@ class Client:
         """ Disconnects from the server """
 
         self.connected_lock.acquire()
-        utils.log('disconnecting from : ' + self.host + ':' + str(self.port))
+        utils.log('disconnecting from : ' + str(self.transport))
         # send disconnect request
         datagram = Datagram(Status.NEW, Mode.DISCONNECT, self.session_id)
         answer = self.__send_datagram(datagram)[0]
         if answer.status == Status.OK:
-            utils.log('disconnected from : ' + self.host + ':' + str(self.port))
+            utils.log('disconnected from : ' + str(self.transport))
             # close connection
             self.socket.close()
             self.connected = False
         else:
             utils.log(
-                'cannot disconnect from : ' + self.host + ':' + str(self.port) + ' error code: ' + str(answer.a),
+                'cannot disconnect from : ' + str(self.transport) + ' error code: ' + str(answer.a),
                 True
             )
         self.connected_lock.release()
@@ -194,15 +303,15 @@ class Client:
 
     def __operation(self, operation: int, a: float, b: float):
         datagram = Datagram(Status.NEW, Mode.OPERATION, self.session_id, operation, a, b)
-        answer = self.__send_datagram(datagram)[0]
+        # heartbeat thread shares the connection
+        with self.connected_lock:
+            answer = self.__send_datagram(datagram)[0]
         if answer.status == Status.OK:
             print(str(answer.result) + '\t:' + str(answer.result_id))
 
     def __query_by_session_id(self):
-        datagram = Datagram(Status.NEW, Mode.QUERY_BY_SESSION_ID, self.session_id)
-        answer = self.__send_datagram(datagram)
-        if answer[0].status == Status.OK:
-            for result in answer:
+        for result in self.iter_session_results():
+            if result.status == Status.OK:
                 print('session_id = ' + str(result.session_id) + "\t" +
                       ' result id = ' + str(result.result_id) + "\t" +
                       ' operation: ' + str(Operation.name_from_code(result.operation)) + "\t" +
@@ -212,7 +321,8 @@ class Client:
 
     def __query_by_result_id(self, result_id: int):
         datagram = Datagram(Status.NEW, Mode.QUERY_BY_RESULT_ID, self.session_id, result_id=result_id)
-        answer = self.__send_datagram(datagram)[0]
+        with self.connected_lock:
+            answer = self.__send_datagram(datagram)[0]
         if answer.status == Status.OK:
             # TODO: [Artur] improve presentation of result
             print('session_id = ' + str(answer.session_id) + "\t" +
@@ -1,44 +1,175 @@
+import argparse
+import asyncio
+import multiprocessing
 import socket
-import sys
-from math import factorial, log, sqrt
+from concurrent.futures import CancelledError as FutureCancelledError, TimeoutError as FutureTimeoutError
+from time import monotonic, perf_counter_ns
 
 import bitstring
-from threading import Thread, Lock
+from threading import Thread, Event
 
 from common.Datagram import Datagram
-from common import utils
-from common.values import Status, Mode, Operation, LOCAL_HOST, PORT, Error, DATAGRAM_SIZE
-from typing import List
+from common import logger, utils
+from common.framing import FrameReader, FrameWriter
+from common.protocol import Codec, ResultBlock, VERSION_1, LATEST_VERSION
+from common.transport import create_transport, UNIX_PREFIX
+from common.values import Status, Mode, Operation, LOCAL_HOST, PORT, Error
+from server.admission import AdmissionControl, COSTS, QUERY_COST
+from server.cache import ResultCache
+from server.ids import IdAllocator
+from server.idle import IdleTracker
+from server.metrics import Metrics, MetricsEndpoint
+from server.operations import calculate
+from server.retention import RetentionPolicy
+from server.storage import Result, ResultStore, create_store, create_shared_store
+from server.vectorized import calculate_many
+from typing import Callable, List, Optional, Tuple, Iterable, Iterator
+
+# logger of requests [called for every calculation and query, so it can be sampled, rate limited or turned off]
+CALLS = logger.get_logger('calls')
+
+# address of embedded sessions in logs
+EMBEDDED_ADDRESS = ('embedded', 0)
 
 
 class Server(Thread):
     """ Implementation of server application """
 
-    def __init__(self, host: str, port: int) -> None:
+    # number of results read from storage at once when answering session query
+    QUERY_PAGE_SIZE = 1024
+    # size of chunks in which answers are sent [B]
+    SEND_CHUNK_SIZE = 64 * 1024
+    # number of heartbeats session may miss before it is closed as idle
+    MISSED_HEARTBEATS = 3
+    # maximal number of requests in batch, longer batch is refused with MAX_VALUE_EXCEEDED error
+    MAX_BATCH = 4096
+    # time between evictions of results over age and over limit of all sessions [s]
+    RESULTS_EXPIRY_INTERVAL = 1.0
+    # number of result ids handler thread leases at once [session ids are only 16 bits, so they are taken one by one]
+    RESULT_ID_BLOCK = 64
+    # greatest session id [16 bits on the wire], then ids wrap around to those of sessions which are gone
+    MAX_SESSION_ID = 0xFFFF
+
+    def __init__(
+            self, host: str, port: int,
+            results_storage: ResultStore = None, worker: int = 0, workers: int = 1,
+            cache_size: int = 65536, cache_ttl: float = 600, results_dir: str = None,
+            heartbeat_interval: float = 1.0, max_heartbeat_interval: float = 60, metrics_port: int = None,
+            session_rate: float = 0, session_burst: float = 0, global_rate: float = 0, global_burst: float = 0,
+            max_pending: int = 1024, retention: RetentionPolicy = None
+    ) -> None:
         """
-        :param host: IP address to serve application on
-        :param port: port number to serve application on
+        :param host: IP address to serve application on, or unix:path of Unix domain socket
+        :param port: port number to serve application on [ignored for Unix domain socket]
+        :param results_storage: storage of results, shared when server is one of many workers
+        :param worker: index of this server among workers serving the same port
+        :param workers: number of workers serving the same port
+        :param cache_size: maximal number of cached calculation outcomes, 0 disables cache
+        :param cache_ttl: time after which cached outcome expires [s]
+        :param results_dir: directory of persistent result log, results are kept in memory if not given
+        :param heartbeat_interval: time between IS_ALIVE requests of clients which do not ask for other one [s]
+        :param max_heartbeat_interval: longest time between IS_ALIVE requests client can ask for [s]
+        :param metrics_port: local port of metrics endpoint, no endpoint if not given
+        :param session_rate: work units per second allowed to one session, 0 for no limit [see admission.COSTS]
+        :param session_burst: work units session can use at once, session_rate if 0
+        :param global_rate: work units per second allowed to all sessions together, 0 for no limit
+        :param global_burst: work units all sessions can use at once, global_rate if 0
+        :param max_pending: maximal work units being handled at once, 0 for no limit
+        :param retention: limits of results kept in memory, all results are kept if not given [not used with
+        results_dir or shared storage]
         """
         super().__init__(name='server')
 
         # initialize members
         self.host = host
         self.port = port
+        self.transport = create_transport(host, port)
         self.on = True
+        # let other workers listen on the same port
+        self.reuse_port = workers > 1
 
-        # create empty dict for storing open sessions and counter of session ids
+        # create storage of results [close it on stop only if it is not shared]
+        self.owns_storage = results_storage is None
+        self.results_storage = create_store(results_dir, retention) if self.owns_storage else results_storage
+        self.results_expired = monotonic()
+        # continue ids after those already in storage
+        next_session_id, next_result_id = self.results_storage.next_ids()
+
+        # create empty dict for storing open sessions and allocator of session ids [unique among workers]
         self.sessions = {}
-        self.next_id = 1
-        self.next_id_lock = Lock()
+        # sessions of callers in the server process [see client.embedded], they are keys of sessions as well
+        self.embedded = set()
+        self.session_ids = IdAllocator(
+            self.__first_id(next_session_id, worker, workers), workers, limit=self.MAX_SESSION_ID
+        )
+        # create empty dict for storing batches of operations being received by sessions [None when batch was dropped
+        # and its remaining requests are ignored]
+        self.batches = {}
+
+        # create allocator of result ids [unique among workers, handler threads lease them in blocks]
+        self.result_ids = IdAllocator(
+            self.__first_id(next_result_id, worker, workers), workers, self.RESULT_ID_BLOCK
+        )
+
+        # create cache of recent calculations
+        self.cache = ResultCache(cache_size, cache_ttl)
+
+        # create tracker of idle sessions [sessions silent for MISSED_HEARTBEATS intervals are closed]
+        self.heartbeat_interval = heartbeat_interval
+        self.max_heartbeat_interval = max_heartbeat_interval
+        self.idle = IdleTracker()
 
-        # create empty dict for storing open sessions and counter of result ids
-        self.results_storage = {}
-        self.next_result_id = 1
+        # create counters and latency histograms of requests
+        self.metrics = Metrics()
+        self.metrics_port = metrics_port
+        self.metrics_endpoint: MetricsEndpoint = None
+
+        # create admission control [requests over limits are refused instead of waiting]
+        self.admission = AdmissionControl(session_rate, session_burst, global_rate, global_burst, max_pending)
+
+    @staticmethod
+    def __first_id(first_free: int, worker: int, workers: int) -> int:
+        """
+        Gets first id of worker
+
+        :param first_free: first id not used yet
+        :param worker: index of worker
+        :param workers: number of workers
+        :return: smallest id >= first_free belonging to worker [ids of worker are worker + 1 modulo workers]
+        """
+        return first_free + (worker + 1 - first_free) % workers
 
     def run(self) -> None:
         """ Starts the server """
+        if self.metrics_port:
+            self.metrics_endpoint = MetricsEndpoint(LOCAL_HOST, self.metrics_port, self.render_metrics)
+            self.metrics_endpoint.start()
+            utils.log('serving metrics on port ' + str(self.metrics_port))
         self.listen()
 
+    def close_resources(self) -> None:
+        """ Closes storage of results if server owns it and stops metrics endpoint """
+        if self.owns_storage:
+            self.results_storage.close()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+
+    def render_metrics(self) -> str:
+        """ Returns metrics of requests, sessions, cache and stored results in Prometheus text format """
+        cache = self.cache.stats()
+        results = self.results_storage.stats()
+        return self.metrics.render({
+            'sessions': len(self.sessions),
+            'cache_entries': cache['entries'],
+            'cache_hits_total': cache['hits'],
+            'cache_misses_total': cache['misses'],
+            'pending_work': self.admission.pending,
+            'requests_refused_total': self.admission.refused,
+            'results_resident': results['resident'],
+            'results_spilled': results['spilled'],
+            'results_evicted_total': results['evicted'],
+        })
+
     def stop(self) -> None:
         """ Starts the server
 
@@ -46,12 +177,17 @@ class Server(Thread):
         """
         self.on = False
         utils.log('stopping listening...')
-        for session in self.sessions:
-            # turn session off
+        for session in list(self.sessions):
+            # turn session off [embedded caller finds out on its next request]
             self.sessions[session] = False
-            # wait for client to confirm disconnection
-            session.join()
-
+            if session in self.embedded:
+                continue
+            # wait for client to confirm disconnection [or for the session to expire if client is gone]
+            while session.is_alive():
+                session.join(1)
+                self.reap_idle_sessions()
+
+        self.close_resources()
         utils.log('all sessions closed')
 
     def menu(self) -> None:
@@ -60,12 +196,18 @@ class Server(Thread):
         print('You can now use netcalc server')
         print(Mode.QUERY_BY_SESSION_ID_CMD + ' id\t: get all calculations of given session')
         print(Mode.QUERY_BY_RESULT_ID_CMD + ' id\t: get calculation by its id')
+        print('cache\t\t: show statistics of calculations cache')
+        print('metrics\t\t: show counters and latencies of requests')
         print('exit\t\t: turn off and exit netcalc server')
         while True:
             command = input()
             if command == 'exit':
                 self.stop()
                 break
+            elif command == 'cache':
+                self.cache_cmd()
+            elif command == 'metrics':
+                self.metrics_cmd()
             else:
                 command = command.split()
                 if len(command) == 2:
@@ -84,21 +226,18 @@ class Server(Thread):
     def listen(self) -> None:
         """ Listens for incoming connections """
 
-        # create socket for handling connections
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # create socket for handling connections with maximal waiting queue
+        s = self.transport.listen(5, self.reuse_port)
         # set socket timeout [makes possible to safely break listening]
         s.settimeout(1)
-        # bind socket with server address
-        s.bind((self.host, self.port))
-        # set maximal waiting queue
-        s.listen(5)
-        utils.log('listening on port ' + str(self.port))
+        utils.log('listening on ' + str(self.transport))
 
         # listen util user turns server off
         while self.on:
             try:
                 # accept connection
                 connection, address = s.accept()
+                address = self.transport.client_address(address)
                 utils.log('connected by ' + str(address))
                 # create handler for new connection [see Handler definition below]
                 handler = Handler(
@@ -109,11 +248,17 @@ class Server(Thread):
                 )
                 # add new connection to sessions storage
                 self.sessions[handler] = True
+                self.idle.add(handler, self.heartbeat_interval * self.MISSED_HEARTBEATS)
                 # handle new session
                 handler.start()
             except socket.timeout:
                 pass
+            # close sessions of clients which stopped sending [accept wakes up at least every second]
+            self.reap_idle_sessions()
+            self.expire_results()
 
+        s.close()
+        self.transport.close()
         utils.log('listening stopped')
 
     def handle_incoming_connection(self, connection: socket, address: tuple, handler: Thread) -> None:
@@ -127,77 +272,431 @@ class Server(Thread):
 
         # create variable for storing id
         session_id = 0
+        # create reader splitting incoming stream into frames, writer gathering answers and codec of frames
+        reader = FrameReader(connection)
+        writer = FrameWriter(connection, self.SEND_CHUNK_SIZE)
+        codec = Codec()
 
-        # handle requests
-        while self.sessions[handler]:
-            try:
-                # receive data
-                data = connection.recv(DATAGRAM_SIZE)
-                answer: Datagram = None
-                # noinspection PyBroadException
+        try:
+            # handle requests
+            while self.sessions[handler]:
                 try:
-                    # decode data
-                    datagram = Datagram.from_bytes(data)
-                    # utils.log('received: ' + str(datagram))
-                    answer: bytes
-                    if datagram.mode == Mode.CONNECT:
-                        answer, session_id = self.__connect(address)
-                        self.results_storage[session_id] = {}
-                    elif datagram.session_id == session_id:
-                        if datagram.mode == Mode.IS_ALIVE:
-                            answer = self.__is_alive(datagram.session_id, handler)
-                        elif datagram.mode == Mode.DISCONNECT:
-                            answer = self.__disconnect(datagram.session_id, address)
-                            self.sessions[handler] = False
-                        elif datagram.mode == Mode.OPERATION:
-                            answer = self.__operation(datagram.session_id, datagram.operation, datagram.a, datagram.b)
-                        elif datagram.mode == Mode.QUERY_BY_SESSION_ID:
-                            answer = self.__query_by_session_id(session_id, datagram.session_id, connection)
-                        elif datagram.mode == Mode.QUERY_BY_RESULT_ID:
-                            answer = self.__query_by_result_id(session_id, datagram.session_id, datagram.result_id)
-                    else:
-                        # if authorization didn't succeed
-                        answer = self.__error(Error.UNAUTHORISED)
-                except (bitstring.ReadError, ValueError, TypeError) as e:
-                    # if data was unreadable
-                    utils.log("datagram exception: " + str(e), True)
-                    answer = self.__error(Error.CANNOT_READ_DATAGRAM, Mode.ERROR, session_id)
-                except Exception as e:
-                    # if any other exception occurred
-                    utils.log("exception: " + str(e), True)
-                    answer = self.__error(Error.INTERNAL_SERVER_ERROR, Mode.ERROR, session_id)
-                finally:
-                    # send answer to the client
-                    connection.sendall(answer)
-            except (ConnectionAbortedError, ConnectionResetError):
-                # if session was closed unsafely
-                utils.log('breaking listening for session: ' + str(session_id))
+                    # send gathered answers before waiting for next request [pipelined ones are answered together]
+                    if not reader.pending(codec.header_size):
+                        writer.flush()
+                    # receive header and payload of frame [header has to be copied before reading on]
+                    header = reader.read(codec.header_size)
+                    started = perf_counter_ns()
+                    try:
+                        size = codec.payload_size(header)
+                    except ValueError as e:
+                        writer.write(self.unreadable_frame(codec, session_id, e))
+                        self.sessions[handler] = False
+                        continue
+                    payload = b''
+                    if size:
+                        header = bytes(header)
+                        payload = reader.read(size)
+                    mode, operation = codec.peek(header, payload)
+                    self.metrics.start()
+                    try:
+                        answers, session_id = self.handle_frame(codec, header, payload, session_id, address, handler)
+                        # gather answers for the client [writer blocks while client does not keep up]
+                        for answer in answers:
+                            writer.write(answer)
+                    finally:
+                        # aborted request is counted as well, so it does not stay in flight
+                        self.metrics.observe(mode, operation, perf_counter_ns() - started)
+                    # long answer does not count as idle time
+                    self.idle.touch(handler)
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                    # if session was closed unsafely
+                    utils.log('breaking listening for session: ' + str(session_id))
+                    self.sessions[handler] = False
+        except Exception as e:
+            # unexpected error must not leave the session behind
+            utils.log('session ' + str(session_id) + ' failed: ' + repr(e), True)
+        finally:
+            # after closing session send last answers and safely close connection
+            try:
+                writer.flush()
+            except OSError:
+                pass
+            self.drop_batch(handler)
+            self.idle.remove(handler)
+            self.admission.remove_session(handler)
+            connection.close()
+            del self.sessions[handler]
+            self.end_session(session_id)
+            utils.log('session closed: ' + str(session_id))
+
+    def end_session(self, session_id: int) -> None:
+        """
+        Lets storage release results of session which ended [nobody else can query them]
+
+        :param session_id: id of the session, 0 if it never connected
+        """
+        if session_id:
+            self.results_storage.end_session(session_id)
+
+    def expire_results(self) -> None:
+        """ Lets storage evict results over limits of retention, at most once per RESULTS_EXPIRY_INTERVAL """
+        now = monotonic()
+        if now - self.results_expired >= self.RESULTS_EXPIRY_INTERVAL:
+            self.results_expired = now
+            self.results_storage.expire()
+
+    def reap_idle_sessions(self) -> None:
+        """ Closes sessions which did not send anything for MISSED_HEARTBEATS of their heartbeat intervals """
+        for handler in self.idle.expire():
+            if handler in self.embedded:
+                # embedded caller has nothing to wake up, it finds out on its next request
+                utils.log('closing idle embedded session')
                 self.sessions[handler] = False
+            elif handler in self.sessions:
+                utils.log('closing idle session')
+                self.drop_session(handler)
+
+    def drop_session(self, handler: object) -> None:
+        """
+        Closes session without waiting for the client
+
+        :param handler: handler of session
+        """
+        self.sessions[handler] = False
+        # wake up handler waiting for data [it finishes as if client disconnected]
+        try:
+            handler.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def open_embedded(self, session: object) -> None:
+        """
+        Registers session of a caller in the server process
+
+        :param session: key of the session [see client.embedded.EmbeddedConnection]
+        """
+        self.embedded.add(session)
+        self.sessions[session] = self.on
+        self.idle.add(session, self.heartbeat_interval * self.MISSED_HEARTBEATS)
+
+    def handle_embedded(self, session: object, session_id: int, datagrams: List[Datagram]) -> (List[Datagram], int):
+        """
+        Handles request of embedded session
+
+        Datagrams are passed to handle_request as they are and its answers are returned without encoding, so the
+        request costs neither a socket nor a codec.
+
+        :param session: key of the session
+        :param session_id: id of session given to the caller so far [0 if not connected yet]
+        :param datagrams: datagrams of the request
+        :return: (answers, session_id after the request)
+        :raises ConnectionAbortedError: if the session was closed by the server
+        """
+        if not self.sessions.get(session):
+            raise ConnectionAbortedError('session closed by server')
+
+        answers = []
+        for datagram in datagrams:
+            started = perf_counter_ns()
+            # the same datagrams are refused as by codecs of connections
+            if not 0 <= datagram.mode <= Mode.RESULT_BLOCK or not 0 <= datagram.operation < Operation.COUNT:
+                answers.append(self.__error(Error.CANNOT_READ_DATAGRAM, Mode.ERROR, session_id))
+                continue
+            self.metrics.start()
+            try:
+                handled, session_id = self.handle_request(datagram, session_id, EMBEDDED_ADDRESS, session)
+                answers.extend(handled)
+            finally:
+                # aborted request is counted as well, so it does not stay in flight
+                self.metrics.observe(datagram.mode, datagram.operation, perf_counter_ns() - started)
+        self.idle.touch(session)
+        return answers, session_id
+
+    def close_embedded(self, session: object, session_id: int = 0) -> None:
+        """
+        Forgets embedded session after its caller disconnected
+
+        :param session: key of the session
+        :param session_id: id of the session, 0 if it never connected
+        """
+        self.sessions.pop(session, None)
+        self.embedded.discard(session)
+        self.drop_batch(session)
+        self.idle.remove(session)
+        self.admission.remove_session(session)
+        self.end_session(session_id)
+
+    def handle_frame(
+            self, codec: Codec, header: bytes, payload: bytes, session_id: int, address: tuple, handler: object
+    ) -> (Iterable[bytes], int):
+        """
+        Handles one frame of session
+
+        It does not touch the connection, so it is shared by all server engines. Codec of the connection is upgraded
+        to the protocol version agreed on in CONNECT after its answer is encoded.
+
+        :param codec: codec of the connection
+        :param header: header of received frame
+        :param payload: payload of received frame
+        :param session_id: id of session given to the connection so far [0 if not connected yet]
+        :param address: address of client
+        :param handler: handler object, key in sessions storage
+        :return: (answers to send to the client [may be lazy], session_id of the connection after the request)
+        """
+        try:
+            datagram = codec.decode(header, payload)
+        except (bitstring.ReadError, ValueError, TypeError) as e:
+            return [self.unreadable_frame(codec, session_id, e)], session_id
+
+        if datagram.mode == Mode.RESULT_BLOCK and codec.version == VERSION_1:
+            # result blocks do not fit into version 1 datagrams
+            error = ValueError('result blocks need protocol version 2')
+            return [self.unreadable_frame(codec, session_id, error)], session_id
+
+        answers, session_id = self.handle_request(datagram, session_id, address, handler)
+
+        if datagram.mode == Mode.CONNECT:
+            encoded = [codec.encode(answer) for answer in answers]
+            if answers[0].status == Status.OK:
+                codec.upgrade(int(answers[0].b), session_id)
+            return encoded, session_id
+        return self.__encoded(codec, answers, datagram.correlation_id), session_id
+
+    def unreadable_frame(self, codec: Codec, session_id: int, e: Exception) -> bytes:
+        """
+        Answers frame which could not be decoded
+
+        :param codec: codec of the connection
+        :param session_id: id of session of the connection
+        :param e: decoding error
+        :return: encoded error answer
+        """
+        utils.log("datagram exception: " + str(e), True)
+        return codec.encode(self.__error(Error.CANNOT_READ_DATAGRAM, Mode.ERROR, session_id))
 
-        # after closing session safely close connection
-        connection.close()
-        utils.log('session closed: ' + str(session_id))
+    @staticmethod
+    def __encoded(codec: Codec, answers: Iterable[Datagram], correlation_id: int) -> Iterator[bytes]:
+        """
+        Encodes answers of one request
+
+        :param codec: codec of the connection
+        :param answers: answers of the request
+        :param correlation_id: correlation id of the request [requests of a batch share it]
+        """
+        for answer in answers:
+            answer.correlation_id = correlation_id
+            yield codec.encode(answer)
+
+    def handle_request(
+            self, datagram: Datagram, session_id: int, address: tuple, handler: object
+    ) -> (Iterable[Datagram], int):
+        """
+        Handles one decoded request of session
+
+        :param datagram: received request
+        :param session_id: id of session given to the connection so far [0 if not connected yet]
+        :param address: address of client
+        :param handler: handler object, key in sessions storage
+        :return: (answers for the client [may be lazy], session_id of the connection after the request)
+        """
+
+        answer: Datagram = None
+        # noinspection PyBroadException
+        try:
+            # utils.log('received: ' + str(datagram))
+            self.idle.touch(handler)
+            if datagram.mode == Mode.CONNECT:
+                interval = self.__heartbeat_interval(datagram.a)
+                answer, session_id = self.__connect(address, interval, self.__protocol_version(datagram.b))
+                if session_id:
+                    self.results_storage.add_session(session_id)
+                    self.idle.add(handler, interval * self.MISSED_HEARTBEATS)
+            elif datagram.session_id == session_id:
+                if datagram.mode == Mode.IS_ALIVE:
+                    answer = self.__is_alive(datagram.session_id, handler)
+                elif datagram.mode == Mode.DISCONNECT:
+                    answer = self.__disconnect(datagram.session_id, address)
+                    self.sessions[handler] = False
+                elif datagram.mode == Mode.OPERATION and (not datagram.last or handler in self.batches):
+                    return self.__collect(handler, datagram), session_id
+                elif datagram.mode == Mode.OPERATION:
+                    answers = self.__admitted(
+                        handler, datagram.session_id, Mode.OPERATION, [datagram.operation],
+                        lambda: [self.__operation(datagram.session_id, datagram.operation, datagram.a, datagram.b)]
+                    )
+                    return answers, session_id
+                elif datagram.mode == Mode.QUERY_BY_SESSION_ID:
+                    answers = self.__admitted(
+                        handler, datagram.session_id, Mode.QUERY_BY_SESSION_ID, [0],
+                        lambda: self.__query_by_session_id(session_id, datagram.session_id, datagram.result_id)
+                    )
+                    return answers, session_id
+                elif datagram.mode == Mode.RESULT_BLOCK:
+                    answers = self.__admitted(
+                        handler, datagram.session_id, Mode.RESULT_BLOCK, [0],
+                        lambda: self.__query_by_session_id(
+                            session_id, datagram.session_id, datagram.result_id, Mode.RESULT_BLOCK
+                        )
+                    )
+                    return answers, session_id
+                elif datagram.mode == Mode.QUERY_BY_RESULT_ID:
+                    answer = self.__query_by_result_id(session_id, datagram.session_id, datagram.result_id)
+            else:
+                # if authorization didn't succeed
+                answer = self.__error(Error.UNAUTHORISED)
+        except Exception as e:
+            # if any other exception occurred
+            utils.log("exception: " + str(e), True)
+            answer = self.__error(Error.INTERNAL_SERVER_ERROR, Mode.ERROR, session_id)
+
+        return ([answer] if answer else []), session_id
+
+    def __collect(self, handler: object, datagram: Datagram) -> List[Datagram]:
+        """
+        Collects request of batch and handles the batch after its last request
+
+        Tokens of every request are taken when it arrives, pending work of the whole batch is checked after its last
+        request [see __admitted]. Batch whose request is refused or which would be longer than MAX_BATCH is dropped:
+        it gets one answer with last flag right away and its remaining requests are ignored.
+
+        :param handler: handler object, key of session
+        :param datagram: request of the batch
+        :return: answers, empty until the batch is handled or dropped
+        """
+        batch = self.batches.get(handler, [])
+        if batch is None:
+            # rest of dropped batch
+            if datagram.last:
+                del self.batches[handler]
+            return []
+
+        if len(batch) >= self.MAX_BATCH:
+            self.drop_batch(handler, not datagram.last)
+            return [self.__error(Error.MAX_VALUE_EXCEEDED, Mode.OPERATION, datagram.session_id, datagram.operation)]
+        wait = self.admission.charge(handler, COSTS[datagram.operation])
+        if wait is not None:
+            self.drop_batch(handler, not datagram.last)
+            CALLS.warning('refused batch of session: %d, retry after %.3f s', datagram.session_id, wait)
+            return [
+                Datagram(
+                    Status.REFUSED, Mode.OPERATION, datagram.session_id, datagram.operation,
+                    a=Error.OVERLOADED, b=wait
+                )
+            ]
+
+        batch.append(datagram)
+        self.batches[handler] = batch
+        if not datagram.last:
+            return []
+        del self.batches[handler]
+        return self.__admitted(
+            handler, datagram.session_id, Mode.OPERATION, [request.operation for request in batch],
+            lambda: self.__operations(datagram.session_id, batch), True
+        )
+
+    def drop_batch(self, handler: object, ignore_rest: bool = False) -> None:
+        """
+        Forgets batch being collected
+
+        :param handler: handler object, key of session
+        :param ignore_rest: ignore remaining requests of the batch until its last one
+        """
+        self.batches.pop(handler, None)
+        if ignore_rest:
+            self.batches[handler] = None
+
+    def __admitted(
+            self, handler: object, session_id: int, mode: int, operations: List[int],
+            handle: Callable[[], Iterable[Datagram]], charged: bool = False
+    ) -> Iterable[Datagram]:
+        """
+        Handles request if admission control admits it
+
+        Answers of session query are produced lazily, so only reading of their first page counts as pending work.
+
+        :param handler: handler object, key of session
+        :param session_id: id of session
+        :param mode: mode of request
+        :param operations: operations of request, one per answer [operation 0 for queries]
+        :param handle: function handling the request and returning its answers
+        :param charged: tokens were taken already as requests of batch arrived
+        :return: answers of the request or REFUSED answer for every operation of request
+        """
+        cost = sum(COSTS[operation] for operation in operations) if mode == Mode.OPERATION else QUERY_COST
+        wait = self.admission.admit(handler, cost, charged)
+        if wait is not None:
+            CALLS.warning('refused %s of session: %d, retry after %.3f s', Mode.name_from_code(mode), session_id, wait)
+            return [
+                Datagram(
+                    Status.REFUSED, mode, session_id, operation, a=Error.OVERLOADED, b=wait,
+                    last=i == len(operations) - 1
+                )
+                for i, operation in enumerate(operations)
+            ]
 
-    def __connect(self, address: tuple) -> (bytes, int):
+        try:
+            return handle()
+        finally:
+            self.admission.done(cost)
+
+    def __connect(self, address: tuple, heartbeat_interval: float, version: int) -> (Datagram, int):
         """
         Establish new session
 
         :param address: client address
-        :return: (answer to the client , given session_id)
+        :param heartbeat_interval: time between IS_ALIVE requests granted to the client [s]
+        :param version: protocol version granted to the client
+        :return: (answer to the client , given session_id) [REFUSED answer and 0 if all session ids are in use]
         """
 
         # get id
-        self.next_id_lock.acquire()
-        given_id = self.next_id
-        self.next_id += 1
-        self.next_id_lock.release()
-        # prepare answer
-        answer = Datagram(Status.OK, Mode.CONNECT, given_id)
-        utils.log('new session: ' + str(given_id) + ' : ' + str(address[0]))
-        return answer.get_bytes(), given_id
+        given_id = self.__free_session_id()
+        if given_id is None:
+            utils.log('refused session of ' + str(address[0]) + ': all session ids are in use', True)
+            return Datagram(Status.REFUSED, Mode.CONNECT, a=Error.NO_FREE_SESSION_ID), 0
+        # prepare answer [granted heartbeat interval is sent in a, protocol version in b]
+        answer = Datagram(Status.OK, Mode.CONNECT, given_id, a=heartbeat_interval, b=version)
+        utils.log('new session: ' + str(given_id) + ' : ' + str(address[0]) + ' protocol v' + str(version))
+        return answer, given_id
+
+    def __free_session_id(self) -> Optional[int]:
+        """
+        Gives id for new session, skipping ids which after wrapping around still belong to sessions in storage
+
+        :return: session id or None if all ids of this worker are in use
+        """
+        for _ in range(self.MAX_SESSION_ID // self.session_ids.step + 1):
+            session_id = self.session_ids.next()
+            if self.results_storage.is_session_id_free(session_id):
+                return session_id
+        return None
 
     @staticmethod
-    def __disconnect(session_id: int, address: tuple) -> bytes:
+    def __protocol_version(requested: float) -> int:
+        """
+        Negotiates protocol version of new session
+
+        :param requested: version asked for by the client in b of CONNECT request, 0 for clients knowing only v1
+        :return: granted version
+        """
+        if not requested >= VERSION_1:
+            return VERSION_1
+        return int(min(requested, LATEST_VERSION))
+
+    def __heartbeat_interval(self, requested: float) -> float:
+        """
+        Negotiates heartbeat interval of new session
+
+        :param requested: interval asked for by the client in a of CONNECT request [s], 0 for default
+        :return: granted interval [s]
+        """
+        if not requested > 0:
+            return self.heartbeat_interval
+        return min(requested, self.max_heartbeat_interval)
+
+    @staticmethod
+    def __disconnect(session_id: int, address: tuple) -> Datagram:
         """
         Closes session
 
@@ -207,9 +706,9 @@ class Server(Thread):
         """
         answer = Datagram(Status.OK, Mode.DISCONNECT, session_id)
         utils.log('removed session: ' + str(session_id) + ' : ' + str(address))
-        return answer.get_bytes()
+        return answer
 
-    def __is_alive(self, session_id: int, handler: Thread) -> bytes:
+    def __is_alive(self, session_id: int, handler: Thread) -> Datagram:
         """
         Handles is alive request
 
@@ -224,9 +723,9 @@ class Server(Thread):
             answer = Datagram(Status.OK, Mode.IS_ALIVE, session_id)
         else:
             answer = Datagram(Status.REFUSED, Mode.IS_ALIVE, session_id)
-        return answer.get_bytes()
+        return answer
 
-    def __operation(self, session_id: int, operation: int, num_a: float, num_b: float) -> bytes:
+    def __operation(self, session_id: int, operation: int, num_a: float, num_b: float) -> Datagram:
         """
         Makes requested calculations
 
@@ -237,84 +736,165 @@ class Server(Thread):
         :return: answer for the client
         """
 
-        utils.log('received call for ' + Operation.name_from_code(operation) + ' from session: ' + str(session_id))
+        CALLS.info('received call for %s from session: %d', Operation.name_from_code(operation), session_id)
 
         answer = Datagram(Status.OK, Mode.OPERATION, session_id, operation, num_a, num_b)
-        answer.result_id = self.next_result_id
-        result: float
+        result, error = self.__calculate(operation, num_a, num_b)
 
-        try:
-            if operation == Operation.POWER:
-                result = num_a**num_b
-            elif operation == Operation.LOG:
-                result = log(num_b)/log(num_a)
-            elif operation == Operation.GEO_MEAN:
-                if num_a*num_b < 0:
-                    return self.__error(5, Mode.OPERATION, session_id, operation)
-                result = sqrt(num_a*num_b)
-            elif operation == Operation.BIN_COE:
-                if num_b > num_a or num_a < 0 or num_b < 0:
-                    return self.__error(5, Mode.OPERATION, session_id, operation)
-                result = factorial(num_a)/(factorial(num_a-num_b)*factorial(num_b))
-        except OverflowError:
-            return self.__error(Error.MAX_VALUE_EXCEEDED, Mode.OPERATION, session_id, operation)
-
-        if result == float('inf'):
-            return self.__error(Error.MAX_VALUE_EXCEEDED, Mode.OPERATION, session_id, operation)
-
-        self.results_storage[session_id][self.next_result_id] = \
-            (operation, num_a, num_b, session_id, result, self.next_result_id)
-
-        self.next_result_id += 1
+        if error is not None:
+            return self.__error(error, Mode.OPERATION, session_id, operation)
+
+        answer.result_id = self.result_ids.next()
+        self.results_storage.add(session_id, answer.result_id, operation, num_a, num_b, result)
 
         answer.result = result
-        return answer.get_bytes()
+        return answer
+
+    def __operations(self, session_id: int, batch: List[Datagram]) -> List[Datagram]:
+        """
+        Makes batch of requested calculations
+
+        Successful results get consecutive result ids, answers are in order of requests and only the last one has
+        last flag set.
+
+        :param session_id: id of session requesting calculations
+        :param batch: requests of the batch
+        :return: answers for the client
+        """
+
+        CALLS.info('received batch of %d calls from session: %d', len(batch), session_id)
 
-    def __query_by_session_id(self, session_id: int, given_session_id: int, connection: socket) -> bytes:
+        calculated = self.__calculate_many([(request.operation, request.a, request.b) for request in batch])
+        result_ids = iter(self.result_ids.next_many(sum(1 for result, error in calculated if error is None)))
+
+        answers: List[Datagram] = list()
+        for i, (request, (result, error)) in enumerate(zip(batch, calculated)):
+            last = i == len(batch) - 1
+            if error is not None:
+                answers.append(self.__error(error, Mode.OPERATION, session_id, request.operation, last))
+                continue
+
+            result_id = next(result_ids)
+            self.results_storage.add(session_id, result_id, request.operation, request.a, request.b, result)
+            answers.append(Datagram(
+                Status.OK, Mode.OPERATION, session_id, request.operation, request.a, request.b,
+                result=result,
+                result_id=result_id,
+                last=last
+            ))
+
+        return answers
+
+    def __calculate(self, operation: int, num_a: float, num_b: float) -> (float, int):
         """
-        Gets all results of session
+        Makes calculation or takes its outcome from cache
+
+        :param operation: id of requested operation
+        :param num_a: number a
+        :param num_b: number b
+        :return: (result, None) on success or (None, error code)
+        """
+        outcome = self.cache.get(operation, num_a, num_b)
+        if outcome is None:
+            outcome = calculate(operation, num_a, num_b)
+            self.cache.put(operation, num_a, num_b, outcome)
+        return outcome
+
+    def __calculate_many(self, requests: List[Tuple[int, float, float]]) -> List[Tuple[float, int]]:
+        """
+        Makes batch of calculations, calculating together only those not found in cache
+
+        Outcomes of batch are not put in cache [vectorized results may differ from calculated one by one in the last
+        bits, and cached outcome of a single request has to be the same as calculated again].
+
+        :param requests: list of (operation, a, b)
+        :return: list of (result, None) or (None, error code) in order of requests
+        """
+        outcomes = [self.cache.get(*request) for request in requests]
+        missing = [i for i, outcome in enumerate(outcomes) if outcome is None]
+
+        for i, outcome in zip(missing, calculate_many([requests[i] for i in missing])):
+            outcomes[i] = outcome
+        return outcomes
+
+    def metrics_cmd(self) -> None:
+        """ Prints metrics of requests """
+        print(self.render_metrics(), end='')
+
+    def cache_cmd(self) -> None:
+        """ Prints statistics of calculations cache """
+        stats = self.cache.stats()
+        print('\t'.join(name + ' = ' + str(value) for name, value in stats.items()))
+
+    def __query_by_session_id(
+            self, session_id: int, given_session_id: int, after_result_id: int = 0,
+            mode: int = Mode.QUERY_BY_SESSION_ID
+    ) -> Iterable[Datagram]:
+        """
+        Gets results of session
+
+        Answers are produced lazily, page by page from the storage, so memory used does not depend on
+        the number of results.
 
         :param session_id: id of session to look for
         :param given_session_id: id of session requesting query
-        :param connection: connection socket
-        :return: answer for the client
+        :param after_result_id: send only results with greater id [lets client resume interrupted query]
+        :param mode: QUERY_BY_SESSION_ID for answer per result or RESULT_BLOCK for answer per page of results
+        :return: answers for the client
         """
-        utils.log('querying by session_id: ' + str(session_id) + ' for ' + str(given_session_id))
+        CALLS.info('querying by session_id: %d for %d', session_id, given_session_id)
 
         if session_id != given_session_id:
-            return self.__error(Error.UNAUTHORISED, Mode.QUERY_BY_SESSION_ID, session_id)
+            return [self.__error(Error.UNAUTHORISED, mode, session_id)]
 
-        if session_id not in self.results_storage:
-            return self.__error(Error.NOT_EXISTING_DATA, Mode.QUERY_BY_SESSION_ID)
-
-        if not self.results_storage[session_id]:
-            return self.__error(Error.NOT_EXISTING_DATA, Mode.QUERY_BY_SESSION_ID)
-
-        results = self.results_storage[session_id]
-        answer: List[Datagram] = list()
-        for result_id, result in results.items():
-            answer.append(Datagram(
-                Status.OK, Mode.QUERY_BY_SESSION_ID, session_id,
-                operation=result[0],
-                a=result[1],
-                b=result[2],
-                result=result[4],
-                result_id=result_id,
-                last=False
-            ))
+        page = self.results_storage.session_results(session_id, after_result_id, self.QUERY_PAGE_SIZE)
+        if not page:
+            return [self.__error(Error.NOT_EXISTING_DATA, mode)]
 
-        # send all except last results to the client
-        for i in range(0, len(answer) - 1):
-            connection.sendall(answer[i].get_bytes())
+        if mode == Mode.RESULT_BLOCK:
+            return self.__session_result_blocks(session_id, page)
+        return self.__session_results_stream(session_id, page)
 
-        # return last result to send
-        answer[len(answer) - 1].last = True
-        return answer[len(answer) - 1].get_bytes()
+    def __session_result_blocks(self, session_id: int, page: List[Result]) -> Iterator[ResultBlock]:
+        """
+        Packs results of session into blocks
+
+        :param session_id: id of session
+        :param page: first page of results
+        :return: block per page, last one with last flag set
+        """
+        while page:
+            next_page = self.results_storage.session_results(session_id, page[-1][5], self.QUERY_PAGE_SIZE)
+            yield ResultBlock.from_results(session_id, page, last=not next_page)
+            page = next_page
+
+    def __session_results_stream(self, session_id: int, page: List[Result]) -> Iterator[Datagram]:
+        """
+        Encodes results of session
+
+        :param session_id: id of session
+        :param page: first page of results
+        :return: answers for the client, last one with last flag set
+        """
+        while page:
+            # look ahead, so the last result can be marked
+            next_page = self.results_storage.session_results(session_id, page[-1][5], self.QUERY_PAGE_SIZE)
+            for i, result in enumerate(page):
+                yield Datagram(
+                    Status.OK, Mode.QUERY_BY_SESSION_ID, session_id,
+                    operation=result[0],
+                    a=result[1],
+                    b=result[2],
+                    result=result[4],
+                    result_id=result[5],
+                    last=not next_page and i == len(page) - 1
+                )
+            page = next_page
 
     def __query_by_session_id_cmd(self, session_id: int) -> None:
-        if session_id in self.results_storage:
-            results = self.results_storage[session_id]
-            for result_id, result in results.items():
+        if self.results_storage.has_session(session_id):
+            results = self.results_storage.session_results(session_id)
+            for result in results:
                 print('session_id = ' + str(session_id) + "\t" +
                       ' result id = ' + str(result[5]) + "\t" +
                       ' operation: ' + str(Operation.name_from_code(result[0])) + "\t" +
@@ -325,7 +905,7 @@ class Server(Thread):
         else:
             self.__error(Error.NOT_EXISTING_DATA, Mode.QUERY_BY_SESSION_ID)
 
-    def __query_by_result_id(self, session_id: int, given_session_id: int, result_id: int) -> bytes:
+    def __query_by_result_id(self, session_id: int, given_session_id: int, result_id: int) -> Datagram:
         """
         Gets one result
 
@@ -334,42 +914,35 @@ class Server(Thread):
         :param result_id: id of result to look for
         :return: answer for the client
         """
-        utils.log('querying by result id: ' + str(result_id) + 'for ' + str(given_session_id))
+        CALLS.info('querying by result id: %d for %d', result_id, given_session_id)
 
         if session_id != given_session_id:
             return self.__error(Error.UNAUTHORISED, Mode.QUERY_BY_SESSION_ID, session_id)
 
-        if session_id not in self.results_storage:
-            return self.__error(Error.NOT_EXISTING_DATA, Mode.QUERY_BY_SESSION_ID_CMD)
+        if not self.results_storage.has_session(session_id):
+            return self.__error(Error.NOT_EXISTING_DATA, Mode.QUERY_BY_RESULT_ID)
 
-        session_results = self.results_storage[session_id]
+        result = self.results_storage.get(result_id)
 
-        if result_id not in session_results:
+        if result is None or result[3] != session_id:
             return self.__error(Error.UNAUTHORISED, Mode.QUERY_BY_RESULT_ID, session_id)
 
         answer = Datagram(
             Status.OK, Mode.QUERY_BY_RESULT_ID, session_id,
-            operation=self.results_storage[session_id][result_id][0],
-            a=self.results_storage[session_id][result_id][1],
-            b=self.results_storage[session_id][result_id][2],
-            result=self.results_storage[session_id][result_id][4],
+            operation=result[0],
+            a=result[1],
+            b=result[2],
+            result=result[4],
             result_id=result_id,
         )
 
-        return answer.get_bytes()
+        return answer
 
     def __query_by_result_id_cmd(self, result_id: int) -> None:
-        result = None
-        results = self.results_storage
-        session_id = None
-
-        for key, res in results.items():
-            if result_id in res:
-                result = res[result_id]
-                session_id = key
+        result = self.results_storage.get(result_id)
 
         if result:
-            print('session_id = ' + str(session_id) + "\t" +
+            print('session_id = ' + str(result[3]) + "\t" +
                   ' result id = ' + str(result[5]) + "\t" +
                   ' operation: ' + str(Operation.name_from_code(result[0])) + "\t" +
                   ' a = ' + str(result[1]) + "\t" +
@@ -379,8 +952,9 @@ class Server(Thread):
         else:
             self.__error(Error.NOT_EXISTING_DATA, Mode.QUERY_BY_RESULT_ID)
 
-    @staticmethod
-    def __error(code: int, mode: int = Mode.ERROR, session_id: int = 0, operation: int = 0) -> bytes:
+    def __error(
+            self, code: int, mode: int = Mode.ERROR, session_id: int = 0, operation: int = 0, last: bool = True
+    ) -> Datagram:
         """
         Returns error answer
 
@@ -388,14 +962,12 @@ class Server(Thread):
         :param mode: mode in which error occurred
         :param session_id: session id in which error occurred
         :param operation: operation in which error occurred
+        :param last: whether it is the last answer for the request
         :return: error answer for the client
         """
-        utils.log(
-            Error.name_from_code(code) + ' on session: ' + str(session_id) + ' mode: ' + Mode.name_from_code(mode),
-            True
-        )
-        error = Datagram(Status.ERROR, mode, session_id, operation, a=code)
-        return error.get_bytes()
+        self.metrics.error(code)
+        CALLS.error('%s on session: %d mode: %s', Error.name_from_code(code), session_id, Mode.name_from_code(mode))
+        return Datagram(Status.ERROR, mode, session_id, operation, a=code, last=last)
 
 
 class Handler(Thread):
@@ -420,15 +992,492 @@ class Handler(Thread):
         self.connection.close()
 
 
+class AsyncServer(Server):
+    """ Implementation of server application running all sessions on one asyncio event loop
+
+    Uses the same request handling as Server, but instead of thread per connection every session is a task,
+    so thousands of mostly idle clients cost only their buffers.
+    """
+
+    # time given to open sessions to finish after stop [s], clients ping every second
+    STOP_GRACE_PERIOD = 3
+
+    def __init__(
+            self, host: str, port: int,
+            results_storage: ResultStore = None, worker: int = 0, workers: int = 1, **settings
+    ) -> None:
+        """
+        :param host: IP address to serve application on
+        :param port: port number to serve application on
+        :param results_storage: storage of results, shared when server is one of many workers
+        :param worker: index of this server among workers serving the same port
+        :param workers: number of workers serving the same port
+        :param settings: other settings of Server
+        """
+        super().__init__(host, port, results_storage, worker, workers, **settings)
+        self.loop: asyncio.AbstractEventLoop = None
+        self.stopped: asyncio.Event = None
+        self.ready = Event()
+
+    def listen(self) -> None:
+        """ Runs event loop until server is stopped """
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.ready.set()
+        utils.log('listening stopped')
+
+    def stop(self) -> None:
+        """ Stops the server
+
+        Stops accepting new connections, then lets open sessions finish their requests [clients get REFUSED
+        on next IS_ALIVE] and closes sessions which did not finish within STOP_GRACE_PERIOD.
+        """
+        self.on = False
+        utils.log('stopping listening...')
+        self.ready.wait()
+        if self.loop is not None and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.close_resources()
+        utils.log('all sessions closed')
+
+    async def serve(self) -> None:
+        """ Accepts connections until server is stopped """
+
+        self.stopped = asyncio.Event()
+        server = await self.transport.start_server(self.handle_stream, 128, self.reuse_port)
+        self.loop = asyncio.get_running_loop()
+        utils.log('listening on ' + str(self.transport))
+        self.ready.set()
+
+        async with server:
+            reaper = asyncio.create_task(self.reap_periodically())
+            await self.stopped.wait()
+            reaper.cancel()
+        self.transport.close()
+
+    async def reap_periodically(self) -> None:
+        """ Closes idle sessions every tick of idle tracker until server is stopped """
+        while True:
+            await asyncio.sleep(self.idle.resolution)
+            self.reap_idle_sessions()
+            self.expire_results()
+
+    def drop_session(self, handler: asyncio.Task) -> None:
+        """
+        Closes session without waiting for the client
+
+        :param handler: task handling the session
+        """
+        self.sessions[handler] = False
+        handler.cancel()
+
+    async def shutdown(self) -> None:
+        """ Closes open sessions and stops accepting """
+
+        # turn sessions off [embedded callers find out on their next request]
+        for session in list(self.sessions):
+            self.sessions[session] = False
+
+        # wait for clients to confirm disconnection
+        tasks = [session for session in list(self.sessions) if session not in self.embedded]
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=self.STOP_GRACE_PERIOD)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        self.stopped.set()
+
+    def open_embedded(self, session: object) -> None:
+        """
+        Registers session of a caller in the server process on the event loop [see Server.open_embedded]
+
+        :param session: key of the session [see client.embedded.EmbeddedConnection]
+        """
+        self.__on_loop(super().open_embedded, session)
+
+    def handle_embedded(self, session: object, session_id: int, datagrams: List[Datagram]) -> (List[Datagram], int):
+        """
+        Handles request of embedded session on the event loop as a frame of a connection [see Server.handle_embedded]
+
+        :param session: key of the session
+        :param session_id: id of session given to the caller so far [0 if not connected yet]
+        :param datagrams: datagrams of the request
+        :return: (answers, session_id after the request)
+        :raises ConnectionAbortedError: if the session was closed by the server
+        """
+        return self.__on_loop(super().handle_embedded, session, session_id, datagrams)
+
+    def close_embedded(self, session: object, session_id: int = 0) -> None:
+        """
+        Forgets embedded session on the event loop [see Server.close_embedded]
+
+        :param session: key of the session
+        :param session_id: id of the session, 0 if it never connected
+        """
+        try:
+            self.__on_loop(super().close_embedded, session, session_id)
+        except ConnectionAbortedError:
+            # loop stopped meanwhile, nothing else touches the sessions
+            super().close_embedded(session, session_id)
+
+    def __on_loop(self, function: Callable, *args):
+        """
+        Calls function on the event loop and waits for its result, so state of sessions is changed only by the loop
+
+        Function is called right away in the loop itself and when the loop does not run [server not started or
+        stopped already].
+
+        :param function: function to call
+        :param args: arguments of the function
+        :raises ConnectionAbortedError: if the loop stopped before the function was called
+        """
+        loop = self.loop
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop or loop is None or not loop.is_running():
+            return function(*args)
+
+        try:
+            future = asyncio.run_coroutine_threadsafe(self.__call(function, *args), loop)
+        except RuntimeError:
+            raise ConnectionAbortedError('server stopped')
+        while True:
+            try:
+                return future.result(self.idle.resolution)
+            except FutureCancelledError:
+                # task of the request was cancelled by stopping loop
+                raise ConnectionAbortedError('server stopped')
+            except FutureTimeoutError:
+                # coroutine scheduled just before the loop stopped never runs
+                if not loop.is_running():
+                    future.cancel()
+                    raise ConnectionAbortedError('server stopped')
+
+    @staticmethod
+    async def __call(function: Callable, *args):
+        """ Calls function on the event loop """
+        return function(*args)
+
+    async def handle_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Handles session
+
+        :param reader: stream of incoming data
+        :param writer: stream of outgoing data
+        """
+
+        address = self.transport.client_address(writer.get_extra_info('peername'))
+        utils.log('connected by ' + str(address))
+        # answers of a request are written at once, so Nagle's algorithm would only delay them
+        connection = writer.get_extra_info('socket')
+        if connection is not None and connection.family in (socket.AF_INET, socket.AF_INET6):
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # current task is a handler of the session
+        handler = asyncio.current_task()
+        self.sessions[handler] = self.on
+        self.idle.add(handler, self.heartbeat_interval * self.MISSED_HEARTBEATS)
+
+        # create variable for storing id and codec of frames
+        session_id = 0
+        codec = Codec()
+
+        try:
+            # handle requests
+            while self.sessions[handler]:
+                # receive header and payload of frame
+                header = await reader.readexactly(codec.header_size)
+                started = perf_counter_ns()
+                try:
+                    size = codec.payload_size(header)
+                except ValueError as e:
+                    writer.write(self.unreadable_frame(codec, session_id, e))
+                    await writer.drain()
+                    break
+                payload = await reader.readexactly(size) if size else b''
+                mode, operation = codec.peek(header, payload)
+                self.metrics.start()
+                try:
+                    answers, session_id = self.handle_frame(codec, header, payload, session_id, address, handler)
+                    # send answers to the client in chunks, waiting while client does not keep up
+                    chunk = bytearray()
+                    for answer in answers:
+                        chunk += answer
+                        if len(chunk) >= self.SEND_CHUNK_SIZE:
+                            writer.write(chunk)
+                            chunk = bytearray()
+                            await writer.drain()
+                    writer.write(chunk)
+                    await writer.drain()
+                finally:
+                    # aborted request is counted as well, so it does not stay in flight
+                    self.metrics.observe(mode, operation, perf_counter_ns() - started)
+                # long answer does not count as idle time
+                self.idle.touch(handler)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # if session was closed unsafely or dropped by the server
+            utils.log('breaking listening for session: ' + str(session_id))
+        except Exception as e:
+            # unexpected error must not leave the session behind
+            utils.log('session ' + str(session_id) + ' failed: ' + repr(e), True)
+        finally:
+            # after closing session safely close connection
+            del self.sessions[handler]
+            self.drop_batch(handler)
+            self.idle.remove(handler)
+            self.admission.remove_session(handler)
+            writer.close()
+            self.end_session(session_id)
+            utils.log('session closed: ' + str(session_id))
+
+
+# available implementations of server
+ENGINES = {
+    'thread': Server,
+    'async': AsyncServer,
+}
+
+
+class PreforkServer(Server):
+    """ Implementation of server application running many worker processes on one port
+
+    Every worker is a complete server of chosen engine listening on the same port with SO_REUSEPORT, so the kernel
+    spreads connections among them and long calculations of one worker do not stall the others. Workers give out
+    ids from disjoint sequences and keep results in one store served by a manager process, so queries work no
+    matter which worker computed the result.
+    """
+
+    def __init__(self, host: str, port: int, engine: str = 'thread', workers: int = 2, **settings) -> None:
+        """
+        :param host: IP address to serve application on
+        :param port: port number to serve application on
+        :param engine: name of server implementation used by workers [see ENGINES]
+        :param workers: number of worker processes
+        :param settings: other settings of Server, passed to every worker
+        """
+        self.manager, results_storage = create_shared_store(settings.get('results_dir'), settings.get('retention'))
+        super().__init__(host, port, results_storage)
+        self.engine = engine
+        self.workers = workers
+        self.settings = settings
+        self.context = multiprocessing.get_context('spawn')
+        self.stopped = self.context.Event()
+        self.processes = []
+
+    def listen(self) -> None:
+        """ Starts workers and waits until all of them finish """
+
+        for worker in range(self.workers):
+            process = self.context.Process(
+                name='worker_' + str(worker),
+                target=run_worker,
+                args=(
+                    self.engine, self.host, self.port, self.results_storage, worker, self.workers, self.stopped,
+                    logger.settings()
+                ),
+                kwargs=self.settings
+            )
+            process.start()
+            self.processes.append(process)
+        utils.log('started ' + str(self.workers) + ' workers on port ' + str(self.port))
+
+        for process in self.processes:
+            process.join()
+        utils.log('listening stopped')
+
+    def stop(self) -> None:
+        """ Stops the server
+
+        Every worker stops its own server [see stop of chosen engine], results store is closed after all of them.
+        """
+        self.on = False
+        utils.log('stopping workers...')
+        self.stopped.set()
+        for process in self.processes:
+            process.join()
+
+        # store is shared by workers, so it is closed only after all of them
+        self.results_storage.close()
+        self.manager.shutdown()
+        utils.log('all workers stopped')
+
+    def open_embedded(self, session: object) -> None:
+        """ Refuses embedded session, sessions live in worker processes """
+        raise ValueError('embedded sessions need a server running in the same process, not its workers')
+
+    def cache_cmd(self) -> None:
+        """ Prints statistics of calculations cache """
+        print('every worker keeps its own cache')
+
+    def metrics_cmd(self) -> None:
+        """ Prints metrics of requests """
+        print('every worker keeps its own metrics, worker n serves them on metrics port + n')
+
+
+def run_worker(
+        engine: str, host: str, port: int,
+        results_storage: ResultStore, worker: int, workers: int, stopped: multiprocessing.Event,
+        log_settings: dict, **settings
+) -> None:
+    """
+    Runs one worker of PreforkServer until it is stopped
+
+    :param engine: name of server implementation [see ENGINES]
+    :param host: IP address to serve application on
+    :param port: port number to serve application on
+    :param results_storage: store shared by all workers
+    :param worker: index of the worker
+    :param workers: number of workers
+    :param stopped: event set when workers should stop
+    :param log_settings: settings of logging of the main process [see logger.settings]
+    :param settings: other settings of Server
+    """
+    logger.configure(log_settings)
+    # every worker serves its own metrics on the next port
+    if settings.get('metrics_port'):
+        settings['metrics_port'] += worker
+    server = ENGINES[engine](host, port, results_storage, worker, workers, **settings)
+    server.start()
+    stopped.wait()
+    server.stop()
+    server.join()
+    logger.stop()
+
+
 def main():
     """ Starts the application """
-    args = sys.argv
-    host = args[1] if len(args) > 1 else LOCAL_HOST
-    port = int(args[2]) if len(args) > 2 else PORT
-    server = Server(host, port)
+    parser = argparse.ArgumentParser(description='netcalc server')
+    parser.add_argument(
+        'host', nargs='?', default=LOCAL_HOST,
+        help='IP address to serve application on, or unix:path of Unix domain socket for local clients'
+    )
+    parser.add_argument('port', nargs='?', type=int, default=PORT, help='port number to serve application on')
+    parser.add_argument(
+        '--engine', choices=ENGINES.keys(), default='thread',
+        help='thread: thread per connection, async: all connections on one asyncio event loop'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='number of worker processes sharing the port, each running chosen engine'
+    )
+    parser.add_argument(
+        '--cache-size', type=int, default=65536,
+        help='maximal number of cached calculation outcomes, 0 disables cache'
+    )
+    parser.add_argument('--cache-ttl', type=float, default=600, help='time after which cached outcome expires [s]')
+    parser.add_argument(
+        '--results-dir',
+        help='directory of persistent result log, results are kept only in memory if not given'
+    )
+    parser.add_argument(
+        '--max-results', type=int, default=0,
+        help='results of all sessions kept in memory, oldest are evicted, 0 for no limit'
+    )
+    parser.add_argument(
+        '--max-session-results', type=int, default=0,
+        help='results of one session kept in memory, its oldest are evicted, 0 for no limit'
+    )
+    parser.add_argument(
+        '--max-memory', type=float, default=0,
+        help='memory for results of all sessions [MiB], oldest are evicted, 0 for no limit'
+    )
+    parser.add_argument(
+        '--max-session-memory', type=float, default=0,
+        help='memory for results of one session [MiB], its oldest are evicted, 0 for no limit'
+    )
+    parser.add_argument(
+        '--result-ttl', type=float, default=0, help='time after which result is evicted from memory [s], 0 for never'
+    )
+    parser.add_argument(
+        '--spill-dir',
+        help='directory of segment evicted results are written to, so queries by result id still find them, '
+             'they are dropped if not given'
+    )
+    parser.add_argument(
+        '--heartbeat-interval', type=float, default=1.0,
+        help='time between IS_ALIVE requests of clients which do not ask for other one [s]'
+    )
+    parser.add_argument(
+        '--max-heartbeat-interval', type=float, default=60,
+        help='longest time between IS_ALIVE requests client can ask for [s]'
+    )
+    parser.add_argument(
+        '--metrics-port', type=int,
+        help='local port of plain text metrics endpoint, worker n of many uses port + n, no endpoint if not given'
+    )
+    parser.add_argument(
+        '--session-rate', type=float, default=0,
+        help='work units per second allowed to one session [log, GM: 1, power: 2, aCb: 4], 0 for no limit'
+    )
+    parser.add_argument(
+        '--session-burst', type=float, default=0, help='work units session can use at once, session rate if 0'
+    )
+    parser.add_argument(
+        '--global-rate', type=float, default=0,
+        help='work units per second allowed to all sessions of a worker together, 0 for no limit'
+    )
+    parser.add_argument(
+        '--global-burst', type=float, default=0, help='work units all sessions can use at once, global rate if 0'
+    )
+    parser.add_argument(
+        '--max-pending', type=int, default=1024,
+        help='maximal work units handled at once by a worker, more is refused, 0 for no limit'
+    )
+    parser.add_argument(
+        '--log-level', choices=logger.LEVELS.keys(), default='info', help='lowest level of logged messages'
+    )
+    parser.add_argument(
+        '--call-log-level', choices=logger.LEVELS.keys(), default='info',
+        help='lowest level of messages logged for every request, off turns them off completely'
+    )
+    parser.add_argument(
+        '--call-log-sample', type=int, default=1, help='log only every n-th message about requests'
+    )
+    parser.add_argument(
+        '--call-log-rate', type=int, default=0,
+        help='maximal number of messages about requests logged per second, 0 for no limit'
+    )
+    args = parser.parse_args()
+    if args.host.startswith(UNIX_PREFIX) and args.workers > 1:
+        parser.error('Unix domain socket is served by one worker, SO_REUSEPORT balances only TCP')
+    retention = RetentionPolicy(
+        args.max_results, args.max_session_results, args.max_memory, args.max_session_memory, args.result_ttl,
+        args.spill_dir
+    )
+    if args.results_dir is not None and (retention.limited() or args.spill_dir is not None):
+        parser.error('result log keeps results on disk, limits of results kept in memory do not apply to it')
+
+    # configure logs and write them in background
+    utils.MAIN.configure(logger.LEVELS[args.log_level])
+    call_log_level = max(logger.LEVELS[args.log_level], logger.LEVELS[args.call_log_level])
+    CALLS.configure(call_log_level, args.call_log_sample, args.call_log_rate)
+    logger.start()
+
+    settings = {
+        'cache_size': args.cache_size,
+        'cache_ttl': args.cache_ttl,
+        'results_dir': args.results_dir,
+        'heartbeat_interval': args.heartbeat_interval,
+        'max_heartbeat_interval': args.max_heartbeat_interval,
+        'metrics_port': args.metrics_port,
+        'session_rate': args.session_rate,
+        'session_burst': args.session_burst,
+        'global_rate': args.global_rate,
+        'global_burst': args.global_burst,
+        'max_pending': args.max_pending,
+        'retention': retention,
+    }
+    if args.workers > 1:
+        server = PreforkServer(args.host, args.port, args.engine, args.workers, **settings)
+    else:
+        server = ENGINES[args.engine](args.host, args.port, **settings)
     server.start()
     server.menu()
     server.join()
+    logger.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,184 @@
+from threading import Lock
+from time import monotonic
+from typing import Dict, Hashable, Optional
+
+from common.values import Operation
+
+# cost of calculations in work units [binomial coefficient of big numbers and power are the slowest]
+COSTS = {
+    Operation.POWER: 2,
+    Operation.LOG: 1,
+    Operation.GEO_MEAN: 1,
+    Operation.BIN_COE: 4,
+}
+# cost of one page of query answers
+QUERY_COST = 1
+
+
+class TokenBucket:
+    """ Limits rate of work
+
+    Holds up to burst tokens, rate tokens are added every second. Work is allowed if its cost is covered by tokens.
+    Work costing more than burst is allowed when the bucket is full and leaves it in debt, so it is slowed down,
+    not refused forever.
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        """
+        :param rate: tokens added per second
+        :param burst: maximal number of tokens
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def take(self, cost: float) -> float:
+        """
+        Takes tokens for work if there are enough of them
+
+        :param cost: cost of work
+        :return: 0 if work is allowed, otherwise time after which it would be allowed [s]
+        """
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= min(cost, self.burst):
+            self.tokens -= cost
+            return 0
+        return (min(cost, self.burst) - self.tokens) / self.rate
+
+    def give_back(self, cost: float) -> None:
+        """
+        Returns tokens of work which was not done
+
+        :param cost: cost of work
+        """
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class AdmissionControl:
+    """ Decides whether request is handled or refused
+
+    Every request has a cost [see COSTS], which has to be covered by token bucket of its session and by the global
+    one, and which counts as pending until the request is handled. When pending work would exceed max_pending,
+    new work is refused instead of waiting behind it [work bigger than max_pending is admitted only when nothing
+    else is pending]. So under overload clients get quick REFUSED answers with time to retry after, while latency
+    of admitted requests stays bounded.
+
+    Zero rate or max_pending turns the particular limit off. Buckets of sessions are used only by the thread
+    of their session, global state is guarded by a lock.
+    """
+
+    def __init__(
+            self, session_rate: float = 0, session_burst: float = 0,
+            global_rate: float = 0, global_burst: float = 0, max_pending: int = 0
+    ) -> None:
+        """
+        :param session_rate: work units per second allowed to one session, 0 for no limit
+        :param session_burst: work units session can use at once, session_rate if 0
+        :param global_rate: work units per second allowed to all sessions together, 0 for no limit
+        :param global_burst: work units all sessions can use at once, global_rate if 0
+        :param max_pending: maximal work units admitted and not finished yet, 0 for no limit
+        """
+        self.session_rate = session_rate
+        self.session_burst = session_burst or session_rate
+        self.max_pending = max_pending
+        self.global_bucket = TokenBucket(global_rate, global_burst or global_rate) if global_rate else None
+
+        # key of session -> bucket of session
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.pending = 0
+        self.refused = 0
+        self.lock = Lock()
+
+    def admit(self, session: Hashable, cost: float, charged: bool = False) -> Optional[float]:
+        """
+        Admits work, which has to be finished by calling done with the same cost
+
+        :param session: key of session requesting the work
+        :param cost: cost of work
+        :param charged: tokens were taken already by charge, only pending work is checked
+        :return: None if work is admitted, otherwise time after which client should retry [s, 0 if unknown]
+        """
+        bucket = None
+        if self.session_rate and not charged:
+            bucket = self.__bucket(session)
+            wait = bucket.take(cost)
+            if wait:
+                return self.__refuse(wait)
+
+        with self.lock:
+            if self.max_pending and self.pending and self.pending + cost > self.max_pending:
+                # queue is full, it is not known when it frees up
+                wait = 0
+            else:
+                wait = self.global_bucket.take(cost) if self.global_bucket is not None and not charged else 0
+                if not wait:
+                    self.pending += cost
+                    return None
+            self.refused += 1
+
+        # session did not use its tokens
+        if bucket is not None:
+            bucket.give_back(cost)
+        return wait
+
+    def charge(self, session: Hashable, cost: float) -> Optional[float]:
+        """
+        Takes tokens for work which is admitted later [requests of batch are charged as they arrive]
+
+        :param session: key of session requesting the work
+        :param cost: cost of work
+        :return: None if tokens were taken, otherwise time after which client should retry [s]
+        """
+        bucket = None
+        if self.session_rate:
+            bucket = self.__bucket(session)
+            wait = bucket.take(cost)
+            if wait:
+                return self.__refuse(wait)
+
+        if self.global_bucket is None:
+            return None
+        with self.lock:
+            wait = self.global_bucket.take(cost)
+            if not wait:
+                return None
+            self.refused += 1
+
+        # session did not use its tokens
+        if bucket is not None:
+            bucket.give_back(cost)
+        return wait
+
+    def done(self, cost: float) -> None:
+        """
+        Finishes admitted work
+
+        :param cost: cost of work
+        """
+        with self.lock:
+            self.pending -= cost
+
+    def remove_session(self, session: Hashable) -> None:
+        """
+        Forgets bucket of closed session
+
+        :param session: key of session
+        """
+        self.buckets.pop(session, None)
+
+    def __bucket(self, session: Hashable) -> TokenBucket:
+        """ Gets bucket of session, creates it on first use """
+        bucket = self.buckets.get(session)
+        if bucket is None:
+            bucket = self.buckets[session] = TokenBucket(self.session_rate, self.session_burst)
+        return bucket
+
+    def __refuse(self, wait: float) -> float:
+        """ Counts refused work """
+        with self.lock:
+            self.refused += 1
+        return wait
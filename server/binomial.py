@@ -0,0 +1,57 @@
+from math import comb, exp, isfinite, lgamma, log
+
+from common.values import Error
+
+# natural logarithm of the largest float64
+LOG_MAX_FLOAT = log(1.7976931348623157e308)
+
+# cap of work of one request: above that many multiplications result is approximated with log-gamma
+MAX_EXACT_STEPS = 256
+
+
+def binomial_coefficient(num_a: float, num_b: float, max_exact_steps: int = MAX_EXACT_STEPS) -> (float, int):
+    """
+    Calculates a choose b
+
+    Only non negative integers with b <= a are accepted. Using symmetry k = min(b, a - b) is chosen, then:
+    results which surely exceed float64 are rejected in O(1) from lower bound (a / k)^k, results needing at most
+    max_exact_steps multiplications are calculated exactly with math.comb and rounded to float64 once, others
+    are approximated in O(1) with log-gamma [relative error below 1e-10].
+
+    :param num_a: number a
+    :param num_b: number b
+    :param max_exact_steps: largest k calculated exactly
+    :return: (result, None) on success or (None, error code) if calculation is not possible
+    """
+
+    if not isfinite(num_a) or not isfinite(num_b):
+        return None, Error.INVALID_ARGUMENT
+    if not float(num_a).is_integer() or not float(num_b).is_integer():
+        return None, Error.INVALID_ARGUMENT
+    if num_b > num_a or num_a < 0 or num_b < 0:
+        return None, Error.INVALID_ARGUMENT
+
+    n = int(num_a)
+    k = min(int(num_b), n - int(num_b))
+
+    if k == 0:
+        return 1.0, None
+
+    # (n / k)^k <= n choose k, so if the bound does not fit, neither does the result
+    if k * (log(n) - log(k)) > LOG_MAX_FLOAT:
+        return None, Error.MAX_VALUE_EXCEEDED
+
+    if k <= max_exact_steps:
+        try:
+            return float(comb(n, k)), None
+        except OverflowError:
+            return None, Error.MAX_VALUE_EXCEEDED
+
+    # bound above keeps n small enough here for log-gamma not to lose precision
+    log_result = lgamma(n + 1) - lgamma(k + 1) - lgamma(n - k + 1)
+    if log_result > LOG_MAX_FLOAT:
+        return None, Error.MAX_VALUE_EXCEEDED
+    try:
+        return exp(log_result), None
+    except OverflowError:
+        return None, Error.MAX_VALUE_EXCEEDED
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from struct import Struct
+from threading import Lock
+from time import monotonic
+from typing import Optional, Tuple
+
+# converter of arguments to their exact bit patterns [so -0.0 and 0.0 or different NaNs are different keys]
+NUMBERS = Struct('>dd')
+
+
+class ResultCache:
+    """ Bounded memo of calculation outcomes
+
+    Keeps outcomes [results and errors alike] of recent calculations keyed by operation code and exact bit patterns
+    of arguments. When full, least recently used entry is evicted, entries older than ttl are treated as missing.
+    All methods are safe to call from many threads.
+    """
+
+    def __init__(self, max_entries: int = 65536, ttl: float = 600) -> None:
+        """
+        :param max_entries: maximal number of entries, 0 disables cache
+        :param ttl: time after which entry expires [s], None for no expiration
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (time of insertion, outcome), ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, operation: int, num_a: float, num_b: float) -> Optional[Tuple[float, int]]:
+        """
+        Looks up outcome of calculation
+
+        :param operation: id of operation
+        :param num_a: number a
+        :param num_b: number b
+        :return: (result, error code) as returned by calculate or None if it is not cached
+        """
+        if not self.max_entries:
+            return None
+
+        key = (operation, NUMBERS.pack(num_a, num_b))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if self.ttl is not None and monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, operation: int, num_a: float, num_b: float, outcome: Tuple[float, int]) -> None:
+        """
+        Saves outcome of calculation
+
+        :param operation: id of operation
+        :param num_a: number a
+        :param num_b: number b
+        :param outcome: (result, error code) as returned by calculate
+        """
+        if not self.max_entries:
+            return
+
+        key = (operation, NUMBERS.pack(num_a, num_b))
+        with self.lock:
+            self.entries[key] = (monotonic(), outcome)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """ Returns counters of cache """
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
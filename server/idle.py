@@ -0,0 +1,113 @@
+from threading import Lock
+from time import monotonic
+from typing import Hashable, List
+
+
+class IdleTracker:
+    """ Timer wheel of idle deadlines
+
+    Every tracked key [session handler] has a timeout and a deadline renewed by touch. The wheel is a ring of slots,
+    each slot holds keys whose deadline falls into one tick of length resolution. Touch only stores new deadline
+    [O(1), no matter how often it is called], the key stays in its slot and is moved lazily when the slot comes due
+    and its deadline turns out to be later. So expire visits only slots of elapsed ticks, and every key in them is
+    either expired or moved once per its timeout.
+    """
+
+    def __init__(self, resolution: float = 0.25, slots: int = 512) -> None:
+        """
+        :param resolution: length of one tick [s], deadlines are checked with this precision
+        :param slots: number of slots of the wheel, deadlines further than one turn wait for more turns
+        """
+        self.resolution = resolution
+        self.slots = slots
+        self.wheel = [[] for _ in range(slots)]
+        # key -> timeout, key -> deadline, key -> tick of slot holding the key
+        self.timeouts = {}
+        self.deadlines = {}
+        self.scheduled = {}
+        # last tick already expired
+        self.tick = int(monotonic() / resolution)
+        self.lock = Lock()
+
+    def add(self, key: Hashable, timeout: float) -> None:
+        """
+        Starts tracking key or changes its timeout
+
+        :param key: tracked object
+        :param timeout: time without touch after which key expires [s]
+        """
+        with self.lock:
+            self.timeouts[key] = timeout
+            self.deadlines[key] = monotonic() + timeout
+            # move key if new deadline comes before its slot [later deadline is handled lazily]
+            scheduled = self.scheduled.get(key)
+            if scheduled is None or int(self.deadlines[key] / self.resolution) < scheduled:
+                self.__schedule(key, self.deadlines[key])
+
+    def touch(self, key: Hashable) -> None:
+        """
+        Renews deadline of key, does nothing if key is not tracked
+
+        :param key: tracked object
+        """
+        with self.lock:
+            timeout = self.timeouts.get(key)
+            if timeout is not None:
+                self.deadlines[key] = monotonic() + timeout
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Stops tracking key [its entry in the wheel is skipped when its slot comes due]
+
+        :param key: tracked object
+        """
+        with self.lock:
+            self.timeouts.pop(key, None)
+            self.deadlines.pop(key, None)
+            self.scheduled.pop(key, None)
+
+    def expire(self, now: float = None) -> List[Hashable]:
+        """
+        Removes keys whose deadline passed
+
+        :param now: current monotonic time, taken from clock if not given
+        :return: expired keys
+        """
+        now = monotonic() if now is None else now
+        target = int(now / self.resolution)
+        expired = []
+
+        with self.lock:
+            # after more than one turn every slot is due, visit each of them once
+            for tick in range(max(self.tick + 1, target - self.slots + 1), target + 1):
+                slot = tick % self.slots
+                keys = self.wheel[slot]
+                if not keys:
+                    continue
+                self.wheel[slot] = []
+                for key in keys:
+                    scheduled = self.scheduled.get(key)
+                    if scheduled is None or scheduled % self.slots != slot:
+                        # key was removed or moved [entry is stale]
+                        continue
+                    if scheduled > target:
+                        # deadline is in one of next turns
+                        self.wheel[slot].append(key)
+                    elif self.deadlines[key] <= now:
+                        expired.append(key)
+                        del self.timeouts[key], self.deadlines[key], self.scheduled[key]
+                    else:
+                        # key was touched, move it to slot of its current deadline
+                        self.__schedule(key, self.deadlines[key], target)
+            self.tick = max(self.tick, target)
+
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.timeouts)
+
+    def __schedule(self, key: Hashable, deadline: float, after: int = None) -> None:
+        """ Puts key into slot of its deadline, never into a tick already expired [lock has to be held] """
+        tick = max(int(deadline / self.resolution), (self.tick if after is None else after) + 1)
+        self.scheduled[key] = tick
+        self.wheel[tick % self.slots].append(key)
@@ -0,0 +1,59 @@
+from threading import Lock, local
+
+
+class IdAllocator:
+    """ Hands out unique ids
+
+    Ids are start, start + step, start + 2 * step, ..., so allocators of different workers created with the same step
+    and different starts never give the same id.
+
+    With block_size above 1 every thread leases a block of ids under the lock and then hands them out on its own, so
+    threads meet on the lock once per block instead of once per id. Ids given to one thread still grow, but ids of
+    different threads interleave and ids left in the block of a finished thread are never used, so stores of results
+    cannot count on ids being dense [see storage.ResultStore].
+
+    With limit ids wrap around: after the greatest id not above limit the allocator starts again from the smallest id
+    of its sequence, so callers have to skip ids still in use.
+    """
+
+    def __init__(self, start: int = 1, step: int = 1, block_size: int = 1, limit: int = None) -> None:
+        """
+        :param start: first id
+        :param step: difference between consecutive ids
+        :param block_size: number of ids leased by a thread at once
+        :param limit: greatest id, no limit if not given
+        """
+        self.step = step
+        self.block_size = block_size
+        self.limit = limit
+        self.next_free = start
+        self.lock = Lock()
+        # next id and end of the block of every thread
+        self.blocks = local()
+
+    def next(self) -> int:
+        """ Returns next unique id """
+        return self.next_many(1).start
+
+    def next_many(self, number: int) -> range:
+        """
+        Returns consecutive unique ids
+
+        :param number: number of ids
+        :return: ids in order
+        """
+        blocks = self.blocks
+        first = getattr(blocks, 'next', 0)
+        end = first + number * self.step
+        if end > getattr(blocks, 'end', 0):
+            # block of thread is used up, lease a new one [at least as big as the request]
+            with self.lock:
+                if self.limit is not None and self.next_free + (number - 1) * self.step > self.limit:
+                    # ids ran out, start again from the smallest one
+                    self.next_free = (self.next_free - 1) % self.step + 1
+                first = self.next_free
+                self.next_free += max(number, self.block_size) * self.step
+                blocks.end = self.next_free if self.limit is None else min(self.next_free, self.limit + 1)
+            end = first + number * self.step
+        blocks.next = end
+        return range(first, end, self.step)
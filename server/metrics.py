@@ -0,0 +1,221 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Tuple
+
+from common.values import Mode, Operation, Error
+
+# number of modes and operations which fit into their datagram fields
+MODES = 8
+OPERATIONS = 4
+# number of error codes [they are sent in number a, so they are not limited by a field]
+ERRORS = 16
+
+# quantiles reported for every histogram
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram:
+    """ Histogram of latencies with HDR-style log-linear buckets
+
+    Values below 2 * 2^precision have their own buckets, above that every power of two is split into 2^precision
+    buckets, so any value is known with relative error below 2^-precision [about 3 % for default precision] while
+    range of days in nanoseconds needs only about a thousand counters. Recording is a few integer operations.
+    """
+
+    def __init__(self, precision: int = 5, max_value: int = 1 << 45) -> None:
+        """
+        :param precision: number of bits of value kept exactly
+        :param max_value: largest recorded value, larger values are counted as max_value
+        """
+        self.precision = precision
+        self.sub_buckets = 1 << precision
+        self.max_value = max_value
+        self.counts = [0] * (self.__index(max_value) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        """
+        Counts value
+
+        :param value: non negative integer [e.g. latency in ns]
+        """
+        value = min(value, self.max_value)
+        self.counts[self.__index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram') -> None:
+        """
+        Adds values recorded by other histogram of the same precision
+
+        :param other: histogram to add
+        """
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> int:
+        """
+        Gets value below which q of recorded values lie
+
+        :param q: quantile from 0 to 1
+        :return: upper bound of bucket holding the quantile, 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.__upper_bound(index), self.max)
+        return self.max
+
+    def __index(self, value: int) -> int:
+        """ Gets bucket of value """
+        shift = value.bit_length() - self.precision - 1
+        if shift <= 0:
+            return value
+        # top precision + 1 bits of value, the first of them is always 1
+        return self.sub_buckets * shift + (value >> shift)
+
+    def __upper_bound(self, index: int) -> int:
+        """ Gets largest value of bucket """
+        if index < 2 * self.sub_buckets:
+            return index
+        shift = index // self.sub_buckets - 1
+        top = index - self.sub_buckets * shift
+        return ((top + 1) << shift) - 1
+
+
+class Metrics:
+    """ Counters and latency histograms of requests
+
+    Requests are counted per mode and operation [operation is meaningful only for OPERATION, other modes are
+    counted under operation 0], errors sent to clients per error code. Requests being handled at the moment are
+    counted too, so it is visible how many wait for the GIL or for calculations. One short lock guards updates.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.requests = [[0] * OPERATIONS for _ in range(MODES)]
+        self.latencies = [[Histogram() for _ in range(OPERATIONS)] for _ in range(MODES)]
+        self.errors = [0] * ERRORS
+        self.in_flight = 0
+
+    def start(self) -> None:
+        """ Counts request which started being handled """
+        with self.lock:
+            self.in_flight += 1
+
+    def observe(self, mode: int, operation: int, latency: int) -> None:
+        """
+        Counts handled request
+
+        :param mode: mode of request
+        :param operation: operation of request
+        :param latency: time of handling including sending answers [ns]
+        """
+        if mode != Mode.OPERATION:
+            operation = 0
+        with self.lock:
+            self.in_flight -= 1
+            self.requests[mode][operation] += 1
+            self.latencies[mode][operation].record(latency)
+
+    def error(self, code: int) -> None:
+        """
+        Counts error answer
+
+        :param code: error code
+        """
+        with self.lock:
+            self.errors[code] += 1
+
+    def render(self, gauges: Dict[str, float] = None) -> str:
+        """
+        Renders metrics in Prometheus text format
+
+        :param gauges: other values to include, name -> value
+        :return: text with one metric per line
+        """
+        lines: List[str] = []
+        with self.lock:
+            for mode, operation, histogram in self.__histograms():
+                labels = 'mode="' + Mode.name_from_code(mode) + '"'
+                if mode == Mode.OPERATION:
+                    labels += ',operation="' + Operation.name_from_code(operation) + '"'
+                lines.append('netcalc_requests_total{' + labels + '} ' + str(self.requests[mode][operation]))
+                for q in QUANTILES:
+                    lines.append(
+                        'netcalc_request_latency_seconds{' + labels + ',quantile="' + str(q) + '"} ' +
+                        format(histogram.quantile(q) / 1e9, '.9f')
+                    )
+                lines.append('netcalc_request_latency_seconds_sum{' + labels + '} ' +
+                             format(histogram.total / 1e9, '.9f'))
+                lines.append('netcalc_request_latency_seconds_count{' + labels + '} ' + str(histogram.count))
+                lines.append('netcalc_request_latency_seconds_max{' + labels + '} ' +
+                             format(histogram.max / 1e9, '.9f'))
+
+            for code, count in enumerate(self.errors):
+                if count:
+                    lines.append('netcalc_errors_total{error="' + Error.name_from_code(code) + '"} ' + str(count))
+            lines.append('netcalc_requests_in_flight ' + str(self.in_flight))
+
+        for name, value in (gauges or {}).items():
+            lines.append('netcalc_' + name + ' ' + str(value))
+        return '\n'.join(lines) + '\n'
+
+    def __histograms(self) -> List[Tuple[int, int, Histogram]]:
+        """ Returns (mode, operation, histogram) of every mode and operation which had requests """
+        return [
+            (mode, operation, self.latencies[mode][operation])
+            for mode in range(MODES) for operation in range(OPERATIONS)
+            if self.requests[mode][operation]
+        ]
+
+
+class MetricsEndpoint:
+    """ Plain text HTTP endpoint serving metrics to scrapers
+
+    Answers every GET with current metrics, runs in its own thread, so it works regardless of server engine.
+    """
+
+    def __init__(self, host: str, port: int, render: Callable[[], str]) -> None:
+        """
+        :param host: IP address to serve metrics on
+        :param port: port number to serve metrics on
+        :param render: function returning current metrics text
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                # scrapes are not worth a line of log each
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(name='metrics_endpoint', target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        """ Starts serving metrics """
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ Stops serving metrics """
+        self.server.shutdown()
+        self.server.server_close()
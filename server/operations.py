@@ -0,0 +1,41 @@
+from math import log, sqrt, isinf, isfinite
+
+from common.values import Operation, Error
+from server.binomial import binomial_coefficient
+
+
+def calculate(operation: int, num_a: float, num_b: float) -> (float, int):
+    """
+    Makes requested calculation
+
+    :param operation: id of requested operation
+    :param num_a: number a
+    :param num_b: number b
+    :return: (result, None) on success or (None, error code) if calculation is not possible
+    """
+
+    result: float = None
+
+    try:
+        if operation == Operation.POWER:
+            # negative number to fractional power is complex
+            if num_a < 0 and isfinite(num_a) and isfinite(num_b) and not float(num_b).is_integer():
+                return None, Error.INVALID_ARGUMENT
+            result = num_a**num_b
+        elif operation == Operation.LOG:
+            result = log(num_b)/log(num_a)
+        elif operation == Operation.GEO_MEAN:
+            if num_a*num_b < 0:
+                return None, Error.INVALID_ARGUMENT
+            result = sqrt(num_a*num_b)
+        elif operation == Operation.BIN_COE:
+            return binomial_coefficient(num_a, num_b)
+    except OverflowError:
+        return None, Error.MAX_VALUE_EXCEEDED
+    except (ValueError, ZeroDivisionError):
+        return None, Error.INVALID_ARGUMENT
+
+    if isinf(result):
+        return None, Error.MAX_VALUE_EXCEEDED
+
+    return result, None
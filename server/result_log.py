@@ -0,0 +1,565 @@
+import os
+from array import array
+from collections import OrderedDict
+from bisect import bisect_right
+from mmap import mmap, ACCESS_READ
+from struct import Struct, error as struct_error
+from threading import Lock, Thread, Event
+from typing import Dict, Iterator, List, Optional
+
+from server.storage import Result
+
+# record of result: result_id, session_id, operation, padding, a, b, result [32 bytes]
+RECORD = Struct('<IHBxddd')
+# record of session index: session_id, result_id
+INDEX_RECORD = Struct('<HI')
+# result ids with special meaning in session index
+SESSION_CREATED = 0
+SESSION_REMOVED = 0xFFFFFFFF
+# header of checkpoint: covered size of index, greatest session id, greatest result id, number of sessions
+CHECKPOINT_HEADER = Struct('<QHII')
+# session of checkpoint: session_id, offset of its SESSION_CREATED entry in index, number of its results
+CHECKPOINT_SESSION = Struct('<HQI')
+
+
+def write_records(fd: int, records: Dict[int, bytes]) -> int:
+    """
+    Writes records to their offsets, every run of consecutive ids with one call
+
+    :param fd: file descriptor of records file
+    :param records: result_id -> record
+    :return: greatest written result id
+    """
+    result_ids = sorted(records)
+    start = 0
+    for i in range(1, len(result_ids) + 1):
+        if i == len(result_ids) or result_ids[i] != result_ids[i - 1] + 1:
+            run = b''.join(records[result_id] for result_id in result_ids[start:i])
+            os.pwrite(fd, run, (result_ids[start] - 1) * RECORD.size)
+            start = i
+    return result_ids[-1]
+
+
+class IndexCheckpoint:
+    """ Summary of the first size bytes of session index
+
+    Holds greatest ids, sessions with offsets of their SESSION_CREATED entries and numbers of their results, which is
+    everything start needs from the index. Saved as sessions.ckp, so start reads only entries written after it.
+    """
+
+    def __init__(self) -> None:
+        # size of index summarized [bytes]
+        self.size = 0
+        self.max_session_id = 0
+        self.max_result_id = 0
+        # session_id -> [offset of its SESSION_CREATED entry, number of its results]
+        self.sessions = {}
+
+    def apply(self, entries: bytes) -> None:
+        """
+        Adds entries following the summarized part of index
+
+        :param entries: packed (session_id, result_id) entries
+        """
+        offset = self.size
+        for session_id, result_id in INDEX_RECORD.iter_unpack(entries):
+            self.max_session_id = max(self.max_session_id, session_id)
+            if result_id == SESSION_REMOVED:
+                self.sessions.pop(session_id, None)
+            elif result_id == SESSION_CREATED:
+                self.sessions[session_id] = [offset, 0]
+            else:
+                self.max_result_id = max(self.max_result_id, result_id)
+                self.sessions.setdefault(session_id, [offset, 0])[1] += 1
+            offset += INDEX_RECORD.size
+        self.size = offset
+
+    def save(self, path: str) -> None:
+        """
+        Writes checkpoint [to a new file renamed over the old one, so a crash leaves one of them whole]
+
+        :param path: path of checkpoint
+        """
+        data = bytearray(CHECKPOINT_HEADER.pack(
+            self.size, self.max_session_id, self.max_result_id, len(self.sessions)
+        ))
+        for session_id, (offset, results) in self.sessions.items():
+            data += CHECKPOINT_SESSION.pack(session_id, offset, results)
+        with open(path + '.new', 'wb') as checkpoint_file:
+            checkpoint_file.write(data)
+        os.replace(path + '.new', path)
+
+    @classmethod
+    def load(cls, path: str, index_size: int) -> 'IndexCheckpoint':
+        """
+        Reads checkpoint
+
+        :param path: path of checkpoint
+        :param index_size: size of index [checkpoint of longer index is stale, index lost its end in a crash]
+        :return: checkpoint, empty if there is none or it cannot be used
+        """
+        checkpoint = cls()
+        try:
+            with open(path, 'rb') as checkpoint_file:
+                data = checkpoint_file.read()
+            size, max_session_id, max_result_id, count = CHECKPOINT_HEADER.unpack_from(data)
+        except (OSError, struct_error):
+            return checkpoint
+        if size > index_size or len(data) != CHECKPOINT_HEADER.size + count * CHECKPOINT_SESSION.size:
+            return checkpoint
+
+        checkpoint.size = size
+        checkpoint.max_session_id = max_session_id
+        checkpoint.max_result_id = max_result_id
+        for session_id, offset, results in CHECKPOINT_SESSION.iter_unpack(data[CHECKPOINT_HEADER.size:]):
+            checkpoint.sessions[session_id] = [offset, results]
+        return checkpoint
+
+
+class ResultLog:
+    """ Stores results of calculations on disk
+
+    Results are fixed size records in results.log, record of result n lies at offset (n - 1) * RECORD.size, so
+    reading one result is an offset calculation in memory map of the file. Records are buffered and written in
+    batches [by size or every flush_interval], mostly appending to the end of the file. Writes run outside the lock,
+    records being written are read from the batch until the map covers them.
+
+    Which results belong to which session is kept in sessions.idx, an append-only list of (session_id, result_id)
+    pairs. Sessions and next free ids are summarized in a checkpoint every CHECKPOINT_BYTES of written index and on
+    close, so start reads only the index written after the last checkpoint [see IndexCheckpoint]. Ids of results are
+    kept in memory only for sessions open in this run [until they end]. Ids of other sessions are read from the index
+    when their results are asked for [from the creation entry of session on] and kept for READ_SESSIONS sessions
+    asked for last, so query reading results page by page reads the index once and memory does not grow with results
+    of sessions which ended. Numbers of results of sessions are counted as they are added.
+
+    Has the same interface as ResultStore.
+    """
+
+    # number of index entries read at once
+    INDEX_CHUNK = 65536
+    # size of index written after which checkpoint is saved [bytes, 131072 entries]
+    CHECKPOINT_BYTES = 1 << 20
+    # number of ended sessions whose ids of results read from the index are kept
+    READ_SESSIONS = 16
+
+    def __init__(self, directory: str, flush_records: int = 1024, flush_interval: float = 0.5) -> None:
+        """
+        :param directory: directory of log files, created if it does not exist
+        :param flush_records: number of buffered results which triggers writing them
+        :param flush_interval: maximal time result stays buffered [s]
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        # held for the time of writing, so batches are written one after another and index is complete without them
+        self.flush_lock = Lock()
+
+        # open results, dropping record torn by a crash
+        self.results_fd = os.open(os.path.join(directory, 'results.log'), os.O_RDWR | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.results_fd).st_size
+        self.size -= self.size % RECORD.size
+        os.ftruncate(self.results_fd, self.size)
+        self.map: mmap = None
+        self.__remap()
+
+        # session_id -> result ids of session, None if they are not kept [session ended]
+        self.sessions = {}
+        # session_id -> result ids of ended session read from the index, the last asked for at the end
+        self.read_sessions = OrderedDict()
+        # session_id -> number of results of session, number of results of all sessions
+        self.counts = {}
+        self.count = 0
+        self.max_session_id = 0
+        self.max_result_id = self.size // RECORD.size
+        self.index_path = os.path.join(directory, 'sessions.idx')
+        self.checkpoint_path = os.path.join(directory, 'sessions.ckp')
+        # summary of index written so far and its size at the last checkpoint
+        self.index: IndexCheckpoint = None
+        self.checkpointed = 0
+        self.__load_index()
+        self.index_file = open(self.index_path, 'ab')
+
+        # result_id -> record waiting for write, records being written
+        self.pending = {}
+        self.writing = {}
+        self.pending_index = bytearray()
+
+        self.closed = Event()
+        self.flusher = Thread(name='result_log_flusher', target=self.__flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def add_session(self, session_id: int) -> None:
+        """
+        Creates empty storage for session
+
+        :param session_id: id of new session
+        """
+        with self.lock:
+            self.sessions[session_id] = array('I')
+            self.read_sessions.pop(session_id, None)
+            self.count -= self.counts.get(session_id, 0)
+            self.counts[session_id] = 0
+            self.max_session_id = max(self.max_session_id, session_id)
+            self.pending_index += INDEX_RECORD.pack(session_id, SESSION_CREATED)
+
+    def has_session(self, session_id: int) -> bool:
+        """
+        Checks if session was registered
+
+        :param session_id: id of session
+        """
+        return session_id in self.sessions
+
+    def is_session_id_free(self, session_id: int) -> bool:
+        """
+        Checks if session id can be given to a new session [records of a removed session stay in the log, but get
+        returns only results of the current session with the id]
+
+        :param session_id: id of session
+        """
+        return session_id not in self.sessions
+
+    def add(self, session_id: int, result_id: int, operation: int, a: float, b: float, result: float) -> None:
+        """
+        Saves result of calculation
+
+        :param session_id: id of session which requested calculation
+        :param result_id: id of result
+        :param operation: operation code
+        :param a: number a
+        :param b: number b
+        :param result: result of calculation
+        """
+        with self.lock:
+            result_ids = self.sessions[session_id]
+            if result_ids is not None:
+                if result_ids and result_ids[-1] > result_id:
+                    # id was leased by a thread before the last result of session was added by another one
+                    result_ids.insert(bisect_right(result_ids, result_id), result_id)
+                else:
+                    result_ids.append(result_id)
+            else:
+                # ids read from the index before are not complete any more
+                self.read_sessions.pop(session_id, None)
+            self.counts[session_id] += 1
+            self.count += 1
+            self.max_result_id = max(self.max_result_id, result_id)
+            self.pending[result_id] = RECORD.pack(result_id, session_id, operation, a, b, result)
+            self.pending_index += INDEX_RECORD.pack(session_id, result_id)
+            full = len(self.pending) >= self.flush_records
+        if full:
+            self.flush()
+
+    def session_results(self, session_id: int, after_result_id: int = 0, limit: int = None) -> List[Result]:
+        """
+        Gets results of session
+
+        :param session_id: id of session
+        :param after_result_id: return only results with greater id
+        :param limit: maximal number of results, all if None
+        :return: results in order of insertion, empty if there are none
+        """
+        with self.lock:
+            result_ids = self.__result_ids(session_id)
+            if result_ids is not None:
+                return self.__read_page(result_ids, after_result_id, limit)
+
+        # ids are read from the index, no batch may be written meanwhile
+        with self.flush_lock, self.lock:
+            result_ids = self.__result_ids(session_id)
+            if result_ids is None:
+                # ids of ended session are not kept, only those asked for lately [next pages of the same query]
+                result_ids = self.__read_index(session_id)
+                self.read_sessions[session_id] = result_ids
+                if len(self.read_sessions) > self.READ_SESSIONS:
+                    self.read_sessions.popitem(last=False)
+            return self.__read_page(result_ids, after_result_id, limit)
+
+    def get(self, result_id: int) -> Optional[Result]:
+        """
+        Gets one result
+
+        :param result_id: id of result
+        :return: result or None if it does not exist
+        """
+        with self.lock:
+            result = self.__read(result_id)
+            if result is None:
+                return None
+            result_ids = self.sessions.get(result[3], ())
+            # record of removed session whose id was given again
+            if result_ids is not None and not self.__contains(result_ids, result_id):
+                return None
+        return result
+
+    def remove_session(self, session_id: int) -> None:
+        """
+        Removes session with all its results [records stay in the log, but are no longer reachable]
+
+        :param session_id: id of session
+        """
+        with self.lock:
+            if session_id in self.sessions:
+                self.__remove(session_id)
+
+    def end_session(self, session_id: int) -> None:
+        """
+        Forgets ids of results of ended session [results stay in the log, so they survive restart and are found by
+        result id, ids are read from the index again if results of the session are asked for], session without
+        results is removed, so its id can be given again
+
+        :param session_id: id of ended session
+        """
+        with self.lock:
+            if session_id not in self.sessions:
+                return
+            if self.counts.get(session_id):
+                self.sessions[session_id] = None
+            else:
+                self.__remove(session_id)
+
+    def expire(self) -> None:
+        """ Evicts results over limits [log keeps results on disk, only buffered ones are in memory] """
+
+    def stats(self) -> dict:
+        """ Returns numbers of results in memory, spilled to disk and evicted in total """
+        with self.lock:
+            return {'resident': len(self.pending) + len(self.writing), 'spilled': 0, 'evicted': 0}
+
+    def next_ids(self) -> (int, int):
+        """ Returns (first unused session_id, first unused result_id) """
+        with self.lock:
+            return self.max_session_id + 1, self.max_result_id + 1
+
+    def flush(self) -> None:
+        """ Writes buffered results, then index entries pointing to them """
+
+        with self.flush_lock:
+            with self.lock:
+                records, self.pending = self.pending, {}
+                index, self.pending_index = self.pending_index, bytearray()
+                self.writing = records
+
+            # readers go on meanwhile, records being written are read from the batch
+            last_result_id = write_records(self.results_fd, records) if records else 0
+            if index:
+                self.index_file.write(index)
+                self.index_file.flush()
+                self.index.apply(index)
+                if self.index.size - self.checkpointed >= self.CHECKPOINT_BYTES:
+                    self.__save_checkpoint()
+
+            with self.lock:
+                self.size = max(self.size, last_result_id * RECORD.size)
+                self.__remap()
+                self.writing = {}
+
+    def close(self) -> None:
+        """ Writes buffered results and closes files """
+        self.closed.set()
+        self.flusher.join()
+        self.flush()
+        with self.flush_lock:
+            if self.index.size != self.checkpointed:
+                self.__save_checkpoint()
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+            os.close(self.results_fd)
+            self.index_file.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.count
+
+    def __read_page(self, result_ids: array, after_result_id: int, limit: Optional[int]) -> List[Result]:
+        """ Reads results with given ids [lock has to be held] """
+        start = bisect_right(result_ids, after_result_id) if after_result_id else 0
+        end = len(result_ids) if limit is None else start + limit
+        return [self.__read(result_id) for result_id in result_ids[start:end]]
+
+    def __read(self, result_id: int) -> Optional[Result]:
+        """ Reads result from buffers or from the log [lock has to be held] """
+
+        record = self.pending.get(result_id) or self.writing.get(result_id)
+        if record is not None:
+            stored_id, session_id, operation, a, b, result = RECORD.unpack(record)
+        elif self.map is not None and 0 < result_id <= len(self.map) // RECORD.size:
+            stored_id, session_id, operation, a, b, result = \
+                RECORD.unpack_from(self.map, (result_id - 1) * RECORD.size)
+        else:
+            return None
+
+        # hole in the log
+        if stored_id != result_id:
+            return None
+
+        return operation, a, b, session_id, result, result_id
+
+    def __flush_periodically(self) -> None:
+        """ Flushes buffered results until log is closed """
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def __remap(self) -> None:
+        """ Maps whole results file into memory after it grew [lock has to be held] """
+        if self.size and (self.map is None or len(self.map) < self.size):
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap(self.results_fd, self.size, access=ACCESS_READ)
+
+    def __entries(self, start: int = 0) -> Iterator[tuple]:
+        """
+        Reads (session_id, result_id) entries of index file in chunks, then those waiting for write
+
+        :param start: offset of the first entry read from the file
+        """
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(start)
+            while True:
+                chunk = index_file.read(self.INDEX_CHUNK * INDEX_RECORD.size)
+                if not chunk:
+                    break
+                yield from INDEX_RECORD.iter_unpack(chunk)
+        yield from INDEX_RECORD.iter_unpack(self.pending_index)
+
+    def __remove(self, session_id: int) -> None:
+        """ Forgets registered session [lock has to be held] """
+        del self.sessions[session_id]
+        self.read_sessions.pop(session_id, None)
+        self.count -= self.counts.pop(session_id, 0)
+        self.pending_index += INDEX_RECORD.pack(session_id, SESSION_REMOVED)
+
+    @staticmethod
+    def __contains(result_ids: array, result_id: int) -> bool:
+        """ Checks if ordered ids contain given one """
+        i = bisect_right(result_ids, result_id)
+        return i > 0 and result_ids[i - 1] == result_id
+
+    def __result_ids(self, session_id: int) -> Optional[array]:
+        """ Gets ids of results of session kept in memory, None if they have to be read [lock has to be held] """
+        result_ids = self.sessions.get(session_id, ())
+        if result_ids is None:
+            result_ids = self.read_sessions.get(session_id)
+            if result_ids is not None:
+                self.read_sessions.move_to_end(session_id)
+        return result_ids
+
+    def __read_index(self, session_id: int) -> array:
+        """ Reads ids of results of session from the index [both locks have to be held] """
+        # entries before the last creation of session are not its [written index is all summarized]
+        start = self.index.sessions.get(session_id, (self.index.size,))[0]
+        result_ids = array('I')
+        for entry_session_id, result_id in self.__entries(start):
+            if entry_session_id != session_id:
+                continue
+            if result_id in (SESSION_CREATED, SESSION_REMOVED):
+                result_ids = array('I')
+            else:
+                result_ids.append(result_id)
+        # index is in order of insertion, threads lease result ids in blocks
+        return array('I', sorted(result_ids))
+
+    def __load_index(self) -> None:
+        """ Finds sessions and greatest ids in checkpoint and index written after it, ids of results are not kept """
+
+        if not os.path.exists(self.index_path):
+            open(self.index_path, 'wb').close()
+        # drop entry torn by a crash
+        size = os.path.getsize(self.index_path)
+        size -= size % INDEX_RECORD.size
+        os.truncate(self.index_path, size)
+
+        self.index = IndexCheckpoint.load(self.checkpoint_path, size)
+        self.checkpointed = self.index.size
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(self.index.size)
+            while True:
+                chunk = index_file.read(self.INDEX_CHUNK * INDEX_RECORD.size)
+                if not chunk:
+                    break
+                self.index.apply(chunk)
+        if self.index.size - self.checkpointed >= self.CHECKPOINT_BYTES:
+            self.__save_checkpoint()
+
+        # sessions of earlier runs ended, their ids are read when asked for
+        self.sessions = dict.fromkeys(self.index.sessions)
+        self.counts = {session_id: results for session_id, (offset, results) in self.index.sessions.items()}
+        self.count = sum(self.counts.values())
+        self.max_session_id = self.index.max_session_id
+        self.max_result_id = max(self.max_result_id, self.index.max_result_id)
+
+    def __save_checkpoint(self) -> None:
+        """ Saves summary of index written so far [flush lock has to be held] """
+        self.index.save(self.checkpoint_path)
+        self.checkpointed = self.index.size
+
+
+class SpillSegment:
+    """ Results evicted from memory by ResultStore [see retention.RetentionPolicy]
+
+    Uses records of the result log, record of result n lies at offset (n - 1) * RECORD.size of spilled.seg, so
+    finding a result needs no index in memory. Results are evicted mostly in order of their ids, so the file grows
+    mostly by appending, ranges of results which were not evicted are holes taking no disk space. Records are buffered
+    and written in batches, buffered ones are read from the buffer. The segment belongs to one run of the server, it
+    is emptied when created and removed when closed.
+    """
+
+    def __init__(self, directory: str, flush_records: int = 1024) -> None:
+        """
+        :param directory: directory of the segment, created if it does not exist
+        :param flush_records: number of buffered results which triggers writing them
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'spilled.seg')
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.flush_records = flush_records
+        # result_id -> record waiting for write
+        self.pending = {}
+        # number of spilled results
+        self.count = 0
+        self.lock = Lock()
+
+    def add(self, results: List[Result]) -> None:
+        """
+        Saves evicted results
+
+        :param results: evicted results
+        """
+        with self.lock:
+            for operation, a, b, session_id, result, result_id in results:
+                self.pending[result_id] = RECORD.pack(result_id, session_id, operation, a, b, result)
+            self.count += len(results)
+            if len(self.pending) >= self.flush_records:
+                write_records(self.fd, self.pending)
+                self.pending.clear()
+
+    def get(self, result_id: int) -> Optional[Result]:
+        """
+        Gets one spilled result
+
+        :param result_id: id of result
+        :return: result or None if it was not spilled
+        """
+        if result_id <= 0:
+            return None
+        with self.lock:
+            record = self.pending.get(result_id)
+        if record is None:
+            record = os.pread(self.fd, RECORD.size, (result_id - 1) * RECORD.size)
+            if len(record) < RECORD.size:
+                return None
+
+        stored_id, session_id, operation, a, b, result = RECORD.unpack(record)
+        # hole in the segment
+        if stored_id != result_id:
+            return None
+        return operation, a, b, session_id, result, result_id
+
+    def close(self) -> None:
+        """ Removes the segment """
+        with self.lock:
+            self.pending.clear()
+            os.close(self.fd)
+            os.unlink(self.path)
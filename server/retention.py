@@ -0,0 +1,63 @@
+from typing import Optional
+
+# memory taken by one result in ResultStore [B]: columns 31, row of its session 4, location 4, insertion order 12
+RESULT_SIZE = 51
+# results evicted below a limit once it is exceeded [1/16 of the limit], so eviction runs in batches
+EVICTION_SLACK = 16
+
+
+class RetentionPolicy:
+    """ Limits of results kept in memory by ResultStore
+
+    A session keeps at most max_session_results of its newest results, all sessions together keep at most
+    max_results of the newest ones and no result is kept longer than max_age. Memory budgets are turned into numbers
+    of results [RESULT_SIZE bytes each], the tighter of a count and a budget applies. When a limit is exceeded, oldest
+    results are evicted until they are EVICTION_SLACK-th of the limit below it. Results of a session are also evicted
+    when the session ends [they can be queried only by the session itself].
+
+    Evicted results are written to a spill segment in spill_dir if it is given [see result_log.SpillSegment], so
+    queries by result id still find them, otherwise they are dropped. Queries by session id answer only results
+    kept in memory.
+    """
+
+    def __init__(
+            self, max_results: int = 0, max_session_results: int = 0, max_memory: float = 0,
+            max_session_memory: float = 0, max_age: float = 0, spill_dir: Optional[str] = None
+    ) -> None:
+        """
+        :param max_results: results of all sessions kept in memory, 0 for no limit
+        :param max_session_results: results of one session kept in memory, 0 for no limit
+        :param max_memory: memory for results of all sessions [MiB], 0 for no limit
+        :param max_session_memory: memory for results of one session [MiB], 0 for no limit
+        :param max_age: time after which result is evicted [s], 0 for no limit
+        :param spill_dir: directory of spill segment, evicted results are dropped if not given
+        """
+        self.max_results = self.__limit(max_results, max_memory)
+        self.max_session_results = self.__limit(max_session_results, max_session_memory)
+        self.max_age = max_age
+        self.spill_dir = spill_dir
+
+    @staticmethod
+    def __limit(results: int, memory: float) -> int:
+        """
+        Gets number of results allowed by count and memory budget
+
+        :param results: maximal number of results, 0 for no limit
+        :param memory: maximal memory [MiB], 0 for no limit
+        :return: the tighter of both limits, 0 for no limit
+        """
+        limits = []
+        if results > 0:
+            limits.append(results)
+        if memory > 0:
+            # a budget smaller than one result still keeps one
+            limits.append(max(int(memory * 2 ** 20) // RESULT_SIZE, 1))
+        return min(limits, default=0)
+
+    def limited(self) -> bool:
+        """ Checks if any result can be evicted """
+        return bool(self.max_results or self.max_session_results or self.max_age)
+
+    def ordered(self) -> bool:
+        """ Checks if store has to remember order in which results were added [to evict the oldest of all sessions] """
+        return bool(self.max_results or self.max_age)
@@ -0,0 +1,529 @@
+from array import array
+from bisect import bisect_right
+from itertools import count
+from multiprocessing.managers import BaseManager
+from math import inf
+from threading import Lock
+from time import monotonic
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from server.retention import EVICTION_SLACK, RetentionPolicy
+
+# stored result: (operation, a, b, session_id, result, result_id)
+Result = Tuple[int, float, float, int, float, int]
+# one array of locations covers result ids with the same bits above LOCATION_BITS
+LOCATION_BITS = 16
+LOCATION_CHUNK = 1 << LOCATION_BITS
+LOCATION_MASK = LOCATION_CHUNK - 1
+
+
+class ResultShard:
+    """ Part of ResultStore holding results of some sessions
+
+    Results are kept in typed columns [one array per field, a row per result] instead of a tuple per result.
+    Every session keeps an array of its rows in order of result ids. Rows of removed results are reused.
+    """
+
+    def __init__(self) -> None:
+        # columns of results [result id 0 marks free row]
+        self.operations = array('B')
+        self.numbers_a = array('d')
+        self.numbers_b = array('d')
+        self.session_ids = array('H')
+        self.results = array('d')
+        self.result_ids = array('I')
+
+        # session_id -> rows of session
+        self.sessions = {}
+        # rows of removed results
+        self.free_rows = array('I')
+
+        # ids and times of results in order of insertion, the oldest not evicted yet at added_head [kept only when
+        # results are evicted by age or by limit of all sessions, ids of already removed results are skipped]
+        self.added_ids = array('I')
+        self.added_times = array('d')
+        self.added_head = 0
+        # number of evicted results
+        self.evicted = 0
+
+        self.lock = Lock()
+
+    def add(self, session_id: int, result_id: int, operation: int, a: float, b: float, result: float) -> int:
+        """
+        Saves result of calculation [lock has to be held]
+
+        :return: row of result
+        """
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.operations[row] = operation
+            self.numbers_a[row] = a
+            self.numbers_b[row] = b
+            self.session_ids[row] = session_id
+            self.results[row] = result
+            self.result_ids[row] = result_id
+        else:
+            row = len(self.result_ids)
+            self.operations.append(operation)
+            self.numbers_a.append(a)
+            self.numbers_b.append(b)
+            self.session_ids.append(session_id)
+            self.results.append(result)
+            self.result_ids.append(result_id)
+
+        rows = self.sessions[session_id]
+        if rows and self.result_ids[rows[-1]] > result_id:
+            # id was leased by a thread before the last result of session was added by another one
+            rows.insert(bisect_right(rows, result_id, key=self.result_ids.__getitem__), row)
+        else:
+            rows.append(row)
+        return row
+
+    def result(self, row: int) -> Result:
+        """ Builds result tuple from row of columns [lock has to be held] """
+        return (
+            self.operations[row], self.numbers_a[row], self.numbers_b[row],
+            self.session_ids[row], self.results[row], self.result_ids[row]
+        )
+
+    def release(self, rows: Iterable[int]) -> None:
+        """ Frees rows of removed results for reuse [lock has to be held] """
+        for row in rows:
+            self.result_ids[row] = 0
+        self.free_rows.extend(rows)
+
+    def oldest(self) -> float:
+        """ Gets time when the oldest remembered result was added, inf if there is none [lock has to be held] """
+        if self.added_head < len(self.added_ids):
+            return self.added_times[self.added_head]
+        return inf
+
+    def __len__(self) -> int:
+        return len(self.result_ids) - len(self.free_rows)
+
+
+class ResultStore:
+    """ Stores results of calculations grouped by sessions
+
+    Sessions are spread over shards by session id, every shard has its own columns and lock, so handlers of
+    different sessions mostly do not wait for each other. Location of result [shard and row] is found in O(1) in
+    arrays indexed by result id, which handlers write to without a lock [creating one takes it]. Every array covers
+    LOCATION_CHUNK ids, ids never used [threads lease result ids in blocks, see ids.IdAllocator] just stay 0 in them.
+    Arrays of evicted results are dropped, so memory of locations does not grow with results which left the store.
+
+    Results over limits of retention policy are evicted [see retention.RetentionPolicy], limits of sessions on
+    insertion, limit of all sessions on every GLOBAL_CHECK-th insertion and age also periodically by expire.
+    """
+
+    # results are counted against limit of all sessions on every n-th insertion [counted by store, ids have gaps]
+    GLOBAL_CHECK = 64
+
+    def __init__(self, shards: int = 16, retention: RetentionPolicy = None) -> None:
+        """
+        :param shards: number of shards
+        :param retention: limits of results kept in memory, no limits if not given
+        """
+        self.shards = [ResultShard() for _ in range(shards)]
+        # result_id // LOCATION_CHUNK -> locations of chunk [row * len(shards) + shard + 1, 0 if there is no result]
+        self.locations = {}
+        self.locations_lock = Lock()
+        # number of insertions [next() of count is atomic under the GIL]
+        self.insertions = count(1)
+
+        self.retention = retention if retention is not None else RetentionPolicy()
+        self.limited = self.retention.limited()
+        self.ordered = self.retention.ordered()
+        # only one thread evicts over limit of all sessions at a time
+        self.eviction_lock = Lock()
+        self.spill = None
+        # ids of sessions with spilled results [their ids are not given again]
+        self.spilled_sessions = set()
+        if self.retention.spill_dir is not None:
+            # segment of evicted results [imported lazily, result_log depends on this module]
+            from server.result_log import SpillSegment
+            self.spill = SpillSegment(self.retention.spill_dir)
+
+    def add_session(self, session_id: int) -> None:
+        """
+        Creates empty storage for session
+
+        :param session_id: id of new session
+        """
+        shard = self.__shard(session_id)
+        with shard.lock:
+            shard.sessions[session_id] = array('I')
+
+    def has_session(self, session_id: int) -> bool:
+        """
+        Checks if session was registered
+
+        :param session_id: id of session
+        """
+        return session_id in self.__shard(session_id).sessions
+
+    def is_session_id_free(self, session_id: int) -> bool:
+        """
+        Checks if session id can be given to a new session [no session has it and no spilled result belongs to it]
+
+        :param session_id: id of session
+        """
+        return session_id not in self.__shard(session_id).sessions and session_id not in self.spilled_sessions
+
+    def add(self, session_id: int, result_id: int, operation: int, a: float, b: float, result: float) -> None:
+        """
+        Saves result of calculation and evicts results over limits
+
+        :param session_id: id of session which requested calculation
+        :param result_id: id of result
+        :param operation: operation code
+        :param a: number a
+        :param b: number b
+        :param result: result of calculation
+        """
+        index = session_id % len(self.shards)
+        shard = self.shards[index]
+        with shard.lock:
+            row = shard.add(session_id, result_id, operation, a, b, result)
+            locations = self.locations.get(result_id >> LOCATION_BITS)
+            if locations is None:
+                locations = self.__chunk(result_id)
+            # entries of other shards are written under their locks, the GIL makes writing one item atomic
+            locations[result_id & LOCATION_MASK] = row * len(self.shards) + index + 1
+            if self.limited:
+                self.__evict_on_add(shard, session_id, result_id)
+
+        if self.limited and self.retention.max_results and next(self.insertions) % self.GLOBAL_CHECK == 0:
+            self.__evict_over_limit()
+
+    def session_results(self, session_id: int, after_result_id: int = 0, limit: int = None) -> List[Result]:
+        """
+        Gets results of session kept in memory
+
+        Results of session have growing ids, so the query can be continued from the last result received.
+
+        :param session_id: id of session
+        :param after_result_id: return only results with greater id
+        :param limit: maximal number of results, all if None
+        :return: results in order of insertion, empty if there are none
+        """
+        shard = self.__shard(session_id)
+        with shard.lock:
+            rows = shard.sessions.get(session_id, ())
+            start = bisect_right(rows, after_result_id, key=shard.result_ids.__getitem__) if after_result_id else 0
+            end = len(rows) if limit is None else start + limit
+            return [shard.result(row) for row in rows[start:end]]
+
+    def get(self, result_id: int) -> Optional[Result]:
+        """
+        Gets one result, from spill segment if it was evicted
+
+        :param result_id: id of result
+        :return: result or None if it does not exist
+        """
+        location = self.__location(result_id)
+        if location:
+            row, index = divmod(location - 1, len(self.shards))
+            shard = self.shards[index]
+            with shard.lock:
+                # row could be reused after the location was read [result is spilled before its row is freed]
+                if row < len(shard.result_ids) and shard.result_ids[row] == result_id:
+                    return shard.result(row)
+
+        if self.spill is not None:
+            return self.spill.get(result_id)
+        return None
+
+    def remove_session(self, session_id: int) -> None:
+        """
+        Removes session with all its results
+
+        :param session_id: id of session
+        """
+        shard = self.__shard(session_id)
+        with shard.lock:
+            rows = shard.sessions.pop(session_id, ())
+            for row in rows:
+                self.__remove_location(shard.result_ids[row])
+            shard.release(rows)
+
+    def end_session(self, session_id: int) -> None:
+        """
+        Evicts all results of ended session if results are evicted at all [without limits they stay], session without
+        results is forgotten, so its id can be given again
+
+        :param session_id: id of ended session
+        """
+        shard = self.__shard(session_id)
+        with shard.lock:
+            if self.limited:
+                self.__evict(shard, shard.sessions.pop(session_id, ()))
+            elif not shard.sessions.get(session_id, True):
+                del shard.sessions[session_id]
+
+    def expire(self) -> None:
+        """ Evicts results over age and over limit of all sessions, drops locations of evicted results """
+        if not self.limited:
+            return
+
+        if self.retention.max_age:
+            cutoff = monotonic() - self.retention.max_age
+            for shard in self.shards:
+                with shard.lock:
+                    if shard.oldest() < cutoff:
+                        self.__evict_oldest(shard, cutoff)
+                    self.__compact_added(shard)
+        if self.retention.max_results:
+            self.__evict_over_limit()
+        self.__drop_locations()
+
+    def stats(self) -> dict:
+        """ Returns numbers of results in memory, spilled to disk and evicted in total """
+        return {
+            'resident': len(self),
+            'spilled': self.spill.count if self.spill is not None else 0,
+            'evicted': sum(shard.evicted for shard in self.shards),
+        }
+
+    def next_ids(self) -> (int, int):
+        """ Returns (first unused session_id, first unused result_id) """
+        last_session_id = max((max(shard.sessions, default=0) for shard in self.shards), default=0)
+        last_result_id = 0
+        for chunk in sorted(self.locations, reverse=True):
+            locations = self.locations[chunk]
+            last = next((i for i in range(len(locations) - 1, -1, -1) if locations[i]), None)
+            if last is not None:
+                last_result_id = chunk * LOCATION_CHUNK + last
+                break
+        return last_session_id + 1, last_result_id + 1
+
+    def close(self) -> None:
+        """ Releases the store [removes spill segment, results are only in memory] """
+        if self.spill is not None:
+            # results of sessions ending later are dropped
+            spill, self.spill = self.spill, None
+            spill.close()
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def __shard(self, session_id: int) -> ResultShard:
+        """ Gets shard of session """
+        return self.shards[session_id % len(self.shards)]
+
+    def __location(self, result_id: int) -> int:
+        """ Gets location of result, 0 if it is not in memory """
+        locations = self.locations.get(result_id >> LOCATION_BITS)
+        if locations is None or result_id < 0:
+            return 0
+        return locations[result_id & LOCATION_MASK]
+
+    def __chunk(self, result_id: int) -> array:
+        """ Gets locations of chunk of result, creates them if there are none """
+        chunk = result_id >> LOCATION_BITS
+        with self.locations_lock:
+            locations = self.locations.get(chunk)
+            if locations is None:
+                locations = array('I', bytes(4 * LOCATION_CHUNK))
+                self.locations[chunk] = locations
+        return locations
+
+    def __remove_location(self, result_id: int) -> None:
+        """ Forgets location of removed result [lock of its shard has to be held] """
+        locations = self.locations.get(result_id >> LOCATION_BITS)
+        if locations is not None:
+            locations[result_id & LOCATION_MASK] = 0
+
+    def __evict_on_add(self, shard: ResultShard, session_id: int, result_id: int) -> None:
+        """ Evicts results over limit of session of added result and too old ones [lock of shard has to be held] """
+        now = monotonic()
+        if self.ordered:
+            shard.added_ids.append(result_id)
+            shard.added_times.append(now)
+
+        max_session_results = self.retention.max_session_results
+        if max_session_results:
+            rows = shard.sessions[session_id]
+            if len(rows) > max_session_results:
+                excess = len(rows) - max_session_results + max_session_results // EVICTION_SLACK
+                self.__evict(shard, rows[:excess])
+                del rows[:excess]
+        if self.retention.max_age:
+            cutoff = now - self.retention.max_age
+            if shard.oldest() < cutoff:
+                self.__evict_oldest(shard, cutoff)
+        if self.ordered:
+            self.__compact_added(shard)
+
+    def __evict(self, shard: ResultShard, rows: Sequence[int]) -> None:
+        """ Removes results from memory, spills them if there is spill segment [lock of shard has to be held] """
+        if not rows:
+            return
+        if self.spill is not None:
+            self.spill.add([shard.result(row) for row in rows])
+            self.spilled_sessions.update(shard.session_ids[row] for row in rows)
+        for row in rows:
+            self.__remove_location(shard.result_ids[row])
+        shard.release(rows)
+        shard.evicted += len(rows)
+
+    def __evict_oldest(self, shard: ResultShard, cutoff: float, count: int = 0, limit: float = inf) -> int:
+        """
+        Evicts oldest results of shard [lock of shard has to be held]
+
+        Rows of a session are ordered by result ids, not by time of insertion, so evicted rows are removed from
+        arrays of their sessions one by one.
+
+        :param cutoff: time before which added results are evicted
+        :param count: number of results evicted even if they are newer
+        :param limit: maximal number of evicted results
+        :return: number of evicted results
+        """
+        rows = array('I')
+        # session_id -> its evicted rows
+        sessions = {}
+        head = shard.added_head
+        while head < len(shard.added_ids) and len(rows) < limit and (
+                len(rows) < count or shard.added_times[head] < cutoff
+        ):
+            result_id = shard.added_ids[head]
+            head += 1
+            location = self.__location(result_id)
+            # result was removed already [by limit of its session or with the session]
+            if not location:
+                continue
+            row = (location - 1) // len(self.shards)
+            rows.append(row)
+            sessions.setdefault(shard.session_ids[row], set()).add(row)
+
+        shard.added_head = head
+        for session_id, evicted in sessions.items():
+            session_rows = shard.sessions[session_id]
+            if set(session_rows[:len(evicted)]) == evicted:
+                # results were added in order of ids [almost always]
+                del session_rows[:len(evicted)]
+            else:
+                shard.sessions[session_id] = array('I', (row for row in session_rows if row not in evicted))
+        self.__evict(shard, rows)
+        return len(rows)
+
+    def __evict_over_limit(self) -> None:
+        """ Evicts oldest results of all sessions until they are below their limit """
+
+        # the other thread evicting enough for both
+        if not self.eviction_lock.acquire(blocking=False):
+            return
+        try:
+            max_results = self.retention.max_results
+            resident = len(self)
+            excess = resident - max_results
+            if excess <= 0:
+                return
+            excess += max_results // EVICTION_SLACK
+            while excess > 0:
+                oldest = []
+                for shard in self.shards:
+                    with shard.lock:
+                        oldest.append(shard.oldest())
+                first = min(oldest)
+                if first == inf:
+                    return
+                # results are assumed to come evenly over time, so about excess of them are older than cutoff
+                cutoff = first + (monotonic() - first) * excess / max(resident, 1)
+                evicted = 0
+                for shard, added in zip(self.shards, oldest):
+                    if added < cutoff:
+                        with shard.lock:
+                            evicted += self.__evict_oldest(shard, cutoff, limit=excess - evicted)
+                    if evicted >= excess:
+                        break
+                if not evicted:
+                    # the oldest result at least
+                    shard = self.shards[oldest.index(first)]
+                    with shard.lock:
+                        evicted = self.__evict_oldest(shard, first, 1)
+                excess -= evicted
+                resident -= evicted
+        finally:
+            self.eviction_lock.release()
+
+    def __compact_added(self, shard: ResultShard) -> None:
+        """ Drops entries of removed results from insertion order [lock of shard has to be held] """
+        head = shard.added_head
+        if len(shard.added_ids) - head > 2 * len(shard) + 4096:
+            # most remembered results were removed by limits of their sessions
+            kept = [i for i in range(head, len(shard.added_ids)) if self.__location(shard.added_ids[i])]
+            shard.added_ids = array('I', [shard.added_ids[i] for i in kept])
+            shard.added_times = array('d', [shard.added_times[i] for i in kept])
+            shard.added_head = 0
+        elif head > 4096 and 2 * head > len(shard.added_ids):
+            del shard.added_ids[:head]
+            del shard.added_times[:head]
+            shard.added_head = 0
+
+    def __drop_locations(self) -> None:
+        """ Drops arrays of locations whose results were all removed [but the newest one] """
+
+        empty = bytes(4 * LOCATION_CHUNK)
+        newest = max(self.locations, default=None)
+        chunks = [
+            chunk for chunk, locations in list(self.locations.items())
+            if chunk != newest and locations.tobytes() == empty
+        ]
+        if not chunks:
+            return
+
+        # locations are written under locks of shards, so all of them are taken [late result creates array again]
+        for shard in self.shards:
+            shard.lock.acquire()
+        try:
+            with self.locations_lock:
+                for chunk in chunks:
+                    # other thread could drop it already
+                    locations = self.locations.get(chunk)
+                    if locations is not None and locations.tobytes() == empty:
+                        del self.locations[chunk]
+        finally:
+            for shard in self.shards:
+                shard.lock.release()
+
+
+class StoreManager(BaseManager):
+    """ Serves one ResultStore to many processes over a local socket """
+
+
+def _result_log(directory: str):
+    """ Creates ResultLog [imported lazily, result_log depends on this module] """
+    from server.result_log import ResultLog
+    return ResultLog(directory)
+
+
+StoreManager.register('ResultStore', ResultStore)
+StoreManager.register('ResultLog', _result_log)
+
+
+def create_store(results_dir: str = None, retention: RetentionPolicy = None):
+    """
+    Creates store of results
+
+    :param results_dir: directory of persistent result log, None for keeping results in memory
+    :param retention: limits of results kept in memory [log keeps them on disk, so it has none]
+    :return: ResultLog if directory was given, ResultStore otherwise
+    """
+    if results_dir is None:
+        return ResultStore(retention=retention)
+    return _result_log(results_dir)
+
+
+def create_shared_store(results_dir: str = None, retention: RetentionPolicy = None) -> (StoreManager, ResultStore):
+    """
+    Starts store process
+
+    :param results_dir: directory of persistent result log, None for keeping results in memory
+    :param retention: limits of results kept in memory [log keeps them on disk, so it has none]
+    :return: (running manager, proxy of the store, which can be passed to worker processes)
+    """
+    manager = StoreManager()
+    manager.start()
+    if results_dir is None:
+        return manager, manager.ResultStore(retention=retention)
+    return manager, manager.ResultLog(results_dir)
@@ -0,0 +1,179 @@
+from typing import List, Tuple
+
+from common.values import Operation, Error
+from server.binomial import LOG_MAX_FLOAT, MAX_EXACT_STEPS
+from server.operations import calculate
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# batches smaller than that are calculated one by one, converting them to arrays costs more than it saves
+MIN_VECTORIZED_BATCH = 32
+
+# binomial coefficients up to that are multiplied out with integers, so they are rounded to float64 only once
+MAX_EXACT_INTEGER = 2 ** 54
+
+# coefficients of Stirling series of log-gamma [terms x^-1, x^-3, x^-5, x^-7]
+STIRLING_TERMS = (1 / 12, -1 / 360, 1 / 1260, -1 / 1680)
+
+
+def calculate_many(requests: List[Tuple[int, float, float]]) -> List[Tuple[float, int]]:
+    """
+    Makes batch of calculations
+
+    Requests are grouped by operation and every group is calculated with NumPy at once. Invalid arguments and
+    results exceeding float64 are masked out, so they get the same error codes as from calculate. Results may
+    differ from calculate in the last bits [NumPy power and logarithm are not those of the C library, binomial
+    coefficients above MAX_EXACT_STEPS use a different log-gamma], so they are not mixed with results of calculate
+    in the cache of the server. Without NumPy [or for small batches] requests are calculated one by one.
+
+    :param requests: list of (operation, a, b)
+    :return: list of (result, None) or (None, error code) in order of requests
+    """
+
+    if np is None or len(requests) < MIN_VECTORIZED_BATCH:
+        return [calculate(operation, num_a, num_b) for operation, num_a, num_b in requests]
+
+    answers: List[Tuple[float, int]] = [None] * len(requests)
+
+    operations, numbers_a, numbers_b = zip(*requests)
+    codes = np.array(operations, dtype=np.uint8)
+    numbers_a = np.array(numbers_a, dtype=np.float64)
+    numbers_b = np.array(numbers_b, dtype=np.float64)
+
+    for operation in (Operation.POWER, Operation.LOG, Operation.GEO_MEAN, Operation.BIN_COE):
+        indices = np.flatnonzero(codes == operation)
+        if not len(indices):
+            continue
+
+        results, invalid = _calculate_group(operation, numbers_a[indices], numbers_b[indices])
+        errors = np.where(invalid, Error.INVALID_ARGUMENT, np.where(np.isinf(results), Error.MAX_VALUE_EXCEEDED, -1))
+
+        for i, result, error in zip(indices.tolist(), results.tolist(), errors.tolist()):
+            answers[i] = (result, None) if error < 0 else (None, error)
+
+    return answers
+
+
+def _calculate_group(operation: int, num_a: 'np.ndarray', num_b: 'np.ndarray') -> ('np.ndarray', 'np.ndarray'):
+    """
+    Calculates one operation for arrays of arguments
+
+    :param operation: id of operation
+    :param num_a: numbers a
+    :param num_b: numbers b
+    :return: (results, mask of invalid arguments) [results exceeding float64 are infinite]
+    """
+
+    with np.errstate(all='ignore'):
+        if operation == Operation.POWER:
+            results = np.power(num_a, num_b)
+            finite_b = np.isfinite(num_b)
+            # zero to negative power is division by zero
+            invalid = (num_a == 0) & (num_b < 0) & finite_b
+            # negative number to fractional power is complex
+            invalid |= np.isfinite(num_a) & (num_a < 0) & finite_b & (num_b != np.floor(num_b))
+        elif operation == Operation.LOG:
+            log_a = np.log(num_a)
+            results = np.log(num_b) / log_a
+            # logarithm of non positive number or base equal to one
+            invalid = (num_a <= 0) | (num_b <= 0) | (log_a == 0)
+        elif operation == Operation.GEO_MEAN:
+            product = num_a * num_b
+            results = np.sqrt(product)
+            invalid = product < 0
+        else:
+            results, invalid = _binomial_coefficients(num_a, num_b)
+
+    return results, invalid
+
+
+def _binomial_coefficients(num_a: 'np.ndarray', num_b: 'np.ndarray') -> ('np.ndarray', 'np.ndarray'):
+    """
+    Calculates a choose b for arrays of arguments [see binomial.binomial_coefficient]
+
+    Coefficients with k = min(b, a - b) up to MAX_EXACT_STEPS are multiplied out step by step for the whole group
+    at once [small ones with integers, so exactly like math.comb], larger ones are approximated with log-gamma.
+
+    :param num_a: numbers a
+    :param num_b: numbers b
+    :return: (results, mask of invalid arguments) [results exceeding float64 are infinite]
+    """
+
+    # only non negative integers with b <= a
+    invalid = ~np.isfinite(num_a) | ~np.isfinite(num_b)
+    invalid |= (num_a != np.floor(num_a)) | (num_b != np.floor(num_b))
+    invalid |= (num_b > num_a) | (num_a < 0) | (num_b < 0)
+
+    n = np.where(invalid, 0, num_a)
+    k = np.minimum(np.where(invalid, 0, num_b), n - np.where(invalid, 0, num_b))
+    results = np.ones_like(n)
+
+    # (n / k)^k <= n choose k, so if the bound does not fit, neither does the result
+    positive = k > 0
+    safe_k = np.where(positive, k, 1)
+    exceeded = positive & (safe_k * (np.log(np.where(positive, n, 1)) - np.log(safe_k)) > LOG_MAX_FLOAT)
+
+    exact = positive & ~exceeded & (k <= MAX_EXACT_STEPS)
+    if exact.any():
+        results[exact] = _multiply_out(n[exact], k[exact])
+
+    approximated = positive & ~exceeded & (k > MAX_EXACT_STEPS)
+    if approximated.any():
+        n_large, k_large = n[approximated], k[approximated]
+        log_results = _log_gamma(n_large + 1) - _log_gamma(k_large + 1) - _log_gamma(n_large - k_large + 1)
+        results[approximated] = np.where(log_results > LOG_MAX_FLOAT, np.inf, np.exp(log_results))
+
+    results[exceeded] = np.inf
+    return results, invalid
+
+
+def _multiply_out(n: 'np.ndarray', k: 'np.ndarray') -> 'np.ndarray':
+    """
+    Calculates n choose k as C(n - k + i, i) = C(n - k + i - 1, i - 1) * (n - k + i) / i for i from 1 to k
+
+    Products are kept both as floats and as integers. Integers are exact while C(n - k + i, i) * i fits int64
+    [always if the coefficient is at most MAX_EXACT_INTEGER, as i <= MAX_EXACT_STEPS = 2^8], so such coefficients
+    are taken from them and rounded to float64 once, like float(math.comb(n, k)).
+
+    :param n: numbers n
+    :param k: numbers k, from 1 to MAX_EXACT_STEPS
+    :return: coefficients as float64
+    """
+    # arguments ordered by k descending, so at every step the ones still multiplied are a prefix
+    order = np.argsort(-k, kind='stable')
+    n, k = n[order], k[order]
+    bottom = n - k
+    # integers of coefficients too big for them are meaningless [they wrap], only their floats are used
+    bottom_integer = np.minimum(bottom, MAX_EXACT_INTEGER).astype(np.int64)
+    steps = np.searchsorted(-k, -np.arange(1, int(k[0]) + 1), side='right')
+
+    product = np.ones_like(n)
+    product_integer = np.ones(len(n), dtype=np.int64)
+    for i, active in enumerate(steps.tolist(), 1):
+        factor = bottom[:active] + i
+        grown = product[:active] * factor
+        # near the float64 limit divide first, results there are not exact anyway
+        product[:active] = np.where(np.isinf(grown), product[:active] / i * factor, grown / i)
+        product_integer[:active] = product_integer[:active] * (bottom_integer[:active] + i) // i
+
+    results = np.empty_like(product)
+    results[order] = np.where(product <= MAX_EXACT_INTEGER, product_integer, product)
+    return results
+
+
+def _log_gamma(x: 'np.ndarray') -> 'np.ndarray':
+    """
+    Calculates natural logarithm of gamma function with Stirling series [NumPy has no log-gamma ufunc]
+
+    :param x: arguments, at least MAX_EXACT_STEPS [series is accurate to float64 precision from about 10]
+    :return: log-gamma of arguments
+    """
+    inverse = 1 / x
+    inverse_square = inverse * inverse
+    series = np.zeros_like(x)
+    for coefficient in reversed(STIRLING_TERMS):
+        series = series * inverse_square + coefficient
+    return (x - 0.5) * np.log(x) - x + 0.5 * np.log(2 * np.pi) + series * inverse
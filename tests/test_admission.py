@@ -0,0 +1,100 @@
+import pytest
+
+from server import admission
+from server.admission import AdmissionControl, TokenBucket
+
+
+class Clock:
+    """ Time of buckets which goes on only when told to """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(admission, 'monotonic', clock)
+    return clock
+
+
+def test_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    assert [bucket.take(1) for _ in range(5)] == [0] * 5
+    assert bucket.take(2) == pytest.approx(0.2)
+
+    clock.now += 0.1
+    assert bucket.take(1) == 0
+    assert bucket.take(1) == pytest.approx(0.1)
+    clock.now += 100
+    # no more than burst is saved
+    assert bucket.take(5) == 0
+    assert bucket.take(1) == pytest.approx(0.1)
+
+
+def test_work_bigger_than_burst_leaves_bucket_in_debt(clock):
+    bucket = TokenBucket(rate=10, burst=5)
+    assert bucket.take(25) == 0
+    assert bucket.take(1) == pytest.approx(2.1)
+
+
+def test_session_over_its_rate_is_refused_with_time_to_retry(clock):
+    control = AdmissionControl(session_rate=10, session_burst=8)
+    assert control.admit('a', 4) is None
+    assert control.admit('a', 4) is None
+    assert control.admit('a', 2) == pytest.approx(0.2)
+    # other sessions have their own buckets
+    assert control.admit('b', 8) is None
+
+    clock.now += 0.2
+    assert control.admit('a', 2) is None
+    assert control.refused == 1
+    assert control.pending == 18
+
+
+def test_all_sessions_share_global_rate(clock):
+    control = AdmissionControl(session_rate=100, global_rate=10, global_burst=6)
+    assert control.admit('a', 4) is None
+    assert control.admit('b', 4) == pytest.approx(0.2)
+    # refused session got its tokens back
+    assert control.buckets['b'].tokens == 100
+    assert control.refused == 1
+
+
+def test_work_over_max_pending_is_refused_until_done(clock):
+    control = AdmissionControl(max_pending=10)
+    assert control.admit('a', 6) is None
+    assert control.admit('b', 4) is None
+    # it is not known when the pending work finishes
+    assert control.admit('c', 1) == 0
+    control.done(4)
+    assert control.admit('c', 1) is None
+    assert control.pending == 7
+
+    control.done(6)
+    control.done(1)
+    # work bigger than the limit is admitted when nothing else is pending
+    assert control.admit('a', 50) is None
+    assert control.admit('b', 1) == 0
+    assert control.refused == 2
+
+
+def test_charged_batch_is_admitted_without_taking_tokens_again(clock):
+    control = AdmissionControl(session_rate=10, global_rate=100, max_pending=10)
+    assert [control.charge('a', 2) for _ in range(5)] == [None] * 5
+    assert control.charge('a', 2) == pytest.approx(0.2)
+    assert control.admit('a', 10, charged=True) is None
+    assert control.admit('a', 1, charged=True) == 0
+    assert control.global_bucket.tokens == 90
+    assert control.refused == 2
+
+
+def test_control_without_limits_admits_everything():
+    control = AdmissionControl()
+    assert all(control.admit(session, 1000) is None for session in range(100))
+    assert control.charge('a', 1e9) is None
+    assert control.refused == 0
+    assert not control.buckets
@@ -0,0 +1,61 @@
+from math import comb, nan, inf
+
+import pytest
+
+from common.values import Error
+from server.binomial import MAX_EXACT_STEPS, binomial_coefficient
+
+
+def relative_error(result: float, exact: int) -> float:
+    return abs(result - exact) / exact
+
+
+@pytest.mark.parametrize('n, k', [(1, 1), (60, 30), (2 ** 53, 2), (1000, MAX_EXACT_STEPS), (1030, MAX_EXACT_STEPS)])
+def test_coefficients_up_to_max_exact_steps_are_exact(n, k):
+    assert binomial_coefficient(n, k) == (float(comb(n, k)), None)
+    # by symmetry the same steps are needed for b and a - b
+    assert binomial_coefficient(n, n - k) == (float(comb(n, k)), None)
+
+
+@pytest.mark.parametrize('n', [MAX_EXACT_STEPS + 1, 600, 1000, 1029])
+def test_coefficients_above_max_exact_steps_are_approximated(n):
+    for k in range(MAX_EXACT_STEPS + 1, n // 2 + 1, 17):
+        result, error = binomial_coefficient(n, k)
+        assert error is None
+        assert relative_error(result, comb(n, k)) < 1e-10
+    assert binomial_coefficient(1000, 300, max_exact_steps=300) == (float(comb(1000, 300)), None)
+
+
+def test_coefficients_at_max_exact_steps_boundary():
+    exact, _ = binomial_coefficient(1000, MAX_EXACT_STEPS)
+    approximated, _ = binomial_coefficient(1000, MAX_EXACT_STEPS, max_exact_steps=MAX_EXACT_STEPS - 1)
+    assert exact == float(comb(1000, MAX_EXACT_STEPS))
+    assert relative_error(approximated, comb(1000, MAX_EXACT_STEPS)) < 1e-10
+
+    # the greatest coefficients still fitting float64
+    assert relative_error(binomial_coefficient(1029, 514)[0], comb(1029, 514)) < 1e-10
+    assert binomial_coefficient(1030, 515) == (None, Error.MAX_VALUE_EXCEEDED)
+
+
+@pytest.mark.parametrize('a, b', [(10, 0), (10, 10), (0, 0), (1e300, 1e300)])
+def test_trivial_coefficients(a, b):
+    assert binomial_coefficient(a, b) == (1.0, None)
+
+
+@pytest.mark.parametrize('a, b', [
+    (5, 6), (-5, 2), (5, -2), (5.5, 2), (5, 2.5), (nan, 2), (5, nan), (inf, 2), (inf, inf),
+])
+def test_invalid_arguments(a, b):
+    assert binomial_coefficient(a, b) == (None, Error.INVALID_ARGUMENT)
+
+
+@pytest.mark.parametrize('a, b', [
+    # rejected by lower bound without calculation
+    (10 ** 6, MAX_EXACT_STEPS), (2000, 1000), (1e300, 1e10),
+    # overflowing exact result
+    (10 ** 5, 100),
+    # overflowing approximation
+    (1030, 500),
+])
+def test_results_exceeding_float_are_rejected(a, b):
+    assert binomial_coefficient(a, b) == (None, Error.MAX_VALUE_EXCEEDED)
@@ -0,0 +1,81 @@
+from math import nan
+
+import pytest
+
+from common.values import Error, Operation
+from server import cache
+from server.cache import ResultCache
+
+
+class Clock:
+    """ Time of cache which goes on only when told to """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(cache, 'monotonic', clock)
+    return clock
+
+
+def test_outcomes_expire_after_ttl(clock):
+    results = ResultCache(ttl=10)
+    results.put(Operation.POWER, 2, 10, (1024.0, None))
+    results.put(Operation.LOG, -1, 2, (None, Error.INVALID_ARGUMENT))
+
+    clock.now += 10
+    assert results.get(Operation.POWER, 2, 10) == (1024.0, None)
+    assert results.get(Operation.LOG, -1, 2) == (None, Error.INVALID_ARGUMENT)
+    # putting again renews entry
+    results.put(Operation.POWER, 2, 10, (1024.0, None))
+
+    clock.now += 0.5
+    assert results.get(Operation.LOG, -1, 2) is None
+    assert results.get(Operation.POWER, 2, 10) == (1024.0, None)
+    clock.now += 10
+    assert results.get(Operation.POWER, 2, 10) is None
+    assert results.stats() == {'entries': 0, 'hits': 3, 'misses': 2, 'evictions': 0, 'expirations': 2}
+
+
+def test_outcomes_without_ttl_do_not_expire(clock):
+    results = ResultCache(ttl=None)
+    results.put(Operation.POWER, 2, 10, (1024.0, None))
+    clock.now += 1e9
+    assert results.get(Operation.POWER, 2, 10) == (1024.0, None)
+
+
+def test_least_recently_used_outcome_is_evicted():
+    results = ResultCache(max_entries=3)
+    for b in range(3):
+        results.put(Operation.POWER, 2, b, (2.0 ** b, None))
+    # the oldest entry is used, so the second one is the least recently used
+    assert results.get(Operation.POWER, 2, 0) == (1.0, None)
+    results.put(Operation.POWER, 2, 3, (8.0, None))
+
+    assert results.get(Operation.POWER, 2, 1) is None
+    assert [results.get(Operation.POWER, 2, b) for b in (0, 2, 3)] == [(1.0, None), (4.0, None), (8.0, None)]
+    assert results.stats()['evictions'] == 1
+    assert results.stats()['entries'] == 3
+
+
+def test_arguments_are_compared_by_bits():
+    results = ResultCache()
+    results.put(Operation.GEO_MEAN, 0.0, 1, (0.0, None))
+    results.put(Operation.GEO_MEAN, nan, 1, (nan, None))
+    assert results.get(Operation.GEO_MEAN, -0.0, 1) is None
+    assert results.get(Operation.LOG, 0.0, 1) is None
+    assert results.get(Operation.GEO_MEAN, 0, 1) == (0.0, None)
+    assert results.get(Operation.GEO_MEAN, nan, 1) is not None
+
+
+def test_cache_of_no_entries_is_disabled():
+    results = ResultCache(max_entries=0)
+    results.put(Operation.POWER, 2, 10, (1024.0, None))
+    assert results.get(Operation.POWER, 2, 10) is None
+    assert results.stats() == {'entries': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
@@ -0,0 +1,101 @@
+import random
+import struct
+
+import pytest
+
+from common.Datagram import A_SHIFT, B_SHIFT, MASK_64, RESULT_SHIFT, Datagram
+from common.values import DATAGRAM_BYTES
+
+# bit patterns of special IEEE-754 numbers
+SPECIAL_NUMBERS = [
+    0x7FF8000000000000,  # quiet NaN
+    0xFFF8000000000001,  # negative quiet NaN with payload
+    0x7FF0000000000001,  # signalling NaN
+    0x7FF4000000000000,  # signalling NaN
+    0x7FF0000000000000,  # +inf
+    0xFFF0000000000000,  # -inf
+    0x0000000000000000,  # +0
+    0x8000000000000000,  # -0
+    0x0000000000000001,  # smallest subnormal
+    0x800FFFFFFFFFFFFF,  # greatest negative subnormal
+    0x7FEFFFFFFFFFFFFF,  # max double
+    0xFFEFFFFFFFFFFFFF,  # min double
+]
+
+
+def bits(number: float) -> int:
+    """ Returns bit pattern of number, so NaNs compare by their payload """
+    return struct.unpack('>Q', struct.pack('>d', number))[0]
+
+
+def fields(datagram: Datagram) -> tuple:
+    """ Returns fields of datagram with numbers as bit patterns """
+    return (
+        datagram.status, datagram.mode, datagram.session_id, datagram.operation, bits(datagram.a), bits(datagram.b),
+        bits(datagram.result), datagram.result_id, datagram.last
+    )
+
+
+def with_numbers(binary: bytes, a: int, b: int, result: int) -> bytes:
+    """ Replaces numbers of encoded datagram with given bit patterns """
+    value = int.from_bytes(binary, 'big')
+    for shift, number in ((A_SHIFT, a), (B_SHIFT, b), (RESULT_SHIFT, result)):
+        value = value & ~(MASK_64 << shift) | number << shift
+    return value.to_bytes(DATAGRAM_BYTES, 'big')
+
+
+def random_datagrams(count: int, seed: int) -> list:
+    """ Returns encoded datagrams with all bits random """
+    generator = random.Random(seed)
+    return [generator.getrandbits(DATAGRAM_BYTES * 8).to_bytes(DATAGRAM_BYTES, 'big') for _ in range(count)]
+
+
+def special_datagrams() -> list:
+    """ Returns encoded datagrams carrying every special number in every number field """
+    generator = random.Random(0)
+    datagrams = []
+    for number in SPECIAL_NUMBERS:
+        for _ in range(4):
+            binary = generator.getrandbits(DATAGRAM_BYTES * 8).to_bytes(DATAGRAM_BYTES, 'big')
+            others = [generator.choice(SPECIAL_NUMBERS) for _ in range(2)]
+            datagrams.append(with_numbers(binary, number, *others))
+            datagrams.append(with_numbers(binary, others[0], number, others[1]))
+            datagrams.append(with_numbers(binary, *others, number))
+    return datagrams
+
+
+@pytest.mark.parametrize('binary', random_datagrams(500, 1) + special_datagrams())
+def test_from_bytes_matches_reference(binary):
+    assert fields(Datagram.from_bytes(binary)) == fields(Datagram.from_bytes_reference(binary))
+
+
+@pytest.mark.parametrize('binary', random_datagrams(500, 2) + special_datagrams())
+def test_get_bytes_matches_reference(binary):
+    datagram = Datagram.from_bytes_reference(binary)
+    assert datagram.get_bytes() == datagram.get_bytes_reference() == binary
+
+
+def test_peek_header_matches_decoding():
+    for binary in random_datagrams(100, 3):
+        datagram = Datagram.from_bytes(binary)
+        assert Datagram.peek_header(binary) == (datagram.mode, datagram.operation)
+
+
+def test_from_bytes_accepts_memoryview():
+    binary = random_datagrams(1, 4)[0]
+    assert fields(Datagram.from_bytes(memoryview(binary))) == fields(Datagram.from_bytes_reference(binary))
+
+
+def test_short_datagram_is_rejected():
+    with pytest.raises(ValueError):
+        Datagram.from_bytes(bytes(DATAGRAM_BYTES - 1))
+
+
+@pytest.mark.parametrize('field, value', [
+    ('operation', 4), ('status', -1), ('session_id', 2 ** 16), ('mode', 8), ('result_id', 2 ** 32)
+])
+def test_out_of_range_field_is_rejected(field, value):
+    datagram = Datagram(0, 0)
+    setattr(datagram, field, value)
+    with pytest.raises(ValueError):
+        datagram.get_bytes()
@@ -0,0 +1,55 @@
+import socket
+import time
+
+import pytest
+
+import netcalc_server
+from client.embedded import EmbeddedConnection
+from common.values import Operation, Status
+
+
+def free_port() -> int:
+    """ Returns port nobody listens on at the moment """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture(params=sorted(netcalc_server.ENGINES))
+def server(request):
+    server = netcalc_server.ENGINES[request.param]('127.0.0.1', free_port())
+    server.start()
+    # embedded sessions of async engine wait for its event loop
+    time.sleep(0.2)
+    yield server
+    server.stop()
+    server.join()
+
+
+def test_embedded_session_is_kept_alive_as_pooled_connection(server):
+    connection = EmbeddedConnection(server, heartbeat_interval=0.5)
+    assert connection.compute(Operation.POWER, 2, 10).result == 1024
+
+    quiet_since = connection.last_request
+    # request of the caller in progress is not interrupted by heartbeat
+    with connection.lock:
+        connection.keep_alive(0)
+    assert connection.last_request == quiet_since
+
+    for _ in range(6):
+        time.sleep(0.3)
+        connection.keep_alive(0.25)
+    assert connection.last_request > quiet_since
+    # session outlived three heartbeat intervals without a request of the caller
+    assert connection.is_alive()
+    assert connection.compute(Operation.LOG, 2, 8).status == Status.OK
+    connection.close()
+
+
+def test_heartbeat_of_closed_embedded_session_does_not_raise(server):
+    connection = EmbeddedConnection(server)
+    server.stop()
+    server.join()
+    connection.keep_alive(0)
+    with pytest.raises(ConnectionAbortedError):
+        connection.compute(Operation.POWER, 2, 10)
@@ -0,0 +1,106 @@
+import pytest
+
+from server import idle
+from server.idle import IdleTracker
+
+
+class Clock:
+    """ Time of tracker which goes on only when told to """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(idle, 'monotonic', clock)
+    return clock
+
+
+def test_keys_expire_after_their_timeout(clock):
+    tracker = IdleTracker(resolution=0.25, slots=16)
+    tracker.add('a', 1)
+    tracker.add('b', 2)
+    tracker.add('c', 2)
+
+    assert tracker.expire(clock.now + 0.9) == []
+    assert tracker.expire(clock.now + 1) == ['a']
+    assert sorted(tracker.expire(clock.now + 2.5)) == ['b', 'c']
+    assert len(tracker) == 0
+    assert tracker.expire(clock.now + 10) == []
+
+
+def test_touch_delays_expiry(clock):
+    tracker = IdleTracker(resolution=0.25, slots=16)
+    tracker.add('a', 1)
+    tracker.add('b', 1)
+    expired = []
+    for _ in range(10):
+        clock.now += 0.75
+        tracker.touch('a')
+        expired += tracker.expire()
+    assert expired == ['b']
+
+    clock.now += 0.9
+    assert tracker.expire() == []
+    clock.now += 0.1
+    assert tracker.expire() == ['a']
+    # touch of key which is not tracked is ignored
+    tracker.touch('a')
+    assert len(tracker) == 0
+
+
+def test_removed_keys_do_not_expire(clock):
+    tracker = IdleTracker(resolution=0.25, slots=16)
+    tracker.add('a', 1)
+    tracker.add('b', 1)
+    tracker.remove('a')
+    tracker.remove('c')
+    clock.now += 5
+    assert tracker.expire() == ['b']
+
+    # key added again gets its new timeout only
+    tracker.add('a', 1)
+    tracker.remove('a')
+    tracker.add('a', 3)
+    clock.now += 2
+    assert tracker.expire() == []
+    clock.now += 1
+    assert tracker.expire() == ['a']
+
+
+def test_shorter_timeout_moves_key_to_earlier_slot(clock):
+    tracker = IdleTracker(resolution=0.25, slots=16)
+    tracker.add('a', 3)
+    tracker.add('a', 1)
+    assert tracker.expire(clock.now + 1) == ['a']
+
+
+def test_timeouts_longer_than_one_turn_of_wheel(clock):
+    # one turn of the wheel is 4 s
+    tracker = IdleTracker(resolution=0.25, slots=16)
+    tracker.add('a', 10)
+    tracker.add('b', 4.1)
+    for step in range(1, 50):
+        expired = tracker.expire(clock.now + step * 0.25)
+        if step * 0.25 < 4.1:
+            assert expired == []
+        elif step * 0.25 < 4.5:
+            assert expired == ['b']
+        elif step * 0.25 < 10:
+            assert expired == []
+        else:
+            assert expired == ['a']
+            break
+    assert len(tracker) == 0
+
+
+def test_expiry_after_long_pause_visits_every_slot_once(clock):
+    tracker = IdleTracker(resolution=0.25, slots=16)
+    for key in range(100):
+        tracker.add(key, 1 + key * 0.5)
+    assert sorted(tracker.expire(clock.now + 1000)) == list(range(100))
@@ -0,0 +1,61 @@
+import socket
+import struct
+import time
+
+import pytest
+
+import netcalc_server
+from client.pool import Connection
+from common.Datagram import Datagram
+from common.protocol import VERSION_1
+from common.values import Mode, Operation, Status
+
+# results of the queried session, so answers do not fit socket buffers and writing them is aborted
+RESULTS = 4 * netcalc_server.Server.MAX_BATCH
+
+
+def free_port() -> int:
+    """ Returns port nobody listens on at the moment """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def connect(port: int) -> Connection:
+    """ Opens session with server which may be still starting """
+    for _ in range(50):
+        try:
+            return Connection('127.0.0.1', port, protocol_version=VERSION_1)
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    raise ConnectionRefusedError('server did not start')
+
+
+@pytest.fixture(params=sorted(netcalc_server.ENGINES))
+def server(request):
+    server = netcalc_server.ENGINES[request.param]('127.0.0.1', free_port(), cache_size=0)
+    server.start()
+    yield server
+    server.stop()
+    server.join()
+
+
+def test_aborted_session_query_leaves_no_request_in_flight(server):
+    connection = connect(server.port)
+    for _ in range(RESULTS // server.MAX_BATCH):
+        connection.compute_many([(Operation.POWER, 2, i % 64) for i in range(server.MAX_BATCH)])
+
+    # ask for all results and reset the connection without reading them
+    connection.writer.write(connection.codec.encode(
+        Datagram(Status.NEW, Mode.QUERY_BY_SESSION_ID, connection.session_id)
+    ))
+    connection.writer.flush()
+    connection.socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    connection.close_transport()
+
+    deadline = time.monotonic() + 10
+    while server.sessions and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not server.sessions
+    assert server.metrics.in_flight == 0
+    assert 'netcalc_requests_in_flight 0\n' in server.render_metrics()
@@ -0,0 +1,70 @@
+import socket
+import time
+
+import pytest
+
+import netcalc_server
+from client.pool import ClientPool
+from common.values import Operation, Status
+
+
+def free_port() -> int:
+    """ Returns port nobody listens on at the moment """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture(params=sorted(netcalc_server.ENGINES))
+def pool(request):
+    server = netcalc_server.ENGINES[request.param]('127.0.0.1', free_port())
+    server.start()
+    for _ in range(50):
+        try:
+            pool = ClientPool('127.0.0.1', server.port, max_size=2, min_idle=1, heartbeat_interval=60)
+            with pool.lease():
+                break
+        except ConnectionRefusedError:
+            pool.close()
+            time.sleep(0.1)
+    yield pool
+    pool.close()
+    server.stop()
+    server.join()
+
+
+def test_error_of_caller_does_not_discard_connection(pool):
+    with pytest.raises(ValueError):
+        with pool.lease() as connection:
+            assert connection.compute(Operation.POWER, 2, 10).status == Status.OK
+            raise ValueError('invalid input of the caller')
+    assert not connection.broken
+    assert pool.stats()['idle'] == 1
+
+    with pool.lease() as again:
+        assert again is connection
+        assert again.compute(Operation.LOG, 2, 8).result == 3
+
+
+def test_failed_connection_is_discarded(pool):
+    with pytest.raises(OSError):
+        with pool.lease() as connection:
+            connection.socket.close()
+            connection.compute(Operation.POWER, 2, 10)
+    assert connection.broken
+    assert pool.stats()['size'] == 0
+
+    with pool.lease() as replacement:
+        assert replacement is not connection
+        assert replacement.compute(Operation.POWER, 2, 10).result == 1024
+
+
+def test_connection_failed_while_caught_by_caller_is_discarded(pool):
+    with pool.lease() as connection:
+        connection.socket.shutdown(socket.SHUT_RDWR)
+        try:
+            connection.compute(Operation.POWER, 2, 10)
+        except OSError:
+            pass
+    assert connection.broken
+    assert pool.stats() == {'size': 0, 'idle': 0, 'replaced': 0, 'expired': 0}
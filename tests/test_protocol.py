@@ -0,0 +1,185 @@
+import socket
+
+import pytest
+
+from common import protocol
+from common.Datagram import Datagram
+from common.framing import FrameReader
+from common.protocol import (
+    ABSOLUTE_IDS, BLOCK, Codec, FLOAT_A, FLOAT_B, FLOAT_RESULT, HEADER, IDS_MASK, ResultBlock, VERSION_1, VERSION_2
+)
+from common.values import Error, Mode, Operation, Status
+
+
+def codec_of(version: int, session_id: int = 7) -> Codec:
+    """ Returns codec upgraded to version """
+    codec = Codec()
+    codec.upgrade(version, session_id)
+    return codec
+
+
+def round_trip(codec: Codec, datagram: Datagram) -> Datagram:
+    """ Encodes datagram and decodes the frame as a reader would, part by part """
+    frame = codec.encode(datagram)
+    header = frame[:codec.header_size]
+    size = codec.payload_size(header)
+    payload = frame[codec.header_size:codec.header_size + size]
+    body = frame[codec.header_size + size:]
+    assert len(body) == codec.body_size(header, payload)
+    return codec.decode(header, payload, body)
+
+
+def fields(datagram: Datagram) -> tuple:
+    return (
+        datagram.status, datagram.mode, datagram.session_id, datagram.operation, datagram.a, datagram.b,
+        datagram.result, datagram.result_id, datagram.last, datagram.correlation_id
+    )
+
+
+@pytest.mark.parametrize('datagram', [
+    Datagram(Status.NEW, Mode.OPERATION, 7, Operation.BIN_COE, 10.5, -3.25, last=False, correlation_id=12),
+    Datagram(Status.OK, Mode.OPERATION, 7, result=1024.0, result_id=0xFFFFFFFF, correlation_id=0xFFFF),
+    Datagram(Status.OK, Mode.QUERY_BY_SESSION_ID, 7, Operation.LOG, 2.0, 8.0, 3.0, 41, last=False),
+    Datagram(Status.NEW, Mode.QUERY_BY_RESULT_ID, 7, result_id=41, correlation_id=1),
+    Datagram(Status.OK, Mode.QUERY_BY_RESULT_ID, 7, Operation.POWER, 2.0, 0.5, 2 ** 0.5, 5),
+    Datagram(Status.NEW, Mode.RESULT_BLOCK, 7, result_id=100),
+    Datagram(Status.ERROR, Mode.OPERATION, 7, a=Error.INVALID_ARGUMENT),
+    Datagram(Status.REFUSED, Mode.OPERATION, 7, a=Error.OVERLOADED, b=0.125, last=False),
+    Datagram(Status.NEW, Mode.IS_ALIVE, 7),
+    Datagram(Status.OK, Mode.DISCONNECT, 7, correlation_id=3),
+])
+def test_version_2_round_trip(datagram):
+    codec = codec_of(VERSION_2)
+    assert fields(round_trip(codec, datagram)) == fields(datagram)
+
+
+def test_version_2_frames_are_compact():
+    codec = codec_of(VERSION_2)
+    assert len(codec.encode(Datagram(Status.NEW, Mode.IS_ALIVE, 7))) == HEADER.size
+    assert len(codec.encode(Datagram(Status.NEW, Mode.OPERATION, 7, Operation.POWER, 2, 3))) == 21
+    assert len(codec.encode(Datagram(Status.OK, Mode.OPERATION, 7, result=8, result_id=1))) == 16
+
+
+def test_version_1_frame_is_whole_datagram():
+    codec = codec_of(VERSION_1)
+    datagram = Datagram(Status.OK, Mode.QUERY_BY_SESSION_ID, 7, Operation.LOG, 2.0, 8.0, 3.0, 41)
+    assert codec.encode(datagram) == datagram.get_bytes()
+    assert fields(round_trip(codec, datagram)) == fields(datagram)
+
+
+def test_unknown_frames_are_refused():
+    codec = codec_of(VERSION_2)
+    with pytest.raises(ValueError):
+        codec.payload_size(HEADER.pack(0xFF, Status.NEW, 1))
+
+    frame = codec.encode(Datagram(Status.NEW, Mode.OPERATION, 7, Operation.POWER, 2, 3))
+    frame = frame[:HEADER.size] + bytes([Operation.COUNT]) + frame[HEADER.size + 1:]
+    assert codec.peek(frame[:HEADER.size], frame[HEADER.size:]) == (Mode.OPERATION, 0)
+    with pytest.raises(ValueError):
+        codec.decode(frame[:HEADER.size], frame[HEADER.size:])
+
+
+def test_answers_are_filled_in_from_requests():
+    codec = codec_of(VERSION_2)
+    requests = [
+        Datagram(Status.NEW, Mode.OPERATION, 7, Operation.POWER, 2, 10, last=False, correlation_id=5),
+        Datagram(Status.NEW, Mode.OPERATION, 7, Operation.LOG, -1, 2, correlation_id=5),
+    ]
+    answers = [
+        round_trip(codec, Datagram(Status.OK, Mode.OPERATION, 7, result=1024, result_id=1, correlation_id=5)),
+        round_trip(codec, Datagram(Status.ERROR, Mode.OPERATION, 7, a=Error.INVALID_ARGUMENT, correlation_id=5)),
+    ]
+    filled = codec.fill_in(answers, requests)
+    assert (filled[0].operation, filled[0].a, filled[0].b, filled[0].result) == (Operation.POWER, 2, 10, 1024)
+    # error answers keep error code in a
+    assert (filled[1].operation, filled[1].a) == (Operation.LOG, Error.INVALID_ARGUMENT)
+
+    with pytest.raises(ValueError):
+        codec.fill_in([Datagram(Status.OK, Mode.OPERATION, 7, correlation_id=6)], requests)
+
+
+def test_pipelined_frames_are_read_from_stream():
+    codec = codec_of(VERSION_2)
+    datagrams = [
+        Datagram(Status.NEW, Mode.OPERATION, 7, Operation.GEO_MEAN, i, 2 * i, correlation_id=i) for i in range(300)
+    ] + [Datagram(Status.NEW, Mode.IS_ALIVE, 7, correlation_id=300)]
+
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        sender.sendall(b''.join(codec.encode(datagram) for datagram in datagrams))
+        reader = FrameReader(receiver)
+        received = [codec.read(reader) for _ in datagrams]
+    assert [fields(datagram) for datagram in received] == [fields(datagram) for datagram in datagrams]
+
+
+@pytest.fixture(params=['numpy', 'plain'])
+def columns(request, monkeypatch):
+    """ Runs test with column conversions done by NumPy [if installed] and by plain arrays """
+    if request.param == 'plain':
+        monkeypatch.setattr(protocol, 'np', None)
+    elif protocol.np is None:
+        pytest.skip('NumPy is not installed')
+    return request.param
+
+
+def results_of(result_ids, a=2.0, b=3.0, result=0.1) -> list:
+    """ Returns results of storage with given ids """
+    return [(Operation.POWER, a, b, 7, result, result_id) for result_id in result_ids]
+
+
+def block_round_trip(block: ResultBlock) -> (int, ResultBlock):
+    """ Encodes block as v2 frame and reads it back """
+    codec = codec_of(VERSION_2)
+    frame = codec.encode(block)
+    header = frame[:HEADER.size]
+    payload = frame[HEADER.size:HEADER.size + BLOCK.size]
+    body = frame[HEADER.size + BLOCK.size:]
+    assert codec.body_size(header, payload) == len(body)
+    return BLOCK.unpack(payload)[3], codec.decode(header, payload, body)
+
+
+@pytest.mark.parametrize('result_ids, ids_encoding', [
+    (range(100, 1124), 0),
+    ([1, 2, 200, 455, 456], 0),
+    ([1, 2, 200, 456], 1),
+    ([1, 300, 301, 65000], 1),
+    ([5, 70005, 0xFFFFFFFF], 2),
+    ([10, 9, 11], ABSOLUTE_IDS),
+    ([42], 0),
+])
+def test_result_ids_are_sent_as_deltas(columns, result_ids, ids_encoding):
+    block = ResultBlock.from_results(7, results_of(result_ids))
+    encoding, decoded = block_round_trip(block)
+    assert encoding & IDS_MASK == ids_encoding
+    assert list(decoded.result_ids) == list(result_ids)
+
+
+def test_numbers_exact_in_single_precision_are_narrowed(columns):
+    results = [(Operation.BIN_COE, float(i), 2.0, 7, 0.1 * i, i + 1) for i in range(64)]
+    results[3] = (Operation.BIN_COE, 1e300, 2.0, 7, 0.3, 4)
+    encoding, decoded = block_round_trip(ResultBlock.from_results(7, results))
+    assert encoding & FLOAT_B and not encoding & FLOAT_A and not encoding & FLOAT_RESULT
+    assert list(decoded.numbers_a) == [result[1] for result in results]
+    assert list(decoded.numbers_b) == [2.0] * 64
+    assert list(decoded.results) == [result[4] for result in results]
+    assert list(decoded.operations) == [Operation.BIN_COE] * 64
+
+
+def test_block_iterates_as_query_answers(columns):
+    block = ResultBlock.from_results(7, results_of([3, 4, 9]), last=False)
+    _, decoded = block_round_trip(block)
+    answers = list(decoded)
+    assert [(answer.mode, answer.result_id, answer.a, answer.b, answer.result) for answer in answers] == [
+        (Mode.QUERY_BY_SESSION_ID, result_id, 2.0, 3.0, 0.1) for result_id in (3, 4, 9)
+    ]
+    # only the final answer of the last block ends the query
+    assert not any(answer.last for answer in answers)
+    assert [answer.last for answer in ResultBlock.from_results(7, results_of([3, 4]))] == [False, True]
+
+
+def test_block_of_wrong_size_is_refused():
+    first, encoding, body = ResultBlock.from_results(7, results_of(range(1, 11))).encode()
+    with pytest.raises(ValueError):
+        ResultBlock.decode(first, 10, encoding, body[:-1])
+    with pytest.raises(ValueError):
+        ResultBlock.decode(first, 11, encoding, body)
@@ -0,0 +1,173 @@
+import os
+import shutil
+
+import pytest
+
+from common.values import Operation
+from server.result_log import INDEX_RECORD, IndexCheckpoint, RECORD, ResultLog
+
+
+@pytest.fixture
+def directory(tmp_path) -> str:
+    return str(tmp_path)
+
+
+def open_log(directory: str) -> ResultLog:
+    # results are written on flush or close only
+    return ResultLog(directory, flush_interval=60)
+
+
+def add_results(log: ResultLog, session_id: int, result_ids) -> None:
+    """ Adds result of logarithm per id, result n is n / 2 """
+    if not log.has_session(session_id):
+        log.add_session(session_id)
+    for result_id in result_ids:
+        log.add(session_id, result_id, Operation.LOG, 2.0, float(result_id), result_id / 2)
+
+
+def ids_of(results) -> list:
+    return [result[5] for result in results]
+
+
+def state_of(log: ResultLog) -> tuple:
+    """ Returns everything a restarted server can ask the log for """
+    sessions = {session_id: ids_of(log.session_results(session_id)) for session_id in sorted(log.sessions)}
+    return log.next_ids(), len(log), sessions
+
+
+def fill(log: ResultLog) -> None:
+    """ Adds results of sessions which end, are removed, have no results and stay open """
+    add_results(log, 1, range(1, 101))
+    add_results(log, 2, range(101, 151))
+    # ids leased in blocks by two threads arrive out of order
+    add_results(log, 3, [151, 152, 217, 153, 218])
+    add_results(log, 4, [154, 155])
+    log.add_session(5)
+    log.end_session(1)
+    log.remove_session(4)
+    log.end_session(5)
+
+
+def test_results_survive_reopen(directory):
+    log = open_log(directory)
+    fill(log)
+    log.close()
+
+    log = open_log(directory)
+    try:
+        assert state_of(log) == ((6, 219), 155, {1: list(range(1, 101)), 2: list(range(101, 151)),
+                                                 3: [151, 152, 153, 217, 218]})
+        assert log.get(217) == (Operation.LOG, 2.0, 217.0, 3, 108.5, 217)
+        # records of removed session stay in the log, but are not reachable
+        assert log.get(154) is None
+        assert log.get(219) is None
+        assert ids_of(log.session_results(1, after_result_id=50, limit=3)) == [51, 52, 53]
+        assert log.is_session_id_free(4) and log.is_session_id_free(5) and not log.is_session_id_free(2)
+    finally:
+        log.close()
+
+
+def test_session_id_given_again_has_no_results_of_earlier_session(directory):
+    log = open_log(directory)
+    fill(log)
+    log.close()
+
+    log = open_log(directory)
+    try:
+        log.remove_session(2)
+        add_results(log, 2, [300])
+        assert ids_of(log.session_results(2)) == [300]
+        assert len(log) == 106
+    finally:
+        log.close()
+    log = open_log(directory)
+    try:
+        assert ids_of(log.session_results(2)) == [300]
+    finally:
+        log.close()
+
+
+def test_start_replays_index_written_after_checkpoint(directory):
+    log = open_log(directory)
+    fill(log)
+    log.close()
+    # checkpoint of the first run, as if the second one crashed
+    shutil.copy(os.path.join(directory, 'sessions.ckp'), os.path.join(directory, 'first.ckp'))
+    checkpointed = IndexCheckpoint.load(os.path.join(directory, 'first.ckp'), 1 << 30).size
+    assert checkpointed == os.path.getsize(os.path.join(directory, 'sessions.idx'))
+
+    log = open_log(directory)
+    add_results(log, 2, range(400, 410))
+    add_results(log, 6, range(410, 420))
+    log.close()
+    log = open_log(directory)
+    expected = state_of(log)
+    log.close()
+
+    os.replace(os.path.join(directory, 'first.ckp'), os.path.join(directory, 'sessions.ckp'))
+    log = open_log(directory)
+    try:
+        assert log.checkpointed == checkpointed
+        assert state_of(log) == expected
+        assert expected[2][6] == list(range(410, 420))
+    finally:
+        log.close()
+
+
+def test_checkpoints_are_saved_while_index_grows(directory, monkeypatch):
+    monkeypatch.setattr(ResultLog, 'CHECKPOINT_BYTES', 64 * INDEX_RECORD.size)
+    log = open_log(directory)
+    add_results(log, 1, range(1, 1001))
+    log.flush()
+    assert log.checkpointed == log.index.size == 1001 * INDEX_RECORD.size
+    log.close()
+
+    # start without checkpoint reads the whole index
+    os.remove(os.path.join(directory, 'sessions.ckp'))
+    log = open_log(directory)
+    try:
+        assert state_of(log) == ((2, 1001), 1000, {1: list(range(1, 1001))})
+    finally:
+        log.close()
+
+
+def test_stale_checkpoint_is_ignored(directory):
+    log = open_log(directory)
+    fill(log)
+    log.close()
+    # index lost its end [entries of session 3 and later ones], checkpoint covers more than is left [results.log
+    # is whole, so its ids are not given again]
+    index_path = os.path.join(directory, 'sessions.idx')
+    os.truncate(index_path, 152 * INDEX_RECORD.size)
+
+    log = open_log(directory)
+    try:
+        assert log.index.size == 152 * INDEX_RECORD.size
+        assert state_of(log) == ((3, 219), 150, {1: list(range(1, 101)), 2: list(range(101, 151))})
+    finally:
+        log.close()
+
+
+def test_records_torn_by_crash_are_dropped(directory):
+    log = open_log(directory)
+    fill(log)
+    log.close()
+    os.remove(os.path.join(directory, 'sessions.ckp'))
+    # crash while writing the last index entry and a batch of records [its index entries are not written yet]
+    index_path = os.path.join(directory, 'sessions.idx')
+    os.truncate(index_path, os.path.getsize(index_path) - 3)
+    results_path = os.path.join(directory, 'results.log')
+    with open(results_path, 'ab') as results_file:
+        results_file.write(RECORD.pack(219, 3, Operation.LOG, 2.0, 219.0, 109.5)[:20])
+
+    log = open_log(directory)
+    try:
+        assert os.path.getsize(index_path) % INDEX_RECORD.size == 0
+        assert os.path.getsize(results_path) == 218 * RECORD.size
+        # the lost entry removed session 5, so it is an ended session again
+        assert log.has_session(5) and not log.is_session_id_free(5)
+        assert log.get(219) is None
+        assert log.next_ids() == (6, 219)
+        assert ids_of(log.session_results(3)) == [151, 152, 153, 217, 218]
+    finally:
+        log.close()
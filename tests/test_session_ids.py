@@ -0,0 +1,84 @@
+import socket
+import time
+
+import pytest
+
+import netcalc_server
+from client.pool import Connection
+from common.Datagram import Datagram
+from common.values import DATAGRAM_BYTES, Error, Mode, Operation, Status
+from server.ids import IdAllocator
+
+
+def free_port() -> int:
+    """ Returns port nobody listens on at the moment """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def connect(port: int) -> Connection:
+    """ Opens session with server which may be still starting """
+    for _ in range(50):
+        try:
+            return Connection('127.0.0.1', port)
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    raise ConnectionRefusedError('server did not start')
+
+
+def wait_closed(server, connections: int) -> None:
+    """ Waits until server has at most given number of open sessions """
+    deadline = time.monotonic() + 10
+    while len(server.sessions) > connections and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+@pytest.fixture(params=sorted(netcalc_server.ENGINES))
+def server(request, monkeypatch):
+    # four session ids, so they run out quickly
+    monkeypatch.setattr(netcalc_server.Server, 'MAX_SESSION_ID', 4)
+    server = netcalc_server.ENGINES[request.param]('127.0.0.1', free_port())
+    server.start()
+    yield server
+    server.stop()
+    server.join()
+
+
+def test_ids_wrap_around_to_limit():
+    ids = IdAllocator(3, 2, limit=8)
+    assert [ids.next() for _ in range(6)] == [3, 5, 7, 1, 3, 5]
+
+
+def test_ids_of_sessions_without_results_are_given_again(server):
+    first = connect(server.port)
+    first.close()
+    wait_closed(server, 0)
+
+    given = set()
+    for _ in range(8):
+        connection = connect(server.port)
+        given.add(connection.session_id)
+        connection.close()
+        wait_closed(server, 0)
+    assert given <= {1, 2, 3, 4}
+
+
+def test_connect_is_refused_when_all_ids_have_results(server):
+    connections = [connect(server.port) for _ in range(4)]
+    for connection in connections:
+        assert connection.compute(Operation.POWER, 2, 3).status == Status.OK
+    assert sorted(connection.session_id for connection in connections) == [1, 2, 3, 4]
+    for connection in connections:
+        connection.close()
+    wait_closed(server, 0)
+
+    # the server answers instead of dropping the connection
+    with socket.create_connection(('127.0.0.1', server.port), 5) as client:
+        client.sendall(Datagram(Status.NEW, Mode.CONNECT).get_bytes())
+        answer = b''
+        while len(answer) < DATAGRAM_BYTES:
+            answer += client.recv(DATAGRAM_BYTES - len(answer))
+    answer = Datagram.from_bytes(answer)
+    assert answer.status == Status.REFUSED
+    assert answer.a == Error.NO_FREE_SESSION_ID
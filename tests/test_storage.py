@@ -0,0 +1,133 @@
+import pytest
+
+from common.values import Operation
+from server import storage
+from server.retention import RetentionPolicy
+from server.storage import ResultStore
+
+
+class Clock:
+    """ Time of store which goes on only when told to """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(storage, 'monotonic', clock)
+    return clock
+
+
+def add_results(store: ResultStore, session_id: int, result_ids, clock: Clock = None) -> None:
+    """ Adds result of logarithm per id, result n is n / 2 """
+    if not store.has_session(session_id):
+        store.add_session(session_id)
+    for result_id in result_ids:
+        if clock is not None:
+            clock.now += 1
+        store.add(session_id, result_id, Operation.LOG, 2.0, float(result_id), result_id / 2)
+
+
+def ids_of(results) -> list:
+    return [result[5] for result in results]
+
+
+def test_results_with_gaps_in_ids_are_kept_in_order():
+    store = ResultStore(shards=4)
+    # ids leased in blocks by two threads arrive interleaved
+    add_results(store, 1, [1, 2, 65, 3, 66, 4, 70000, 5])
+
+    assert ids_of(store.session_results(1)) == [1, 2, 3, 4, 5, 65, 66, 70000]
+    assert ids_of(store.session_results(1, after_result_id=4, limit=3)) == [5, 65, 66]
+    assert store.get(66) == (Operation.LOG, 2.0, 66.0, 1, 33.0, 66)
+    assert store.get(6) is None
+    assert store.next_ids() == (2, 70001)
+
+
+def test_session_keeps_its_newest_results():
+    store = ResultStore(retention=RetentionPolicy(max_session_results=160))
+    add_results(store, 1, range(1, 161))
+    add_results(store, 2, range(161, 171))
+    assert len(store) == 170
+
+    # limit is exceeded by one, so results are evicted below it by a sixteenth of it
+    add_results(store, 1, [171])
+    assert ids_of(store.session_results(1)) == list(range(12, 161)) + [171]
+    assert store.get(11) is None
+    assert len(store.session_results(2)) == 10
+    assert store.stats() == {'resident': 160, 'spilled': 0, 'evicted': 11}
+
+
+def test_all_sessions_keep_their_newest_results(clock):
+    store = ResultStore(retention=RetentionPolicy(max_results=1024))
+    for session_id in range(1, 5):
+        add_results(store, session_id, range(512 * session_id - 511, 512 * session_id + 1), clock)
+
+    # limit is checked on every GLOBAL_CHECK-th insertion
+    assert len(store) <= 1024 + ResultStore.GLOBAL_CHECK
+    store.expire()
+    assert len(store) <= 1024
+    assert store.get(1) is None and store.get(1024) is None
+    assert store.get(2048) is not None
+    assert ids_of(store.session_results(4))[-1] == 2048
+
+
+def test_old_results_are_evicted(clock):
+    store = ResultStore(retention=RetentionPolicy(max_age=60))
+    add_results(store, 1, range(1, 11), clock)
+    add_results(store, 2, range(11, 21), clock)
+
+    clock.now += 46
+    store.expire()
+    # results added more than a minute ago
+    assert ids_of(store.session_results(1)) == list(range(6, 11))
+    assert ids_of(store.session_results(2)) == list(range(11, 21))
+
+    clock.now += 60
+    store.expire()
+    assert len(store) == 0
+    assert store.stats()['evicted'] == 20
+
+
+def test_evicted_results_are_found_in_spill(tmp_path):
+    store = ResultStore(retention=RetentionPolicy(max_session_results=32, spill_dir=str(tmp_path)))
+    try:
+        add_results(store, 1, range(1, 101))
+        add_results(store, 2, range(101, 111))
+
+        assert len(store.session_results(1)) <= 32
+        # evicted results are read from spill segment, the rest from memory
+        assert [store.get(result_id) for result_id in range(1, 111)] == [
+            (Operation.LOG, 2.0, float(result_id), 1 if result_id <= 100 else 2, result_id / 2, result_id)
+            for result_id in range(1, 111)
+        ]
+        assert store.get(111) is None
+
+        # results of ended session are spilled, so its id is not given again
+        store.end_session(2)
+        assert store.session_results(2) == []
+        assert store.get(105)[5] == 105
+        assert not store.is_session_id_free(2)
+        assert store.stats()['spilled'] == 100 - len(store.session_results(1)) + 10
+    finally:
+        store.close()
+    assert not (tmp_path / 'spilled.seg').exists()
+
+
+def test_ids_of_sessions_without_results_are_free():
+    store = ResultStore()
+    store.add_session(1)
+    add_results(store, 2, [1])
+    assert not store.is_session_id_free(1)
+
+    store.end_session(1)
+    store.end_session(2)
+    # results of ended sessions stay without limits
+    assert store.is_session_id_free(1)
+    assert not store.is_session_id_free(2)
+    assert store.get(1) is not None
@@ -0,0 +1,71 @@
+import random
+from math import inf, isnan, nan
+
+import pytest
+
+from common.values import Operation
+from server.operations import calculate
+from server.vectorized import MAX_EXACT_INTEGER, MIN_VECTORIZED_BATCH, calculate_many
+
+np = pytest.importorskip('numpy')
+
+SPECIAL_NUMBERS = [
+    0.0, -0.0, 1.0, -1.0, 2.0, -2.0, 0.5, -0.5, inf, -inf, nan, 1e308, -1e308, 1e-308,
+    256.0, 257.0, 512.0, 513.0, 1000.0, 1029.0, 1030.0, 1e6, 3.0, 10.0,
+]
+OPERATIONS = (Operation.POWER, Operation.LOG, Operation.GEO_MEAN, Operation.BIN_COE)
+
+
+def random_requests(operation: int, count: int) -> list:
+    """ Returns requests with arguments of all kinds [small, integer, negative, big] """
+    generator = random.Random(operation)
+    requests = []
+    for _ in range(count):
+        kind = generator.random()
+        if kind < 0.3:
+            a, b = generator.uniform(-50, 50), generator.uniform(-50, 50)
+        elif kind < 0.6:
+            a = float(generator.randint(0, 3000))
+            b = float(generator.randint(-5, int(a) + 5))
+        elif kind < 0.8:
+            a, b = generator.uniform(-1e5, 1e5), float(generator.randint(-400, 400))
+        else:
+            a, b = float(generator.randint(0, 10 ** 7)), float(generator.randint(0, 400))
+        requests.append((operation, a, b))
+    return requests
+
+
+@pytest.mark.parametrize('operation', OPERATIONS)
+def test_batch_gives_results_of_calculate(operation):
+    requests = [(operation, a, b) for a in SPECIAL_NUMBERS for b in SPECIAL_NUMBERS]
+    requests += random_requests(operation, 5000)
+
+    for request, (result, error) in zip(requests, calculate_many(requests)):
+        expected, expected_error = calculate(*request)
+        assert error == expected_error, request
+        if error is not None:
+            assert result is None
+        elif isnan(expected):
+            assert isnan(result), request
+        else:
+            assert result == pytest.approx(expected, rel=1e-11, abs=0), request
+
+
+def test_binomial_coefficients_of_batch_are_exact_up_to_max_exact_integer():
+    requests = [(Operation.BIN_COE, float(n), float(k)) for n in range(0, 300, 7) for k in range(0, n + 1, 3)]
+    requests += [(Operation.BIN_COE, 2.0 ** 53 + 2, 2.0), (Operation.BIN_COE, 1e15, 3.0)]
+    for request, (result, _) in zip(requests, calculate_many(requests)):
+        expected, _ = calculate(*request)
+        if expected <= MAX_EXACT_INTEGER:
+            assert result == expected, request
+
+
+def test_mixed_batch_keeps_order_of_requests():
+    requests = [(OPERATIONS[i % 4], float(i % 13 + 2), float(i % 5)) for i in range(MIN_VECTORIZED_BATCH * 4)]
+    expected = [calculate(*request) for request in requests]
+    answers = calculate_many(requests)
+    assert [error for _, error in answers] == [error for _, error in expected]
+    assert [result for result, _ in answers] == pytest.approx([result for result, _ in expected], rel=1e-11)
+
+    # small batch is calculated one by one
+    assert calculate_many(requests[:3]) == expected[:3]